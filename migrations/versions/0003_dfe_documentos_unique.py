@@ -0,0 +1,32 @@
+"""unique (empresa_id, nsu, schema) on dfe_documentos"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_dfe_documentos_unique"; down_revision = "0002_manifest_columns"; branch_labels=None; depends_on=None
+
+def upgrade():
+    # Preservar a manifestação mais recente antes de remover duplicatas (mantém o menor id)
+    op.execute("""
+        UPDATE dfe_documentos k SET
+            manifest_tp = m.manifest_tp, manifest_nseq = m.manifest_nseq, manifest_cstat = m.manifest_cstat,
+            manifest_xmotivo = m.manifest_xmotivo, manifest_xml_path = m.manifest_xml_path,
+            manifest_updated_at = m.manifest_updated_at
+        FROM (
+            SELECT DISTINCT ON (empresa_id, nsu, schema) *
+            FROM dfe_documentos WHERE manifest_updated_at IS NOT NULL
+            ORDER BY empresa_id, nsu, schema, manifest_updated_at DESC
+        ) m
+        WHERE k.id = (SELECT min(d.id) FROM dfe_documentos d
+                      WHERE d.empresa_id = m.empresa_id AND d.nsu = m.nsu AND d.schema = m.schema)
+    """)
+    op.execute("""
+        DELETE FROM dfe_documentos a USING dfe_documentos b
+        WHERE a.empresa_id = b.empresa_id AND a.nsu = b.nsu AND a.schema = b.schema AND a.id > b.id
+    """)
+    op.create_index("uq_dfe_empresa_nsu_schema", "dfe_documentos", ["empresa_id","nsu","schema"], unique=True)
+    # (empresa_id, nsu) passa a ser prefixo do índice único
+    op.drop_index("ix_dfe_empresa_nsu", table_name="dfe_documentos")
+
+def downgrade():
+    op.create_index("ix_dfe_empresa_nsu", "dfe_documentos", ["empresa_id","nsu"])
+    op.drop_index("uq_dfe_empresa_nsu_schema", table_name="dfe_documentos")
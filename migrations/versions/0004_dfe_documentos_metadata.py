@@ -0,0 +1,28 @@
+"""materialized metadata columns on dfe_documentos"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_dfe_documentos_metadata"; down_revision = "0003_dfe_documentos_unique"; branch_labels=None; depends_on=None
+
+def upgrade():
+    op.add_column("dfe_documentos", sa.Column("emitente_cnpj", sa.String(14)))
+    op.add_column("dfe_documentos", sa.Column("emitente_nome", sa.String(200)))
+    op.add_column("dfe_documentos", sa.Column("data_emissao", sa.Date))
+    op.add_column("dfe_documentos", sa.Column("valor", sa.Numeric(15, 2)))
+    op.add_column("dfe_documentos", sa.Column("uf", sa.String(2)))
+    op.add_column("dfe_documentos", sa.Column("destinatario_cnpj", sa.String(14)))
+    op.add_column("dfe_documentos", sa.Column("tp_evento", sa.String(6)))
+    op.create_index("ix_dfe_empresa_data_emissao", "dfe_documentos", ["empresa_id","data_emissao"])
+    op.create_index("ix_dfe_empresa_emitente", "dfe_documentos", ["empresa_id","emitente_cnpj"])
+    # Linhas existentes: python -m src.jobs.backfill_metadata
+
+def downgrade():
+    op.drop_index("ix_dfe_empresa_emitente", table_name="dfe_documentos")
+    op.drop_index("ix_dfe_empresa_data_emissao", table_name="dfe_documentos")
+    op.drop_column("dfe_documentos", "tp_evento")
+    op.drop_column("dfe_documentos", "destinatario_cnpj")
+    op.drop_column("dfe_documentos", "uf")
+    op.drop_column("dfe_documentos", "valor")
+    op.drop_column("dfe_documentos", "data_emissao")
+    op.drop_column("dfe_documentos", "emitente_nome")
+    op.drop_column("dfe_documentos", "emitente_cnpj")
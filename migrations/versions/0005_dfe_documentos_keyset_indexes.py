@@ -0,0 +1,30 @@
+"""composite indexes for keyset pagination and document filters"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005_dfe_documentos_keyset_indexes"; down_revision = "0004_dfe_documentos_metadata"; branch_labels=None; depends_on=None
+
+def upgrade():
+    # Todas terminam em id: o filtro + ORDER BY id DESC + "id < cursor" percorrem o índice sem ordenar
+    op.create_index("ix_dfe_empresa_id", "dfe_documentos", ["empresa_id","id"])
+    op.create_index("ix_dfe_empresa_schema_id", "dfe_documentos", ["empresa_id","schema","id"])
+    op.drop_index("ix_dfe_empresa_data_emissao", table_name="dfe_documentos")
+    op.create_index("ix_dfe_empresa_data_emissao_id", "dfe_documentos", ["empresa_id","data_emissao","id"])
+    op.drop_index("ix_dfe_empresa_emitente", table_name="dfe_documentos")
+    op.create_index("ix_dfe_empresa_emitente_id", "dfe_documentos", ["empresa_id","emitente_cnpj","id"])
+    op.create_index("ix_dfe_empresa_valor", "dfe_documentos", ["empresa_id","valor"])
+    op.create_index("ix_dfe_empresa_manifest_id", "dfe_documentos", ["empresa_id","manifest_tp","id"])
+    # Prefixo de chave (LIKE '3525%') independente da collation
+    op.create_index("ix_dfe_empresa_chave_prefix", "dfe_documentos", ["empresa_id","chave"],
+                    postgresql_ops={"chave": "varchar_pattern_ops"})
+
+def downgrade():
+    op.drop_index("ix_dfe_empresa_chave_prefix", table_name="dfe_documentos")
+    op.drop_index("ix_dfe_empresa_manifest_id", table_name="dfe_documentos")
+    op.drop_index("ix_dfe_empresa_valor", table_name="dfe_documentos")
+    op.drop_index("ix_dfe_empresa_emitente_id", table_name="dfe_documentos")
+    op.create_index("ix_dfe_empresa_emitente", "dfe_documentos", ["empresa_id","emitente_cnpj"])
+    op.drop_index("ix_dfe_empresa_data_emissao_id", table_name="dfe_documentos")
+    op.create_index("ix_dfe_empresa_data_emissao", "dfe_documentos", ["empresa_id","data_emissao"])
+    op.drop_index("ix_dfe_empresa_schema_id", table_name="dfe_documentos")
+    op.drop_index("ix_dfe_empresa_id", table_name="dfe_documentos")
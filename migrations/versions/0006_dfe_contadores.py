@@ -0,0 +1,30 @@
+"""per-company document counters"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006_dfe_contadores"; down_revision = "0005_dfe_documentos_keyset_indexes"; branch_labels=None; depends_on=None
+
+def upgrade():
+    op.create_table("dfe_contadores",
+        sa.Column("empresa_id", sa.Integer, sa.ForeignKey("empresas.id"), primary_key=True),
+        sa.Column("categoria", sa.String(20), primary_key=True),
+        sa.Column("total", sa.BigInteger, nullable=False, server_default="0"),
+    )
+    # Carga inicial a partir dos documentos existentes (mesmas regras de src/core/counters.py)
+    op.execute("""
+        INSERT INTO dfe_contadores (empresa_id, categoria, total)
+        SELECT empresa_id,
+               CASE WHEN schema LIKE 'procNFe%' THEN 'registradas'
+                    WHEN schema LIKE 'resNFe%' THEN 'pendentes'
+                    ELSE 'eventos' END,
+               count(*)
+        FROM dfe_documentos GROUP BY 1, 2
+    """)
+    op.execute("""
+        INSERT INTO dfe_contadores (empresa_id, categoria, total)
+        SELECT empresa_id, 'manifestadas', count(*)
+        FROM dfe_documentos WHERE manifest_cstat IN ('135','136') GROUP BY 1
+    """)
+
+def downgrade():
+    op.drop_table("dfe_contadores")
@@ -0,0 +1,27 @@
+"""persistent per-company sync schedule"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007_dfe_agenda"; down_revision = "0006_dfe_contadores"; branch_labels=None; depends_on=None
+
+def upgrade():
+    op.create_table("dfe_agenda",
+        sa.Column("empresa_id", sa.Integer, sa.ForeignKey("empresas.id"), primary_key=True),
+        sa.Column("next_allowed_at", sa.DateTime, nullable=True),
+        sa.Column("last_run_at", sa.DateTime, nullable=True),
+        sa.Column("last_cstat", sa.String(6), nullable=True),
+        sa.Column("last_reason", sa.String(30), nullable=True),
+        sa.Column("consecutive_errors", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("ix_dfe_agenda_next_allowed_at", "dfe_agenda", ["next_allowed_at"])
+    # Empresas já em dia (ultNSU == maxNSU) começam segurando 1 h: o deploy não gera rajada de consultas ociosas
+    op.execute("""
+        INSERT INTO dfe_agenda (empresa_id, next_allowed_at, last_reason, consecutive_errors, updated_at)
+        SELECT empresa_id, (now() at time zone 'utc') + interval '1 hour', 'idle', 0, now() at time zone 'utc'
+        FROM cursor_dfe WHERE ultimo_nsu = max_nsu AND ultimo_nsu <> '000000000000000'
+    """)
+
+def downgrade():
+    op.drop_index("ix_dfe_agenda_next_allowed_at", table_name="dfe_agenda")
+    op.drop_table("dfe_agenda")
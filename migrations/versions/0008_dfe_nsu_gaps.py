@@ -0,0 +1,30 @@
+"""persistent NSU gap ledger"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008_dfe_nsu_gaps"; down_revision = "0007_dfe_agenda"; branch_labels=None; depends_on=None
+
+def upgrade():
+    op.create_table("dfe_nsu_gaps",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("empresa_id", sa.Integer, sa.ForeignKey("empresas.id"), nullable=False),
+        sa.Column("nsu_ini", sa.BigInteger, nullable=False),
+        sa.Column("nsu_fim", sa.BigInteger, nullable=False),
+        sa.Column("next_nsu", sa.BigInteger, nullable=False),
+        sa.Column("status", sa.String(12), nullable=False, server_default="pendente"),
+        sa.Column("recovered", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("empty", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("last_cstat", sa.String(6), nullable=True),
+        sa.Column("last_error", sa.Text, nullable=True),
+        sa.Column("next_attempt_at", sa.DateTime, nullable=True),
+        sa.Column("created_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("uq_dfe_gap_empresa_ini", "dfe_nsu_gaps", ["empresa_id","nsu_ini"], unique=True)
+    op.create_index("ix_dfe_gap_empresa_status", "dfe_nsu_gaps", ["empresa_id","status","nsu_ini"])
+
+def downgrade():
+    op.drop_index("ix_dfe_gap_empresa_status", table_name="dfe_nsu_gaps")
+    op.drop_index("uq_dfe_gap_empresa_ini", table_name="dfe_nsu_gaps")
+    op.drop_table("dfe_nsu_gaps")
@@ -0,0 +1,34 @@
+"""background sync job queue"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009_dfe_jobs"; down_revision = "0008_dfe_nsu_gaps"; branch_labels=None; depends_on=None
+
+def upgrade():
+    op.create_table("dfe_jobs",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("empresa_id", sa.Integer, sa.ForeignKey("empresas.id"), nullable=False),
+        sa.Column("status", sa.String(12), nullable=False, server_default="fila"),
+        sa.Column("force", sa.Boolean, nullable=False, server_default=sa.false()),
+        sa.Column("processed", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("pages", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("start_nsu", sa.String(20), nullable=True),
+        sa.Column("ult_nsu", sa.String(20), nullable=True),
+        sa.Column("max_nsu", sa.String(20), nullable=True),
+        sa.Column("result", sa.JSON, nullable=True),
+        sa.Column("error", sa.Text, nullable=True),
+        sa.Column("created_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sa.Column("started_at", sa.DateTime, nullable=True),
+        sa.Column("finished_at", sa.DateTime, nullable=True),
+        sa.Column("updated_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("ix_dfe_jobs_status_id", "dfe_jobs", ["status","id"])
+    op.create_index("ix_dfe_jobs_empresa_id", "dfe_jobs", ["empresa_id","id"])
+    op.create_index("uq_dfe_jobs_empresa_ativo", "dfe_jobs", ["empresa_id"], unique=True,
+                    postgresql_where=sa.text("status IN ('fila', 'executando')"))
+
+def downgrade():
+    op.drop_index("uq_dfe_jobs_empresa_ativo", table_name="dfe_jobs")
+    op.drop_index("ix_dfe_jobs_empresa_id", table_name="dfe_jobs")
+    op.drop_index("ix_dfe_jobs_status_id", table_name="dfe_jobs")
+    op.drop_table("dfe_jobs")
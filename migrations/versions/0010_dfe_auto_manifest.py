@@ -0,0 +1,30 @@
+"""auto-manifest pipeline (Ciência + procNFe fetch)"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010_dfe_auto_manifest"; down_revision = "0009_dfe_jobs"; branch_labels=None; depends_on=None
+
+def upgrade():
+    op.create_table("dfe_auto_manifest",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("empresa_id", sa.Integer, sa.ForeignKey("empresas.id"), nullable=False),
+        sa.Column("chave", sa.String(44), nullable=False),
+        sa.Column("doc_id", sa.Integer, sa.ForeignKey("dfe_documentos.id"), nullable=False),
+        sa.Column("status", sa.String(12), nullable=False, server_default="ciencia"),
+        sa.Column("ciencia_cstat", sa.String(6), nullable=True),
+        sa.Column("ciencia_at", sa.DateTime, nullable=True),
+        sa.Column("proc_doc_id", sa.Integer, sa.ForeignKey("dfe_documentos.id"), nullable=True),
+        sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("last_cstat", sa.String(6), nullable=True),
+        sa.Column("last_error", sa.Text, nullable=True),
+        sa.Column("next_attempt_at", sa.DateTime, nullable=True),
+        sa.Column("created_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("uq_dfe_auto_manifest_empresa_chave", "dfe_auto_manifest", ["empresa_id","chave"], unique=True)
+    op.create_index("ix_dfe_auto_manifest_empresa_status", "dfe_auto_manifest", ["empresa_id","status","next_attempt_at"])
+
+def downgrade():
+    op.drop_index("ix_dfe_auto_manifest_empresa_status", table_name="dfe_auto_manifest")
+    op.drop_index("uq_dfe_auto_manifest_empresa_chave", table_name="dfe_auto_manifest")
+    op.drop_table("dfe_auto_manifest")
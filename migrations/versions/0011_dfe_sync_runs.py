@@ -0,0 +1,33 @@
+"""per-run sync history with per-stage page timings"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011_dfe_sync_runs"; down_revision = "0010_dfe_auto_manifest"; branch_labels=None; depends_on=None
+
+def upgrade():
+    op.create_table("dfe_sync_runs",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("empresa_id", sa.Integer, sa.ForeignKey("empresas.id"), nullable=False),
+        sa.Column("job_id", sa.Integer, sa.ForeignKey("dfe_jobs.id"), nullable=True),
+        sa.Column("origem", sa.String(12), nullable=False, server_default="agendador"),
+        sa.Column("ok", sa.Boolean, nullable=False, server_default=sa.true()),
+        sa.Column("reason", sa.String(40), nullable=True),
+        sa.Column("cstat", sa.String(6), nullable=True),
+        sa.Column("processed", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("pages", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("start_nsu", sa.String(20), nullable=True),
+        sa.Column("ult_nsu", sa.String(20), nullable=True),
+        sa.Column("max_nsu", sa.String(20), nullable=True),
+        sa.Column("duration_ms", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("stages", sa.JSON, nullable=True),
+        sa.Column("trace", sa.JSON, nullable=True),
+        sa.Column("started_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+        sa.Column("finished_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("ix_dfe_sync_runs_empresa_id", "dfe_sync_runs", ["empresa_id","id"])
+    op.create_index("ix_dfe_sync_runs_started_at", "dfe_sync_runs", ["started_at"])
+
+def downgrade():
+    op.drop_index("ix_dfe_sync_runs_started_at", table_name="dfe_sync_runs")
+    op.drop_index("ix_dfe_sync_runs_empresa_id", table_name="dfe_sync_runs")
+    op.drop_table("dfe_sync_runs")
@@ -1,8 +1,22 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from .routes import health, empresas, dfe, documentos, nfe_publica_sp
-app = FastAPI(title="DF-e Sync (NSU) + NFSe adapters", version="0.1.0")
+from contextlib import asynccontextmanager
+from .routes import health, metrics, empresas, dfe, documentos, nfe_publica_sp
+from src.ws import async_transport
+from src.core import jobs
+from src.settings import settings
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	# workers da fila de sincronização (POST /api/dfe/sync); 0 = só o processo src.jobs.sync_worker
+	jobs.start_workers(settings.DFE_JOB_WORKERS)
+	yield
+	jobs.stop_workers()
+	# fecha os clientes httpx (keep-alive mTLS) das rotas async
+	await async_transport.aclose_all()
+
+app = FastAPI(title="DF-e Sync (NSU) + NFSe adapters", version="0.1.0", lifespan=lifespan)
 
 # CORS: permitir UI local (ajuste se necessário)
 app.add_middleware(
@@ -18,6 +32,7 @@ app.add_middleware(
 	allow_headers=["*"],
 )
 app.include_router(health.router)
+app.include_router(metrics.router, tags=["Métricas"])
 app.include_router(empresas.router, prefix="/api", tags=["Empresas"])
 app.include_router(dfe.router, prefix="/api", tags=["DF-e"])
 app.include_router(documentos.router, prefix="/api", tags=["Documentos"])
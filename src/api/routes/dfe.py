@@ -1,25 +1,61 @@
 from fastapi import APIRouter, HTTPException, Query
-from sqlalchemy import select, update
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from sqlalchemy import select, func
+from datetime import datetime
 from src.store.db import SessionLocal
-from src.models import Empresa, Certificado, CursorDFe, DFEDocumento
-from src.cert.pfx_utils import pfx_to_pem_tempfiles, pfx_extract_cnpj_cpf
-from src.core.dfe_sync import run_distribution
-import os, certifi
-from src.ws.dfe_client import nfe_distribuicao_dfe, nfe_consultar_nsu, nfe_consultar_chave
-from src.ws.manifest_client import enviar_manifestacao
+from src.store.xml_store import put_xml
+from src.models import Empresa, CursorDFe, DFEDocumento
+from src.cert import cert_manager
+from src.core import agenda, nsu_gaps, jobs, manifest_store, auto_manifest, sync_runs
+from src.core.counters import MANIFEST_OK_CSTATS
+import certifi
+from src.ws.dfe_client import nfe_distribuicao_dfe_async, nfe_consultar_nsu_async, nfe_consultar_chave_async
+from src.ws.dist_response import doc_xml
+from src.ws.manifest_client import enviar_manifestacao_async, enviar_manifestacao_lote_async, DESC_EVENTO
 from src.settings import settings
 
 router = APIRouter()
 
-def _load_cert_tuple(empresa_id:int):
+# Rotas que chamam o AN/SEFAZ são async (src.ws.async_transport): a espera pela rede não
+# ocupa thread do servidor; banco, certificado e arquivos vão para o threadpool.
+
+def _load_cert(empresa_id:int):
+    """Empresa e certificado A1 decifrado (em cache, ver src.cert.cert_manager)."""
     with SessionLocal() as db:
-        cert = db.execute(select(Certificado).where(Certificado.empresa_id==empresa_id)).scalar_one_or_none()
         emp  = db.execute(select(Empresa).where(Empresa.id==empresa_id)).scalar_one_or_none()
-        if not emp: raise HTTPException(404,"Empresa nÃ£o encontrada")
-        if not cert: raise HTTPException(400,"Certificado nÃ£o cadastrado")
-        pfx = open(cert.pfx_path,"rb").read()
-        cert_path, key_path = pfx_to_pem_tempfiles(pfx, cert.senha_cripto)
-        return (emp, cert_path, key_path)
+    if not emp: raise HTTPException(404,"Empresa nÃ£o encontrada")
+    lc = cert_manager.get(empresa_id)
+    if not lc: raise HTTPException(400,"Certificado nÃ£o cadastrado")
+    return emp, lc
+
+def _check_cert_owner(emp, lc):
+    # Validação H04/H05: CNPJ consultado deve bater com CNPJ-base do certificado
+    if lc.tipo == "CNPJ" and (emp.cnpj or '').strip()[:8] != (lc.doc or '')[:8]:
+        raise HTTPException(422, "CNPJ consultado difere do CNPJ-base do certificado (H04)")
+
+def _persist_manifest(cnpj:str, empresa_id:int, chNFe:str, tpEvento:str, nSeq:int, res:dict) -> str|None:
+    """Persiste o resultado no documento mais recente com esta chave (se existir); devolve o
+    caminho do XML de resposta salvo."""
+    saved_path = None
+    try:
+        with SessionLocal() as db:
+            doc_id = db.execute(select(func.max(DFEDocumento.id)).where(DFEDocumento.empresa_id==empresa_id, DFEDocumento.chave==chNFe)).scalar()
+            if doc_id:
+                saved_path = manifest_store.save_response(cnpj, chNFe, tpEvento, nSeq, res.get("resp_xml"))
+                manifest_store.update_manifest(db, doc_id, tpEvento, nSeq, res, saved_path)
+                db.commit()
+    except Exception:
+        pass
+    return saved_path
+
+def _persist_manifest_lote(cnpj:str, empresa_id:int, results:list[dict]) -> dict[tuple[str, str, int], str|None]:
+    """Versão em lote de ``_persist_manifest`` (um único UPDATE); devolve (chave, tpEvento, nSeq) -> caminho do XML salvo."""
+    with SessionLocal() as db:
+        saved = manifest_store.update_lote(db, cnpj, empresa_id, results)
+        db.commit()
+    return saved
 
 @router.get("/dfe/cursor")
 def get_cursor(empresa_id:int=Query(...)):
@@ -28,219 +64,203 @@ def get_cursor(empresa_id:int=Query(...)):
         if not cur: raise HTTPException(404,"Cursor nÃ£o encontrado")
         return {"empresa_id":empresa_id,"ultimo_nsu":cur.ultimo_nsu,"max_nsu":cur.max_nsu,"updated_at":str(cur.updated_at)}
 
+def _agenda_row(empresa_id:int):
+    with SessionLocal() as db:
+        return agenda.get(db, empresa_id)
+
 @router.post("/dfe/sync")
-def sync_now(empresa_id:int=Query(...)):
-    cert_tuple = None
-    try:
-        emp, cert_path, key_path = _load_cert_tuple(empresa_id)
-        cert_tuple = (cert_path, key_path)
-        # Validação H04/H05: CNPJ consultado deve bater com CNPJ-base do certificado (usando PFX original)
-        with SessionLocal() as db:
-            cert = db.execute(select(Certificado).where(Certificado.empresa_id==empresa_id)).scalar_one()
-            pfx_bytes = open(cert.pfx_path,'rb').read()
-            tipo, doc = pfx_extract_cnpj_cpf(pfx_bytes, cert.senha_cripto)
-            if tipo == "CNPJ":
-                if (emp.cnpj or '').strip()[:8] != (doc or '')[:8]:
-                    raise HTTPException(422, "CNPJ consultado difere do CNPJ-base do certificado (H04)")
-            elif tipo == "CPF":
-                raise HTTPException(422, "Certificado PF não suportado neste endpoint")
-        verify = certifi.where()  # ou bundle ICP-Brasil
-        res = run_distribution(emp.id, emp.cnpj, cert_tuple, verify)
-        return res
-    finally:
-        if cert_tuple:
-            for p in cert_tuple:
-                try:
-                    if p and os.path.exists(p): os.remove(p)
-                except: pass
+async def sync_now(empresa_id:int=Query(...), force:bool=Query(False)):
+    """Enfileira a sincronização (dfe_jobs) e devolve o job; um job já em fila/execução da
+    empresa é reaproveitado. Acompanhe em GET /api/dfe/jobs/{id}."""
+    emp, lc = await run_in_threadpool(_load_cert, empresa_id)
+    _check_cert_owner(emp, lc)
+    if lc.tipo == "CPF":
+        raise HTTPException(422, "Certificado PF não suportado neste endpoint")
+    # Mesma agenda do agendador (dfe_agenda); force ignora a espera de ociosidade/erro, nunca a do 656
+    row = await run_in_threadpool(_agenda_row, empresa_id)
+    wait = agenda.hold_sec(row, datetime.utcnow(), force)
+    if wait:
+        return JSONResponse(status_code=429, headers={"Retry-After": str(wait)},
+                            content={"ok": False, "skipped": True, "retry_after_sec": wait, **agenda.as_dict(row)})
+    job, created = await run_in_threadpool(jobs.enqueue, emp.id, force)
+    return JSONResponse(status_code=202, headers={"Location": f"/api/dfe/jobs/{job['id']}"},
+                        content={"ok": True, "job_id": job["id"], "deduplicated": not created, "job": job})
+
+@router.get("/dfe/jobs/{job_id}")
+def get_job(job_id:int):
+    """Situação e progresso do job: documentos processados, NSU atual vs maxNSU, taxa e ETA."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job não encontrado")
+    return job
+
+@router.get("/dfe/jobs")
+def list_jobs(empresa_id:int=Query(...), limit:int=Query(20, ge=1, le=200)):
+    return {"empresa_id": empresa_id, "jobs": jobs.recent(empresa_id, limit)}
+
+@router.get("/dfe/runs/{run_id}")
+def get_run(run_id:int):
+    """Execução de run_distribution com o tempo por etapa de cada página (dfe_sync_runs)."""
+    run = sync_runs.get(run_id)
+    if run is None:
+        raise HTTPException(404, "Execução não encontrada")
+    return run
+
+@router.get("/dfe/runs")
+def list_runs(empresa_id:int=Query(...), limit:int=Query(20, ge=1, le=200)):
+    """Últimas execuções da empresa (agendador e jobs da API) com os totais por etapa."""
+    return {"empresa_id": empresa_id, "runs": sync_runs.recent(empresa_id, limit)}
+
+@router.get("/dfe/gaps")
+def get_gaps(empresa_id:int=Query(...), limit:int=Query(100, ge=1, le=1000)):
+    """Lacunas de NSU da empresa (dfe_nsu_gaps): resumo por situação e intervalos em aberto."""
+    with SessionLocal() as db:
+        return nsu_gaps.status(db, empresa_id, limit)
+
+@router.get("/dfe/auto-manifest")
+def get_auto_manifest(empresa_id:int=Query(...), status:str|None=Query(None, description="ciencia|aguardando|concluida|falha"),
+                      limit:int=Query(100, ge=1, le=1000)):
+    """Manifestação automática da empresa (dfe_auto_manifest): resumo por situação e notas
+    (por padrão, as ainda não concluídas)."""
+    if status and status not in auto_manifest.STATUSES:
+        raise HTTPException(422, f"status inválido: {status}")
+    with SessionLocal() as db:
+        return auto_manifest.status(db, empresa_id, status, limit)
+
+@router.post("/dfe/auto-manifest/retry")
+def retry_auto_manifest(empresa_id:int=Query(...)):
+    """Devolve as notas em falha à etapa em que pararam; seguem no próximo ciclo da empresa."""
+    with SessionLocal() as db:
+        n = auto_manifest.retry_failed(db, empresa_id)
+        db.commit()
+    return {"empresa_id": empresa_id, "requeued": n}
 
 @router.get("/dfe/diagnose")
-def diagnose(empresa_id:int=Query(...), ult_nsu:str=Query("000000000000000")):
+async def diagnose(empresa_id:int=Query(...), ult_nsu:str=Query("000000000000000")):
     """Executa UMA chamada ao serviço de distribuição para diagnóstico sem loop.
     Retorna cStat, xMotivo, ultNSU, maxNSU, quantidade de docs e tempo.
     """
-    cert_tuple = None
-    try:
-        emp, cert_path, key_path = _load_cert_tuple(empresa_id)
-        cert_tuple = (cert_path, key_path)
-        with SessionLocal() as db:
-            cert = db.execute(select(Certificado).where(Certificado.empresa_id==empresa_id)).scalar_one()
-            pfx_bytes = open(cert.pfx_path,'rb').read()
-            tipo, doc = pfx_extract_cnpj_cpf(pfx_bytes, cert.senha_cripto)
-            if tipo == "CNPJ" and (emp.cnpj or '')[:8] != (doc or '')[:8]:
-                raise HTTPException(422, "CNPJ consultado difere do CNPJ-base do certificado (H04)")
-        verify = settings.DFE_CA_BUNDLE if settings.DFE_CA_BUNDLE else certifi.where()
-        res = nfe_distribuicao_dfe(emp.cnpj, ult_nsu, cert_tuple, verify)
-        if 'error' in res:
-            raise HTTPException(502, f"Erro chamada WS: {res.get('detail')}")
-        docs = res.get("docs") or []
-        by_schema = {}
-        for d in docs:
-            sch = d.get("schema") or "?"
-            by_schema[sch] = by_schema.get(sch, 0) + 1
-        return {
-            "cStat":res.get("cStat"),
-            "xMotivo":res.get("xMotivo"),
-            "ultNSU":res.get("ultNSU"),
-            "maxNSU":res.get("maxNSU"),
-            "docs_count": len(docs),
-            "by_schema": by_schema,
-            "elapsed": res.get("elapsed")
-        }
-    finally:
-        if cert_tuple:
-            for p in cert_tuple:
-                try:
-                    if p and os.path.exists(p): os.remove(p)
-                except: pass
+    emp, lc = await run_in_threadpool(_load_cert, empresa_id)
+    _check_cert_owner(emp, lc)
+    verify = settings.DFE_CA_BUNDLE if settings.DFE_CA_BUNDLE else certifi.where()
+    res = await nfe_distribuicao_dfe_async(emp.cnpj, ult_nsu, lc.cert_tuple, verify)
+    if 'error' in res:
+        raise HTTPException(502, f"Erro chamada WS: {res.get('detail')}")
+    docs = res.get("docs") or []
+    by_schema = {}
+    for d in docs:
+        sch = d.get("schema") or "?"
+        by_schema[sch] = by_schema.get(sch, 0) + 1
+    return {
+        "cStat":res.get("cStat"),
+        "xMotivo":res.get("xMotivo"),
+        "ultNSU":res.get("ultNSU"),
+        "maxNSU":res.get("maxNSU"),
+        "docs_count": len(docs),
+        "by_schema": by_schema,
+        "elapsed": res.get("elapsed")
+    }
 
 @router.get("/dfe/consnsu")
-def cons_nsu(empresa_id:int=Query(...), nsu:str=Query(...)):
+async def cons_nsu(empresa_id:int=Query(...), nsu:str=Query(...)):
     """Consulta pontual por NSU faltante (consNSU), conforme NT 2014/002.
     Retorna cStat, xMotivo e, se localizado, o(s) documento(s) em docZip (decodificados) com schema e NSU.
     """
-    cert_tuple = None
-    try:
-        emp, cert_path, key_path = _load_cert_tuple(empresa_id)
-        cert_tuple = (cert_path, key_path)
-        with SessionLocal() as db:
-            cert = db.execute(select(Certificado).where(Certificado.empresa_id==empresa_id)).scalar_one()
-            pfx_bytes = open(cert.pfx_path,'rb').read()
-            tipo, doc = pfx_extract_cnpj_cpf(pfx_bytes, cert.senha_cripto)
-            if tipo == "CNPJ" and (emp.cnpj or '')[:8] != (doc or '')[:8]:
-                raise HTTPException(422, "CNPJ consultado difere do CNPJ-base do certificado (H04)")
-        verify = settings.DFE_CA_BUNDLE if settings.DFE_CA_BUNDLE else certifi.where()
-        res = nfe_consultar_nsu(emp.cnpj, nsu, cert_tuple, verify)
-        if 'error' in res:
-            raise HTTPException(502, f"Erro chamada WS: {res.get('detail')}")
-        # não retornar XML completo no corpo para evitar payload grande; retornar apenas metadados
-        meta = [{"nsu": d.get("nsu"), "schema": d.get("schema"), "xml_size": len(d.get("xml") or b"")} for d in (res.get("docs") or [])]
-        return {
-            "cStat": res.get("cStat"),
-            "xMotivo": res.get("xMotivo"),
-            "ultNSU": res.get("ultNSU"),
-            "maxNSU": res.get("maxNSU"),
-            "docs": meta,
-            "elapsed": res.get("elapsed"),
-        }
-    finally:
-        if cert_tuple:
-            for p in cert_tuple:
-                try:
-                    if p and os.path.exists(p): os.remove(p)
-                except: pass
+    emp, lc = await run_in_threadpool(_load_cert, empresa_id)
+    _check_cert_owner(emp, lc)
+    verify = settings.DFE_CA_BUNDLE if settings.DFE_CA_BUNDLE else certifi.where()
+    res = await nfe_consultar_nsu_async(emp.cnpj, nsu, lc.cert_tuple, verify)
+    if 'error' in res:
+        raise HTTPException(502, f"Erro chamada WS: {res.get('detail')}")
+    # não retornar XML completo no corpo para evitar payload grande; retornar apenas metadados
+    meta = [{"nsu": d.get("nsu"), "schema": d.get("schema"), "xml_size": len(doc_xml(d))} for d in (res.get("docs") or [])]
+    return {
+        "cStat": res.get("cStat"),
+        "xMotivo": res.get("xMotivo"),
+        "ultNSU": res.get("ultNSU"),
+        "maxNSU": res.get("maxNSU"),
+        "docs": meta,
+        "elapsed": res.get("elapsed"),
+    }
 
 @router.get("/dfe/conschave")
-def cons_chave(empresa_id:int=Query(...), chNFe:str=Query(..., min_length=44, max_length=44)):
+async def cons_chave(empresa_id:int=Query(...), chNFe:str=Query(..., min_length=44, max_length=44)):
     """Consulta por chave específica (consChNFe) e retorna metadados e tamanhos dos XMLs."""
-    cert_tuple = None
-    try:
-        emp, cert_path, key_path = _load_cert_tuple(empresa_id)
-        cert_tuple = (cert_path, key_path)
-        with SessionLocal() as db:
-            cert = db.execute(select(Certificado).where(Certificado.empresa_id==empresa_id)).scalar_one()
-            pfx_bytes = open(cert.pfx_path,'rb').read()
-            tipo, doc = pfx_extract_cnpj_cpf(pfx_bytes, cert.senha_cripto)
-            if tipo == "CNPJ" and (emp.cnpj or '')[:8] != (doc or '')[:8]:
-                raise HTTPException(422, "CNPJ consultado difere do CNPJ-base do certificado (H04)")
-        verify = settings.DFE_CA_BUNDLE if settings.DFE_CA_BUNDLE else certifi.where()
-        res = nfe_consultar_chave(emp.cnpj, chNFe, cert_tuple, verify)
-        if 'error' in res:
-            raise HTTPException(502, f"Erro chamada WS: {res.get('detail')}")
-        meta = [{"nsu": d.get("nsu"), "schema": d.get("schema"), "xml_size": len(d.get("xml") or b"")} for d in (res.get("docs") or [])]
-        return {
-            "cStat": res.get("cStat"),
-            "xMotivo": res.get("xMotivo"),
-            "ultNSU": res.get("ultNSU"),
-            "maxNSU": res.get("maxNSU"),
-            "docs": meta,
-            "elapsed": res.get("elapsed"),
-        }
-    finally:
-        if cert_tuple:
-            for p in cert_tuple:
-                try:
-                    if p and os.path.exists(p): os.remove(p)
-                except: pass
+    emp, lc = await run_in_threadpool(_load_cert, empresa_id)
+    _check_cert_owner(emp, lc)
+    verify = settings.DFE_CA_BUNDLE if settings.DFE_CA_BUNDLE else certifi.where()
+    res = await nfe_consultar_chave_async(emp.cnpj, chNFe, lc.cert_tuple, verify)
+    if 'error' in res:
+        raise HTTPException(502, f"Erro chamada WS: {res.get('detail')}")
+    meta = [{"nsu": d.get("nsu"), "schema": d.get("schema"), "xml_size": len(doc_xml(d))} for d in (res.get("docs") or [])]
+    return {
+        "cStat": res.get("cStat"),
+        "xMotivo": res.get("xMotivo"),
+        "ultNSU": res.get("ultNSU"),
+        "maxNSU": res.get("maxNSU"),
+        "docs": meta,
+        "elapsed": res.get("elapsed"),
+    }
 
 @router.get("/dfe/conschave/download")
-def cons_chave_download(
+async def cons_chave_download(
     empresa_id:int=Query(...),
     chNFe:str=Query(..., min_length=44, max_length=44),
     prefer:str=Query("procNFe", description="Prefixo preferido do schema: procNFe|resNFe|resEvento"),
     save:bool=Query(False, description="Se true, salva XML no storage e retorna saved_path")
 ):
     """Consulta por chave e retorna o XML (preferência de schema) como texto; opcionalmente salva no storage."""
-    cert_tuple = None
-    try:
-        emp, cert_path, key_path = _load_cert_tuple(empresa_id)
-        cert_tuple = (cert_path, key_path)
-        with SessionLocal() as db:
-            cert = db.execute(select(Certificado).where(Certificado.empresa_id==empresa_id)).scalar_one()
-            pfx_bytes = open(cert.pfx_path,'rb').read()
-            tipo, doc = pfx_extract_cnpj_cpf(pfx_bytes, cert.senha_cripto)
-            if tipo == "CNPJ" and (emp.cnpj or '')[:8] != (doc or '')[:8]:
-                raise HTTPException(422, "CNPJ consultado difere do CNPJ-base do certificado (H04)")
-        verify = settings.DFE_CA_BUNDLE if settings.DFE_CA_BUNDLE else certifi.where()
-        res = nfe_consultar_chave(emp.cnpj, chNFe, cert_tuple, verify)
-        if 'error' in res:
-            raise HTTPException(502, f"Erro chamada WS: {res.get('detail')}")
-        docs = res.get("docs") or []
-        if not docs:
-            raise HTTPException(404, "Nenhum documento localizado para a chave")
-        # seleção por preferência
-        preferred = (prefer or '').strip()
-        chosen = None
-        if preferred:
+    emp, lc = await run_in_threadpool(_load_cert, empresa_id)
+    _check_cert_owner(emp, lc)
+    verify = settings.DFE_CA_BUNDLE if settings.DFE_CA_BUNDLE else certifi.where()
+    res = await nfe_consultar_chave_async(emp.cnpj, chNFe, lc.cert_tuple, verify)
+    if 'error' in res:
+        raise HTTPException(502, f"Erro chamada WS: {res.get('detail')}")
+    docs = res.get("docs") or []
+    if not docs:
+        raise HTTPException(404, "Nenhum documento localizado para a chave")
+    # seleção por preferência
+    preferred = (prefer or '').strip()
+    chosen = None
+    if preferred:
+        for d in docs:
+            if (d.get("schema") or '').startswith(preferred):
+                chosen = d; break
+    # fallback: procNFe -> resNFe -> primeiro
+    if chosen is None:
+        for pref in ("procNFe","resNFe","resEvento"):
             for d in docs:
-                if (d.get("schema") or '').startswith(preferred):
+                if (d.get("schema") or '').startswith(pref):
                     chosen = d; break
-        # fallback: procNFe -> resNFe -> primeiro
-        if chosen is None:
-            for pref in ("procNFe","resNFe","resEvento"):
-                for d in docs:
-                    if (d.get("schema") or '').startswith(pref):
-                        chosen = d; break
-                if chosen is not None:
-                    break
-        if chosen is None:
-            chosen = docs[0]
-        xml_bytes = chosen.get("xml") or b""
+            if chosen is not None:
+                break
+    if chosen is None:
+        chosen = docs[0]
+    xml_bytes = doc_xml(chosen)
+    try:
+        txt = xml_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        txt = xml_bytes.decode('latin-1', errors='ignore')
+    saved_path = None
+    if save:
         try:
-            txt = xml_bytes.decode('utf-8')
-        except UnicodeDecodeError:
-            txt = xml_bytes.decode('latin-1', errors='ignore')
-        saved_path = None
-        if save:
-            try:
-                from pathlib import Path
-                base = Path(settings.STORAGE_BASE_PATH)/emp.cnpj
-                base.mkdir(parents=True, exist_ok=True)
-                safe_schema = (chosen.get("schema") or "").split(".")[0]
-                fname = f"{chNFe}-{safe_schema}-{chosen.get('nsu') or 'nsu'}.xml"
-                p = base/fname
-                p.write_text(txt, encoding='utf-8')
-                saved_path = str(p)
-            except Exception as e:
-                # não falhar download por erro de I/O; apenas não retornar saved_path
-                saved_path = None
-        return {
-            "status":"ok",
-            "schema": chosen.get("schema"),
-            "nsu": chosen.get("nsu"),
-            "preferred": preferred or None,
-            "saved_path": saved_path,
-            "xml": txt,
-        }
-    finally:
-        if cert_tuple:
-            for p in cert_tuple:
-                try:
-                    if p and os.path.exists(p): os.remove(p)
-                except: pass
+            safe_schema = (chosen.get("schema") or "").split(".")[0]
+            fname = f"{chNFe}-{safe_schema}-{chosen.get('nsu') or 'nsu'}.xml"
+            saved_path = await run_in_threadpool(put_xml, emp.cnpj, fname, txt.encode('utf-8'))
+        except Exception as e:
+            # não falhar download por erro de I/O; apenas não retornar saved_path
+            saved_path = None
+    return {
+        "status":"ok",
+        "schema": chosen.get("schema"),
+        "nsu": chosen.get("nsu"),
+        "preferred": preferred or None,
+        "saved_path": saved_path,
+        "xml": txt,
+    }
 
 @router.post("/dfe/manifestar")
-def manifestar_destinatario(
+async def manifestar_destinatario(
     empresa_id:int=Query(...),
     chNFe:str=Query(..., min_length=44, max_length=44),
     tpEvento:str=Query(..., description="210210=Ciencia, 210200=Confirmacao, 210220=Desconhecimento, 210240=Operacao nao Realizada"),
@@ -248,88 +268,83 @@ def manifestar_destinatario(
     justificativa:str|None=Query(None)
 ):
     """Envia manifestação do destinatário (RecepcaoEvento 4.00). Requer certificado A1 da empresa."""
-    cert_tuple = None
-    try:
-        emp, cert_path, key_path = _load_cert_tuple(empresa_id)
-        cert_tuple = (cert_path, key_path)
-        # Valida CNPJ-base conforme H04
-        with SessionLocal() as db:
-            cert = db.execute(select(Certificado).where(Certificado.empresa_id==empresa_id)).scalar_one()
-            pfx_bytes = open(cert.pfx_path,'rb').read()
-            tipo, doc = pfx_extract_cnpj_cpf(pfx_bytes, cert.senha_cripto)
-            if tipo == "CNPJ" and (emp.cnpj or '')[:8] != (doc or '')[:8]:
-                raise HTTPException(422, "CNPJ consultado difere do CNPJ-base do certificado (H04)")
-            if tipo == "CPF":
-                raise HTTPException(422, "Certificado PF não suportado para manifestação do destinatário")
-        verify = settings.DFE_CA_BUNDLE if settings.DFE_CA_BUNDLE else certifi.where()
-        res = enviar_manifestacao(emp.cnpj, chNFe, tpEvento, nSeq, cert_tuple, verify)
+    emp, lc = await run_in_threadpool(_load_cert, empresa_id)
+    _check_cert_owner(emp, lc)
+    if lc.tipo == "CPF":
+        raise HTTPException(422, "Certificado PF não suportado para manifestação do destinatário")
+    verify = settings.DFE_CA_BUNDLE if settings.DFE_CA_BUNDLE else certifi.where()
+    res = await enviar_manifestacao_async(emp.cnpj, chNFe, tpEvento, nSeq, lc.cert_tuple, verify)
+    saved_path = await run_in_threadpool(_persist_manifest, emp.cnpj, empresa_id, chNFe, tpEvento, nSeq, res)
 
-        # Persistir resultado no documento mais recente com esta chave (se existir)
-        saved_path = None
-        try:
-            with SessionLocal() as db:
-                doc = db.execute(select(DFEDocumento).where(DFEDocumento.empresa_id==empresa_id, DFEDocumento.chave==chNFe).order_by(DFEDocumento.id.desc())).scalar_one_or_none()
-                if doc:
-                    try:
-                        # salvar XML de resposta se existir
-                        resp_xml = res.get("resp_xml")
-                        if resp_xml:
-                            from pathlib import Path
-                            base = Path(settings.STORAGE_BASE_PATH)/emp.cnpj
-                            base.mkdir(parents=True, exist_ok=True)
-                            fname = f"evento_{chNFe}_{tpEvento}_{nSeq}.xml"
-                            p = base/fname
-                            p.write_text(resp_xml, encoding='utf-8')
-                            saved_path = str(p)
-                    except Exception:
-                        saved_path = None
-                    db.execute(update(DFEDocumento).where(DFEDocumento.id==doc.id).values(
-                        manifest_tp=tpEvento,
-                        manifest_nseq=nSeq,
-                        manifest_cstat=str(res.get("cStat") or ""),
-                        manifest_xmotivo=res.get("xMotivo"),
-                        manifest_xml_path=saved_path,
-                        manifest_updated_at=__import__("datetime").datetime.utcnow(),
-                    ))
-                    db.commit()
-        except Exception:
-            pass
+    # Resposta HTTP: 2xx somente com sucesso (cStat presente). Caso contrário 4xx/5xx com detalhes.
+    cstat = (res.get("cStat") or "").strip()
+    if cstat:
+        out = {k: res.get(k) for k in ("cStat","xMotivo")}
+        out["saved_path"] = saved_path
+        return out
+
+    # Mapear erro para código HTTP adequado
+    err = (res.get("error") or "").lower()
+    status_code = res.get("status_code")
+    body = res.get("body")
+    meta = {k: res.get(k) for k in ("url","op","soap") if res.get(k)}
+    detail = res.get("detail") or res.get("xMotivo") or "Falha na manifestação"
+
+    # Heurística de status
+    if err == "sign":
+        status = 400
+    elif err in ("http","parse"):
+        status = 502
+    elif isinstance(status_code, int) and 400 <= status_code < 500:
+        status = 424  # dependência remota retornou 4xx
+    else:
+        status = 502
 
-        # Resposta HTTP: 2xx somente com sucesso (cStat presente). Caso contrário 4xx/5xx com detalhes.
-        cstat = (res.get("cStat") or "").strip()
-        if cstat:
-            out = {k: res.get(k) for k in ("cStat","xMotivo")}
-            out["saved_path"] = saved_path
-            return out
+    payload = {"detail": detail, **meta}
+    if isinstance(status_code, int):
+        payload["status_code"] = status_code
+    if body:
+        payload["body"] = body[:1000]
+    if saved_path:
+        payload["saved_path"] = saved_path
+    raise HTTPException(status, payload)
 
-        # Mapear erro para código HTTP adequado
-        err = (res.get("error") or "").lower()
-        status_code = res.get("status_code")
-        body = res.get("body")
-        meta = {k: res.get(k) for k in ("url","op","soap") if res.get(k)}
-        detail = res.get("detail") or res.get("xMotivo") or "Falha na manifestação"
+class ManifestEvento(BaseModel):
+    chNFe: str = Field(..., min_length=44, max_length=44)
+    tpEvento: str = Field("210210", description="210210=Ciencia, 210200=Confirmacao, 210220=Desconhecimento, 210240=Operacao nao Realizada")
+    nSeq: int = 1
 
-        # Heurística de status
-        if err == "sign":
-            status = 400
-        elif err in ("http","parse"):
-            status = 502
-        elif isinstance(status_code, int) and 400 <= status_code < 500:
-            status = 424  # dependência remota retornou 4xx
-        else:
-            status = 502
+class ManifestLote(BaseModel):
+    eventos: list[ManifestEvento] = Field(..., min_length=1, max_length=1000)
 
-        payload = {"detail": detail, **meta}
-        if isinstance(status_code, int):
-            payload["status_code"] = status_code
-        if body:
-            payload["body"] = body[:1000]
-        if saved_path:
-            payload["saved_path"] = saved_path
-        raise HTTPException(status, payload)
-    finally:
-        if cert_tuple:
-            for p in cert_tuple:
-                try:
-                    if p and os.path.exists(p): os.remove(p)
-                except: pass
\ No newline at end of file
+@router.post("/dfe/manifestar/lote")
+async def manifestar_lote(body:ManifestLote, empresa_id:int=Query(...)):
+    """Manifestação do destinatário de várias notas: eventos agrupados por destino em lotes envEvento
+    assinados (até DFE_EVENT_BATCH_SIZE por lote), enviados em paralelo; cada retEvento é casado com
+    sua chave e os documentos são atualizados em um único UPDATE."""
+    chaves = [e.chNFe for e in body.eventos]
+    if len(set(chaves)) != len(chaves):
+        raise HTTPException(422, "Chave repetida no pedido (um evento por chave)")
+    invalid = sorted({e.tpEvento for e in body.eventos} - set(DESC_EVENTO))
+    if invalid:
+        raise HTTPException(422, f"tpEvento inválido: {', '.join(invalid)}")
+    emp, lc = await run_in_threadpool(_load_cert, empresa_id)
+    _check_cert_owner(emp, lc)
+    if lc.tipo == "CPF":
+        raise HTTPException(422, "Certificado PF não suportado para manifestação do destinatário")
+    verify = settings.DFE_CA_BUNDLE if settings.DFE_CA_BUNDLE else certifi.where()
+    eventos = [(e.chNFe, e.tpEvento, e.nSeq) for e in body.eventos]
+    results = await enviar_manifestacao_lote_async(emp.cnpj, eventos, lc.cert_tuple, verify)
+    saved = await run_in_threadpool(_persist_manifest_lote, emp.cnpj, empresa_id, results)
+    items = []
+    for r in results:
+        item = {k: r.get(k) for k in ("chNFe", "tpEvento", "nSeq", "cStat", "xMotivo", "nProt")}
+        if not r.get("cStat"):
+            item.update({k: r[k] for k in ("error", "detail", "status_code", "url") if r.get(k)})
+        item["saved_path"] = saved.get((r["chNFe"], r["tpEvento"], int(r["nSeq"])))
+        items.append(item)
+    return {
+        "total": len(items),
+        "ok": sum(1 for i in items if i["cStat"] in MANIFEST_OK_CSTATS),
+        "items": items,
+    }
\ No newline at end of file
@@ -1,69 +1,122 @@
-from fastapi import APIRouter, Query, HTTPException
-from fastapi.responses import FileResponse
-from sqlalchemy import select, func
+from fastapi import APIRouter, Query, HTTPException, Depends, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from sqlalchemy import select
 from src.store.db import SessionLocal
-from src.models import DFEDocumento
-from lxml import etree
+from src.store.xml_store import read_xml, xml_exists, is_gzip
+from src.store.archive import zip_stream, tar_gz_stream
+from src.models import DFEDocumento, Empresa
+from src.core.doc_fields import FIELD_COLUMNS, as_json
+from src.core import counters
+from src.core.counters import MANIFEST_OK_CSTATS
 from pathlib import Path
+from datetime import date, datetime
+from decimal import Decimal
+import base64, json
 
 router = APIRouter()
 
+# Status de manifestação aceitos no filtro ``manifest`` -> tpEvento
+MANIFEST_STATUS_TP = {
+    "confirmada": "210200",
+    "ciencia": "210210",
+    "desconhecida": "210220",
+    "nao_realizada": "210240",
+}
+
+def encode_cursor(last_id:int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode().rstrip("=")
+
+def decode_cursor(token:str) -> int:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return int(data["id"])
+    except Exception:
+        raise HTTPException(400, "cursor inválido")
+
+class DocFilters:
+    """Filtros de documentos comuns às listagens (query string)."""
+    def __init__(
+        self,
+        schema:str|None=Query(None, description="Prefixo do schema: resNFe|procNFe|resEvento|procEventoNFe"),
+        data_ini:date|None=Query(None, description="Data de emissão inicial (AAAA-MM-DD)"),
+        data_fim:date|None=Query(None, description="Data de emissão final (AAAA-MM-DD)"),
+        emitente_cnpj:str|None=Query(None),
+        valor_min:Decimal|None=Query(None),
+        valor_max:Decimal|None=Query(None),
+        chave:str|None=Query(None, max_length=44, description="Prefixo da chave de acesso"),
+        manifest:str|None=Query(None, description="pendente|confirmada|ciencia|desconhecida|nao_realizada|erro"),
+    ):
+        self.schema = schema; self.data_ini = data_ini; self.data_fim = data_fim
+        self.emitente_cnpj = "".join(ch for ch in emitente_cnpj if ch.isdigit()) if emitente_cnpj else None
+        self.valor_min = valor_min; self.valor_max = valor_max
+        self.chave = "".join(ch for ch in chave if ch.isdigit()) if chave else None
+        self.manifest = manifest
+
+    def apply(self, q):
+        if self.schema:
+            q = q.where(DFEDocumento.schema.startswith(self.schema, autoescape=True))
+        if self.data_ini:
+            q = q.where(DFEDocumento.data_emissao >= self.data_ini)
+        if self.data_fim:
+            q = q.where(DFEDocumento.data_emissao <= self.data_fim)
+        if self.emitente_cnpj:
+            q = q.where(DFEDocumento.emitente_cnpj == self.emitente_cnpj)
+        if self.valor_min is not None:
+            q = q.where(DFEDocumento.valor >= self.valor_min)
+        if self.valor_max is not None:
+            q = q.where(DFEDocumento.valor <= self.valor_max)
+        if self.chave:
+            q = q.where(DFEDocumento.chave.startswith(self.chave))
+        if self.manifest == "pendente":
+            q = q.where(DFEDocumento.manifest_tp.is_(None))
+        elif self.manifest == "erro":
+            q = q.where(DFEDocumento.manifest_tp.is_not(None), DFEDocumento.manifest_cstat.not_in(MANIFEST_OK_CSTATS))
+        elif self.manifest in MANIFEST_STATUS_TP:
+            q = q.where(DFEDocumento.manifest_tp == MANIFEST_STATUS_TP[self.manifest], DFEDocumento.manifest_cstat.in_(MANIFEST_OK_CSTATS))
+        elif self.manifest:
+            raise HTTPException(400, "manifest inválido")
+        return q
+
+def _page(q, limit:int, offset:int, cursor:str|None):
+    """Ordena por id desc e pagina por cursor (keyset, ``id < último``) ou, sem cursor, por offset."""
+    if cursor:
+        q = q.where(DFEDocumento.id < decode_cursor(cursor))
+    else:
+        q = q.offset(offset)
+    return q.order_by(DFEDocumento.id.desc()).limit(limit)
+
+def _next_cursor(rows, limit:int) -> str|None:
+    return encode_cursor(rows[-1][0].id) if rows and len(rows) == limit else None
+
 @router.get("/documentos")
-def list_docs(empresa_id:int=Query(...), limit:int=Query(50), offset:int=Query(0)):
+def list_docs(empresa_id:int=Query(...), limit:int=Query(50, ge=1, le=500), offset:int=Query(0),
+              cursor:str|None=Query(None, description="Token next_cursor da página anterior (ignora offset)"),
+              f:DocFilters=Depends()):
     with SessionLocal() as db:
-        rows = db.execute(select(DFEDocumento).where(DFEDocumento.empresa_id==empresa_id).order_by(DFEDocumento.id.desc()).offset(offset).limit(limit)).all()
+        q = f.apply(select(DFEDocumento).where(DFEDocumento.empresa_id==empresa_id))
+        rows = db.execute(_page(q, limit, offset, cursor)).all()
         items = []
         for (r,) in rows:
             items.append({
                 "id":r.id,"nsu":r.nsu,"schema":r.schema,"chave":r.chave,
                 "caminho_xml": r.caminho_xml, "created_at": str(r.created_at)
             })
-        return {"items":items,"count":len(items)}
-
-def _parse_doc_fields(xml_bytes: bytes) -> dict:
-    ns = {"nfe":"http://www.portalfiscal.inf.br/nfe"}
-    try:
-        root = etree.fromstring(xml_bytes)
-    except Exception:
-        return {}
-    data = {}
-    # Tenta resNFe
-    ch = root.find('.//nfe:chNFe', ns)
-    if ch is not None:
-        data['chave'] = ch.text
-    emit_cnpj = root.find('.//nfe:CNPJ', ns)
-    emit_nome = root.find('.//nfe:xNome', ns)
-    if emit_cnpj is not None:
-        data['emitente_cnpj'] = emit_cnpj.text
-    if emit_nome is not None:
-        data['emitente_nome'] = emit_nome.text
-    # Datas: dhEmi (procNFe/NFe) ou dhEmi/dEmi em resumos
-    for xp in ['.//nfe:dhEmi', './/nfe:dEmi']:
-        d = root.find(xp, ns)
-        if d is not None and d.text:
-            data['data_emissao'] = d.text[:10]
-            break
-    # Valor: vNF ou vProd total
-    for xp in ['.//nfe:vNF', './/nfe:total//nfe:vNF', './/nfe:ICMSTot//nfe:vNF']:
-        v = root.find(xp, ns)
-        if v is not None and v.text:
-            data['valor'] = v.text
-            break
-    return data
+        return {"items":items,"count":len(items),"next_cursor":_next_cursor(rows, limit)}
 
 @router.get("/documentos/importacao")
-def list_docs_importacao(empresa_id:int=Query(...), limit:int=Query(50), offset:int=Query(0), filtro:str|None=Query(None)):
-    """Lista documentos com campos enriquecidos a partir do XML salvo, para UI de importação.
+def list_docs_importacao(empresa_id:int=Query(...), limit:int=Query(50, ge=1, le=500), offset:int=Query(0), filtro:str|None=Query(None),
+                         cursor:str|None=Query(None, description="Token next_cursor da página anterior (ignora offset)"),
+                         f:DocFilters=Depends()):
+    """Lista documentos com os metadados materializados na ingestão (sem ler XML), para UI de importação.
     filtro=pendentes -> resNFe; filtro=registradas -> procNFe; vazio -> todos.
+    Aceita os filtros de DocFilters e paginação por cursor (next_cursor).
     Retorna também contadores por categoria.
     """
     with SessionLocal() as db:
         q = select(DFEDocumento).where(DFEDocumento.empresa_id==empresa_id)
-        if filtro == 'pendentes':
-            q = q.where(DFEDocumento.schema=="resNFe")
-        elif filtro == 'registradas':
-            q = q.where(DFEDocumento.schema=="procNFe")
-        q = q.order_by(DFEDocumento.id.desc()).offset(offset).limit(limit)
+        if filtro in ('pendentes', 'registradas'):
+            q = q.where(counters.category_filter(filtro))
+        q = _page(f.apply(q), limit, offset, cursor)
         rows = db.execute(q).all()
         items = []
         for (r,) in rows:
@@ -77,26 +130,77 @@ def list_docs_importacao(empresa_id:int=Query(...), limit:int=Query(50), offset:
                 "manifest_xml_path": r.manifest_xml_path,
                 "manifest_updated_at": str(r.manifest_updated_at) if getattr(r, 'manifest_updated_at', None) else None
             })
-            try:
-                p = Path(r.caminho_xml)
-                if p.exists():
-                    xmlb = p.read_bytes()
-                    info.update(_parse_doc_fields(xmlb))
-            except Exception:
-                pass
+            info.update(as_json({k: getattr(r, k) for k in FIELD_COLUMNS}))
             items.append(info)
-        total_all = db.execute(select(func.count()).select_from(DFEDocumento).where(DFEDocumento.empresa_id==empresa_id)).scalar() or 0
-        total_reg = db.execute(select(func.count()).select_from(DFEDocumento).where(DFEDocumento.empresa_id==empresa_id, DFEDocumento.schema=="procNFe")).scalar() or 0
-        total_pen = db.execute(select(func.count()).select_from(DFEDocumento).where(DFEDocumento.empresa_id==empresa_id, DFEDocumento.schema=="resNFe")).scalar() or 0
-        return {"items":items, "count":len(items), "counts": {"todas": total_all, "registradas": total_reg, "pendentes": total_pen}}
+        return {"items":items, "count":len(items), "next_cursor":_next_cursor(rows, limit),
+                "counts": counters.get_counts(db, empresa_id)}
+
+@router.get("/documentos/contadores")
+def contadores(empresa_id:int=Query(...)):
+    """Contadores por categoria (todas, registradas, pendentes, eventos, manifestadas)."""
+    with SessionLocal() as db:
+        return counters.get_counts(db, empresa_id)
+
+# Exportação: documentos lidos do banco em lotes por id (keyset), cada lote em sessão curta
+_EXPORT_BATCH = 1000
+_EXPORT_FORMATS = {
+    "zip": (zip_stream, "application/zip", "zip"),
+    "tar.gz": (tar_gz_stream, "application/gzip", "tar.gz"),
+}
+
+def _export_entries(q, manifestacao:bool):
+    last_id = 0
+    while True:
+        with SessionLocal() as db:
+            rows = db.execute(q.where(DFEDocumento.id > last_id).order_by(DFEDocumento.id).limit(_EXPORT_BATCH)).all()
+        if not rows:
+            return
+        for r in rows:
+            yield f"{r.nsu}_{r.schema}.xml", r.caminho_xml, r.created_at
+            if manifestacao and r.manifest_xml_path:
+                yield (f"eventos/evento_{r.chave}_{r.manifest_tp}_{r.manifest_nseq}.xml", r.manifest_xml_path,
+                       r.manifest_updated_at or r.created_at)
+        last_id = rows[-1].id
+
+@router.get("/documentos/export")
+def export_docs(empresa_id:int=Query(...), formato:str=Query("zip", description="zip|tar.gz"),
+                manifestacao:bool=Query(False, description="Inclui os XMLs de retorno da manifestação (pasta eventos/)"),
+                f:DocFilters=Depends()):
+    """Pacote ZIP ou tar.gz com os XMLs dos documentos que atendem aos filtros, gerado em fluxo
+    (memória constante, sem arquivo temporário). Arquivos ausentes no storage são listados em
+    ``ausentes.txt`` dentro do pacote."""
+    if formato not in _EXPORT_FORMATS:
+        raise HTTPException(400, "formato inválido (zip|tar.gz)")
+    with SessionLocal() as db:
+        cnpj = db.execute(select(Empresa.cnpj).where(Empresa.id==empresa_id)).scalar_one_or_none()
+    if cnpj is None:
+        raise HTTPException(404, "Empresa não encontrada")
+    # filtros aplicados antes de abrir o fluxo: filtro inválido ainda vira 400
+    q = f.apply(select(DFEDocumento.id, DFEDocumento.nsu, DFEDocumento.schema, DFEDocumento.chave,
+                       DFEDocumento.caminho_xml, DFEDocumento.created_at, DFEDocumento.manifest_tp,
+                       DFEDocumento.manifest_nseq, DFEDocumento.manifest_xml_path, DFEDocumento.manifest_updated_at)
+                .where(DFEDocumento.empresa_id==empresa_id))
+    stream, media_type, ext = _EXPORT_FORMATS[formato]
+    filename = f"dfe_{cnpj}_{datetime.utcnow():%Y%m%d%H%M%S}.{ext}"
+    return StreamingResponse(stream(_export_entries(q, manifestacao)), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 @router.get("/documentos/{doc_id}/download")
-def download_xml(doc_id:int):
+def download_xml(doc_id:int, request:Request):
     with SessionLocal() as db:
         row = db.execute(select(DFEDocumento).where(DFEDocumento.id==doc_id)).scalar_one_or_none()
         if not row:
             raise HTTPException(404, "Documento não encontrado")
-        p = Path(row.caminho_xml)
-        if not p.exists():
+        if not xml_exists(row):
             raise HTTPException(404, "Arquivo XML não encontrado")
-        return FileResponse(str(p), media_type='application/xml', filename=p.name)
\ No newline at end of file
+        p = Path(row.caminho_xml)
+        if p.suffix == ".xml":
+            return FileResponse(str(p), media_type='application/xml', filename=p.name)
+        # armazenamento comprimido/endereçado por conteúdo: nome amigável a partir do NSU/schema
+        filename = f"{row.nsu}_{row.schema}.xml"
+        if is_gzip(row) and "gzip" in request.headers.get("accept-encoding", "").lower():
+            # GZip guardado (docZip original ou CAS gzip) vai como está; quem descomprime é o cliente
+            return FileResponse(str(p), media_type='application/xml', filename=filename,
+                                headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+        return Response(read_xml(row), media_type='application/xml',
+                        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
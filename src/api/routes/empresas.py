@@ -4,6 +4,8 @@ from src.store.db import SessionLocal
 from src.models import Empresa, Certificado, CursorDFe
 from pathlib import Path
 from src.settings import settings
+from src.ws import async_transport, session_pool
+from src.cert import cert_manager
 
 router = APIRouter()
 
@@ -30,4 +32,10 @@ async def upload_cert(empresa_id:int, certificado_pfx:UploadFile, senha_certific
     with SessionLocal() as db:
         db.execute(insert(Certificado).values(empresa_id=empresa_id, pfx_path=str(pfx_path), senha_cripto=senha_certificado))
         db.commit()
+        emp = db.execute(select(Empresa).where(Empresa.id==empresa_id)).scalar_one_or_none()
+    # Certificado decifrado em cache e sessões mTLS abertas com o anterior não devem ser reaproveitados
+    cert_manager.invalidate(empresa_id)
+    if emp:
+        session_pool.invalidate(emp.cnpj)
+        async_transport.invalidate(emp.cnpj)
     return {"ok":True}
\ No newline at end of file
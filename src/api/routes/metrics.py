@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from src.core import metrics
+
+router = APIRouter()
+
+# na API o backlog por empresa (cursor_dfe) entra na coleta
+metrics.register_backlog()
+
+@router.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return Response(generate_latest(metrics.REGISTRY), media_type=CONTENT_TYPE_LATEST)
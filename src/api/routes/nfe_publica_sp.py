@@ -4,13 +4,13 @@ from fastapi import APIRouter
 router = APIRouter()
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import JSONResponse
-from src.public.nfe_sp_public import consulta_publica_sp
+from src.public.nfe_sp_public import consulta_publica_sp_async
 
 router = APIRouter()
 
 @router.get("/nfe/sp/publica/{chave}")
-def consulta_publica(chave: str):
-    res = consulta_publica_sp(chave)
+async def consulta_publica(chave: str):
+    res = await consulta_publica_sp_async(chave)
     if res.get("status") == "error":
         raise HTTPException(502, res.get("detail"))
     return res
@@ -0,0 +1,94 @@
+"""Cache dos certificados A1 das empresas (PFX já decifrado).
+
+Antes, cada requisição lia o PFX, decifrava o PKCS#12 duas vezes (PEM temporário e
+extração do CNPJ/CPF) e gravava a chave privada em texto puro em /tmp. Aqui o PFX é
+carregado uma vez por empresa e mantido em memória junto com o CNPJ/CPF extraído.
+
+O PEM (cert + chave) fica em arquivos anônimos em memória (``memfd_create``),
+expostos como ``/proc/self/fd/N`` para quem exige caminho (requests/OpenSSL, signxml);
+a chave nunca vai para o disco. Onde ``memfd`` não existe, usa-se um temporário 0600
+removido quando a entrada sai do cache.
+
+A entrada é refeita quando o registro do certificado ou o arquivo PFX (mtime/tamanho)
+muda, e descartada explicitamente por ``invalidate`` no upload de novo certificado.
+"""
+import hashlib, os, tempfile, threading, weakref
+from typing import Optional, Tuple
+from sqlalchemy import select
+from src.store.db import SessionLocal
+from src.models import Certificado
+from src.cert.pfx_utils import pfx_load, pem_material, cert_cnpj_cpf
+
+def _mem_file(name: str, data: bytes) -> tuple[str, int | None]:
+    """(caminho, fd) de um arquivo em memória com ``data``; fd None no fallback em disco."""
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create(name, getattr(os, "MFD_CLOEXEC", 0))
+        os.write(fd, data)
+        return f"/proc/self/fd/{fd}", fd
+    fd, path = tempfile.mkstemp(suffix=".pem", prefix="dfe-cert-")
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+    return path, None
+
+def _release(files: list[tuple[str, int | None]]):
+    for path, fd in files:
+        try:
+            if fd is not None:
+                os.close(fd)
+            elif os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
+
+class LoadedCert:
+    """Certificado decifrado de uma empresa. ``cert_tuple`` segue válido enquanto houver
+    referência ao objeto (liberação via finalizador, não no ``invalidate``), de modo que
+    requisições em andamento não perdem os arquivos se o certificado for trocado."""
+
+    def __init__(self, stamp: tuple, pfx_bytes: bytes, password: str):
+        key, cert, chain = pfx_load(pfx_bytes, password)
+        cert_pem, key_pem = pem_material(key, cert, chain)
+        self.stamp = stamp
+        self.tipo, self.doc = cert_cnpj_cpf(cert)
+        self.fingerprint = hashlib.sha256(cert_pem).hexdigest()
+        files = [_mem_file("dfe-cert", cert_pem), _mem_file("dfe-key", key_pem)]
+        self.cert_tuple: Tuple[str, str] = (files[0][0], files[1][0])
+        weakref.finalize(self, _release, files)
+
+# empresa_id -> certificado carregado
+_cache: dict[int, LoadedCert] = {}
+_lock = threading.Lock()
+
+def _stamp(cert: Certificado) -> tuple:
+    st = os.stat(cert.pfx_path)
+    return (cert.id, cert.pfx_path, st.st_mtime_ns, st.st_size)
+
+def get(empresa_id: int) -> Optional[LoadedCert]:
+    """Certificado da empresa (o cadastrado mais recente) ou None se não houver.
+    Erros de leitura/senha do PFX propagam como ``ValueError``/``OSError``."""
+    with SessionLocal() as db:
+        cert = db.execute(select(Certificado).where(Certificado.empresa_id==empresa_id)
+                          .order_by(Certificado.id.desc()).limit(1)).scalar_one_or_none()
+    if cert is None:
+        return None
+    stamp = _stamp(cert)
+    with _lock:
+        lc = _cache.get(empresa_id)
+        if lc is not None and lc.stamp == stamp:
+            return lc
+    # decifra fora do lock; em corrida duas threads podem carregar, a última vence
+    with open(cert.pfx_path, "rb") as f:
+        lc = LoadedCert(stamp, f.read(), cert.senha_cripto)
+    with _lock:
+        _cache[empresa_id] = lc
+    return lc
+
+def invalidate(empresa_id: Optional[int] = None):
+    """Descarta o certificado em cache da empresa (ou de todas)."""
+    with _lock:
+        if empresa_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(empresa_id, None)
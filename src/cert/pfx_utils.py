@@ -3,14 +3,21 @@ from cryptography import x509
 from cryptography.x509.oid import NameOID
 import tempfile, os
 
-def pfx_to_pem_tempfiles(pfx_bytes: bytes, password: str):
+def pfx_load(pfx_bytes: bytes, password: str):
     key, cert, chain = pkcs12.load_key_and_certificates(pfx_bytes, password.encode("utf-8") if password else None)
     if not key or not cert: raise ValueError("PFX invÃ¡lido/senha incorreta")
+    return key, cert, chain or []
+
+def pem_material(key, cert, chain) -> tuple[bytes, bytes]:
+    """(cert+cadeia em PEM, chave privada PKCS8 em PEM sem senha)."""
     certs = [cert.public_bytes(Encoding.PEM)]
-    if chain:
-        for c in chain: certs.append(c.public_bytes(Encoding.PEM))
-    cert_fd, cert_path = tempfile.mkstemp(suffix=".pem"); os.write(cert_fd, b"".join(certs)); os.close(cert_fd)
-    key_fd, key_path = tempfile.mkstemp(suffix=".pem"); os.write(key_fd, key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())); os.close(key_fd)
+    for c in chain: certs.append(c.public_bytes(Encoding.PEM))
+    return b"".join(certs), key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+
+def pfx_to_pem_tempfiles(pfx_bytes: bytes, password: str):
+    cert_pem, key_pem = pem_material(*pfx_load(pfx_bytes, password))
+    cert_fd, cert_path = tempfile.mkstemp(suffix=".pem"); os.write(cert_fd, cert_pem); os.close(cert_fd)
+    key_fd, key_path = tempfile.mkstemp(suffix=".pem"); os.write(key_fd, key_pem); os.close(key_fd)
     return cert_path, key_path
 
 def pfx_extract_cnpj_cpf(pfx_bytes: bytes, password: str):
@@ -20,6 +27,10 @@ def pfx_extract_cnpj_cpf(pfx_bytes: bytes, password: str):
     key, cert, chain = pkcs12.load_key_and_certificates(pfx_bytes, password.encode("utf-8") if password else None)
     if not cert:
         raise ValueError("Certificado ausente no PFX")
+    return cert_cnpj_cpf(cert)
+
+def cert_cnpj_cpf(cert):
+    """CNPJ/CPF de um certificado já carregado; ver ``pfx_extract_cnpj_cpf``."""
     # Tentar Subject Alternative Name com OtherName OIDs (biblioteca não expõe OtherName value facilmente em todos os casos)
     try:
         san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
@@ -0,0 +1,118 @@
+"""Agenda persistente de sincronização por empresa (tabela ``dfe_agenda``).
+
+Cada execução de ``run_distribution`` (agendador ou ``POST /api/dfe/sync``) registra
+aqui o resultado e o próximo horário permitido para a empresa:
+
+- ociosa (ultNSU == maxNSU): ``DFE_IDLE_HOLD_SEC`` (a NT pede ~1 h);
+- cStat 656 (consumo indevido): o ``wait_sec`` devolvido pelo ciclo;
+- erro ou serviço paralisado (108/109): espera exponencial a partir de
+  ``DFE_AGENDA_RETRY_BASE_SEC`` pelo número de falhas seguidas, até ``DFE_AGENDA_RETRY_CAP_SEC``;
+- prazo/cota de páginas esgotados: volta a ficar elegível de imediato.
+
+Por estar no banco, a janela sobrevive a reinícios e vale para os dois processos. Empresa
+sem linha na agenda está sempre elegível.
+
+As empresas elegíveis saem em ordem de prioridade: maior backlog conhecido
+(maxNSU − ultNSU) primeiro, empresas nunca sincronizadas antes de todas, e, no
+empate, quem rodou há mais tempo.
+"""
+import heapq
+from datetime import datetime, timedelta
+from sqlalchemy import select, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from src.models import Empresa, CursorDFe, DFEAgenda
+from src.settings import settings
+
+_NEVER = float("inf")  # backlog desconhecido (sem cursor): atende primeiro
+
+def _nsu_int(nsu) -> int:
+    try:
+        return int(nsu or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def backlog(ult_nsu, max_nsu) -> int:
+    return max(0, _nsu_int(max_nsu) - _nsu_int(ult_nsu))
+
+def entry(emp: Empresa, pending: float, last_run_at: datetime | None) -> tuple:
+    """Item da fila de prioridade (``heapq``): menor tupla sai primeiro."""
+    return (-pending, last_run_at.timestamp() if last_run_at else 0.0, emp.id, emp)
+
+def due_queue(db, now: datetime | None = None) -> list[tuple]:
+    """Empresas ativas elegíveis em ``now``, como heap de ``entry``."""
+    now = now or datetime.utcnow()
+    rows = db.execute(
+        select(Empresa, CursorDFe.ultimo_nsu, CursorDFe.max_nsu, DFEAgenda.last_run_at)
+        .outerjoin(CursorDFe, CursorDFe.empresa_id==Empresa.id)
+        .outerjoin(DFEAgenda, DFEAgenda.empresa_id==Empresa.id)
+        .where(Empresa.ativo==1, or_(DFEAgenda.next_allowed_at.is_(None), DFEAgenda.next_allowed_at <= now))
+    ).all()
+    heap = [entry(emp, _NEVER if ult is None else backlog(ult, mx), last_run)
+            for emp, ult, mx, last_run in rows]
+    heapq.heapify(heap)
+    return heap
+
+def get(db, empresa_id: int) -> DFEAgenda | None:
+    return db.execute(select(DFEAgenda).where(DFEAgenda.empresa_id==empresa_id)).scalar_one_or_none()
+
+def hold_sec(row: DFEAgenda | None, now: datetime | None = None, force: bool = False) -> int:
+    """Segundos até a empresa poder sincronizar (0 = elegível). ``force`` ignora a espera de
+    ociosidade/erro, nunca a do 656."""
+    now = now or datetime.utcnow()
+    if row is None or not row.next_allowed_at or row.next_allowed_at <= now:
+        return 0
+    if force and row.last_reason != "consumo_indevido":
+        return 0
+    return int((row.next_allowed_at - now).total_seconds()) + 1
+
+def retry_delay(errors: int) -> int:
+    return min(settings.DFE_AGENDA_RETRY_CAP_SEC, settings.DFE_AGENDA_RETRY_BASE_SEC * 2 ** max(0, errors - 1))
+
+def _schedule(res: dict, errors: int) -> tuple[int, str | None, int]:
+    """(espera em segundos, motivo, falhas seguidas) a partir do retorno de run_distribution."""
+    if not res.get("ok"):
+        err = res.get("error") or {}
+        errors += 1
+        return retry_delay(errors), str(err.get("error") or "erro")[:30], errors
+    reason = res.get("reason") if res.get("stopped") else None
+    if reason == "consumo_indevido":
+        return int(res.get("wait_sec") or 3600), reason, 0
+    if reason == "service_down":
+        errors += 1
+        return retry_delay(errors), reason, errors
+    if reason in ("deadline", "page_quota"):
+        return 0, reason, 0
+    if res.get("ultNSU") == res.get("maxNSU"):
+        return settings.DFE_IDLE_HOLD_SEC, "idle", 0
+    return 0, reason, 0
+
+def record_result(db, empresa_id: int, res: dict, started_at: datetime | None = None) -> DFEAgenda:
+    """Grava o resultado de um ciclo e o próximo horário permitido (upsert, sem commit)."""
+    now = datetime.utcnow()
+    prev = get(db, empresa_id)
+    delay, reason, errors = _schedule(res, prev.consecutive_errors if prev else 0)
+    err = res.get("error") or {}
+    values = {
+        "next_allowed_at": now + timedelta(seconds=delay),
+        "last_run_at": started_at or now,
+        "last_cstat": (res.get("cStat") or err.get("cStat") or None),
+        "last_reason": reason,
+        "consecutive_errors": errors,
+        "updated_at": now,
+    }
+    db.execute(pg_insert(DFEAgenda).values(empresa_id=empresa_id, **values)
+               .on_conflict_do_update(index_elements=[DFEAgenda.empresa_id], set_=values))
+    db.expire_all()
+    return get(db, empresa_id)
+
+def as_dict(row: DFEAgenda | None) -> dict:
+    if row is None:
+        return {"next_allowed_at": None, "last_run_at": None, "last_cstat": None,
+                "last_reason": None, "consecutive_errors": 0}
+    return {
+        "next_allowed_at": row.next_allowed_at.isoformat() if row.next_allowed_at else None,
+        "last_run_at": row.last_run_at.isoformat() if row.last_run_at else None,
+        "last_cstat": row.last_cstat,
+        "last_reason": row.last_reason,
+        "consecutive_errors": row.consecutive_errors,
+    }
@@ -0,0 +1,171 @@
+"""Manifestação automática das notas recebidas só como resumo (tabela ``dfe_auto_manifest``).
+
+Com ``DFE_AUTO_MANIFEST=true``, cada resNFe inserido por ``run_distribution`` entra na fila
+na mesma transação da página (``ingest``). Ao final do ciclo, ``run_auto_manifest``
+(src/core/dfe_sync.py) avança as notas da empresa:
+
+- ``ciencia``: Ciência da Operação (210210) em lotes envEvento; 135/136 ou 573 (ciência já
+  registrada) passam a ``aguardando``. Nota já manifestada por fora (``/api/dfe/manifestar``)
+  pula direto para ``aguardando``;
+- ``aguardando``: passado ``DFE_AUTO_MANIFEST_PROC_DELAY_SEC``, consulta a chave (consChNFe)
+  até o AN liberar o procNFe;
+- ``concluida``: procNFe gravado e ligado à linha resNFe de origem (``proc_doc_id``). O procNFe
+  que chega antes pelo próprio distNSU também conclui a nota;
+- ``falha``: rejeição definitiva (ex.: nota cancelada) ou ``DFE_AUTO_MANIFEST_MAX_ATTEMPTS``
+  tentativas sem sucesso; fica visível em ``GET /api/dfe/auto-manifest``.
+
+Após erro (ou procNFe ainda indisponível), a nota espera com a mesma progressão exponencial
+da agenda; após 656, espera 1 h sem contar tentativa.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, or_, case, exists
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from src.models import DFEAutoManifest, DFEDocumento
+from src.core.agenda import retry_delay
+from src.core.counters import MANIFEST_OK_CSTATS
+from src.settings import settings
+
+CIENCIA, WAITING, DONE, FAILED = "ciencia", "aguardando", "concluida", "falha"
+STATUSES = (CIENCIA, WAITING, DONE, FAILED)
+TP_CIENCIA = "210210"
+
+# 573: duplicidade de evento (a ciência já estava registrada)
+_CIENCIA_OK = MANIFEST_OK_CSTATS + ("573",)
+# consChNFe sem volta: fora do prazo de download, sem permissão, cancelada, denegada
+_FETCH_FINAL = ("632", "640", "653", "654")
+
+def _is_proc(schema:str | None) -> bool:
+    return (schema or "").startswith("procNFe")
+
+def enqueue(db, empresa_id:int, docs:list[tuple[int, str]]):
+    """Enfileira resNFe (id, chave) para a Ciência; chave já na fila é no-op (ON CONFLICT)."""
+    by_chave = {ch: doc_id for doc_id, ch in docs if ch}
+    if not by_chave:
+        return
+    db.execute(pg_insert(DFEAutoManifest).values([
+        {"empresa_id": empresa_id, "chave": ch, "doc_id": doc_id} for ch, doc_id in by_chave.items()
+    ]).on_conflict_do_nothing(index_elements=["empresa_id", "chave"]))
+
+def link_proc(db, empresa_id:int, chaves:list[str]) -> list[str]:
+    """Conclui as notas em aberto destas chaves que já têm procNFe gravado, ligando a linha do
+    procNFe (``proc_doc_id``). Devolve as chaves concluídas."""
+    chaves = list({c for c in chaves if c})
+    if not chaves:
+        return []
+    proc_id = (select(func.max(DFEDocumento.id))
+               .where(DFEDocumento.empresa_id==empresa_id, DFEDocumento.chave==DFEAutoManifest.chave,
+                      DFEDocumento.schema.startswith("procNFe"))
+               .scalar_subquery())
+    return list(db.execute(update(DFEAutoManifest).where(
+        DFEAutoManifest.empresa_id==empresa_id, DFEAutoManifest.chave.in_(chaves),
+        DFEAutoManifest.status != DONE, proc_id.is_not(None),
+    ).values(status=DONE, proc_doc_id=proc_id, next_attempt_at=None, updated_at=datetime.utcnow())
+      .returning(DFEAutoManifest.chave)).scalars())
+
+def ingest(db, empresa_id:int, inserted:list, page_rows:list[dict]):
+    """Gancho de ``_persist_docs`` (mesma transação da página): resNFe inserido entra na fila e
+    procNFe da página (inserido ou repetido) conclui a nota. ``inserted``: (id, schema, chave)."""
+    res = [(doc_id, ch) for doc_id, schema, ch in inserted if (schema or "").startswith("resNFe")]
+    enqueue(db, empresa_id, res)
+    # resNFe novo também é conferido: o procNFe pode ter chegado antes dele
+    link_proc(db, empresa_id, [r["chave"] for r in page_rows if _is_proc(r["schema"])] + [ch for _, ch in res])
+
+def _due(status:str):
+    return (DFEAutoManifest.status==status) & or_(DFEAutoManifest.next_attempt_at.is_(None),
+                                                  DFEAutoManifest.next_attempt_at <= datetime.utcnow())
+
+def skip_manifested(db, empresa_id:int):
+    """Notas em ``ciencia`` já manifestadas por fora passam a ``aguardando`` sem novo evento
+    (Ciência após manifestação conclusiva seria rejeitada)."""
+    now = datetime.utcnow()
+    manifested = exists().where(DFEDocumento.empresa_id==empresa_id, DFEDocumento.chave==DFEAutoManifest.chave,
+                                DFEDocumento.manifest_cstat.in_(MANIFEST_OK_CSTATS))
+    db.execute(update(DFEAutoManifest).where(DFEAutoManifest.empresa_id==empresa_id, DFEAutoManifest.status==CIENCIA, manifested)
+               .values(status=WAITING, next_attempt_at=now, updated_at=now))
+
+def claim(db, empresa_id:int, status:str, limit:int) -> list[DFEAutoManifest]:
+    """Notas elegíveis da etapa (mais antigas primeiro), até ``limit``."""
+    if limit <= 0:
+        return []
+    return db.execute(select(DFEAutoManifest).where(DFEAutoManifest.empresa_id==empresa_id, _due(status))
+                      .order_by(DFEAutoManifest.id).limit(limit)).scalars().all()
+
+def _retry(row:DFEAutoManifest, now:datetime, error:str) -> dict:
+    attempts = row.attempts + 1
+    values = {"attempts": attempts, "last_error": error[:500]}
+    if attempts >= settings.DFE_AUTO_MANIFEST_MAX_ATTEMPTS:
+        values.update(status=FAILED, next_attempt_at=None)
+    else:
+        values["next_attempt_at"] = now + timedelta(seconds=retry_delay(attempts))
+    return values
+
+def _set(db, row:DFEAutoManifest, values:dict):
+    values["updated_at"] = datetime.utcnow()
+    db.execute(update(DFEAutoManifest).where(DFEAutoManifest.id==row.id).values(**values))
+
+def ciencia_result(db, row:DFEAutoManifest, res:dict) -> bool:
+    """Grava o retorno da Ciência de uma nota; True se registrada."""
+    now = datetime.utcnow()
+    cstat = str(res.get("cStat") or "")
+    if cstat and not res.get("lote"):
+        if cstat in _CIENCIA_OK:
+            _set(db, row, {"status": WAITING, "ciencia_cstat": cstat, "ciencia_at": now, "attempts": 0,
+                           "last_cstat": cstat, "last_error": None,
+                           "next_attempt_at": now + timedelta(seconds=settings.DFE_AUTO_MANIFEST_PROC_DELAY_SEC)})
+            return True
+        _set(db, row, {"status": FAILED, "last_cstat": cstat, "next_attempt_at": None,
+                       "last_error": f"cStat {cstat}: {res.get('xMotivo') or ''}"[:500]})
+        return False
+    # falha de envio/assinatura ou lote rejeitado por inteiro: tenta de novo
+    values = _retry(row, now, f"{res.get('error') or 'lote'}: {res.get('detail') or res.get('xMotivo') or ''}")
+    if cstat:
+        values["last_cstat"] = cstat
+    _set(db, row, values)
+    return False
+
+def fetch_result(db, row:DFEAutoManifest, cstat:str | None, error:str | None):
+    """Consulta da chave sem procNFe: espera e tenta de novo, ou encerra em ``falha``."""
+    now = datetime.utcnow()
+    values = {"last_cstat": cstat} if cstat else {}
+    if cstat in _FETCH_FINAL:
+        values.update(status=FAILED, next_attempt_at=None, last_error=(error or "")[:500])
+    elif cstat == "656":
+        values["next_attempt_at"] = now + timedelta(seconds=3600)
+    else:
+        # 137/138 sem procNFe: o AN ainda não liberou o documento completo
+        values.update(_retry(row, now, error or f"cStat {cstat}: procNFe ainda indisponível"))
+    _set(db, row, values)
+
+def retry_failed(db, empresa_id:int) -> int:
+    """Devolve as notas em ``falha`` à etapa em que pararam, com tentativas zeradas."""
+    res = db.execute(update(DFEAutoManifest).where(DFEAutoManifest.empresa_id==empresa_id, DFEAutoManifest.status==FAILED)
+                     .values(status=case((DFEAutoManifest.ciencia_cstat.is_not(None), WAITING), else_=CIENCIA),
+                             attempts=0, next_attempt_at=None, updated_at=datetime.utcnow()))
+    return res.rowcount
+
+def status(db, empresa_id:int, st:str | None = None, limit:int = 100) -> dict:
+    """Resumo por situação e notas da empresa (``st`` ou, sem filtro, as ainda não concluídas)."""
+    summary = {s: 0 for s in STATUSES}
+    for s, n in db.execute(select(DFEAutoManifest.status, func.count()).where(DFEAutoManifest.empresa_id==empresa_id)
+                           .group_by(DFEAutoManifest.status)).all():
+        summary[s] = n
+    cond = DFEAutoManifest.status==st if st else DFEAutoManifest.status != DONE
+    rows = db.execute(select(DFEAutoManifest).where(DFEAutoManifest.empresa_id==empresa_id, cond)
+                      .order_by(DFEAutoManifest.id).limit(limit)).scalars().all()
+    return {
+        "empresa_id": empresa_id,
+        "resumo": summary,
+        "notas": [{
+            "id": r.id,
+            "chave": r.chave,
+            "doc_id": r.doc_id,
+            "status": r.status,
+            "ciencia_cstat": r.ciencia_cstat,
+            "ciencia_at": r.ciencia_at.isoformat() if r.ciencia_at else None,
+            "proc_doc_id": r.proc_doc_id,
+            "attempts": r.attempts,
+            "last_cstat": r.last_cstat,
+            "last_error": r.last_error,
+            "next_attempt_at": r.next_attempt_at.isoformat() if r.next_attempt_at else None,
+        } for r in rows],
+    }
@@ -0,0 +1,104 @@
+"""Contadores por categoria de documento (tela de importação).
+
+As categorias derivam do prefixo do schema do docZip (o AN envia, por exemplo,
+``resNFe_v1.01.xsd``): ``registradas`` (procNFe), ``pendentes`` (resNFe) e
+``eventos`` (resEvento/procEventoNFe); ``todas`` é a soma. ``manifestadas`` conta
+documentos com manifestação registrada (cStat 135/136).
+
+Dois modos de leitura:
+- agregado agrupado: uma única consulta ``GROUP BY`` sobre ``dfe_documentos``;
+- tabela ``dfe_contadores`` (``DFE_COUNTERS_TABLE=true``): leitura O(1), mantida
+  incrementalmente por ``run_distribution`` (linhas efetivamente inseridas) e pela
+  manifestação, na mesma transação da escrita.
+"""
+from sqlalchemy import select, func, case, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from src.models import DFEDocumento, DFEContador
+from src.settings import settings
+
+MANIFEST_OK_CSTATS = ("135", "136")
+SCHEMA_CATEGORIES = ("registradas", "pendentes", "eventos")
+_PREFIXES = (("procNFe", "registradas"), ("resNFe", "pendentes"))
+
+def schema_category(schema: str | None) -> str:
+    for prefix, cat in _PREFIXES:
+        if (schema or "").startswith(prefix):
+            return cat
+    return "eventos"
+
+def category_expr():
+    return case(
+        *[(DFEDocumento.schema.startswith(prefix), cat) for prefix, cat in _PREFIXES],
+        else_="eventos",
+    )
+
+def category_filter(cat: str):
+    """Condição SQL equivalente a ``schema_category(schema) == cat``."""
+    if cat == "eventos":
+        return ~(DFEDocumento.schema.startswith("procNFe") | DFEDocumento.schema.startswith("resNFe"))
+    prefix = dict((c, p) for p, c in _PREFIXES)[cat]
+    return DFEDocumento.schema.startswith(prefix)
+
+def _empty() -> dict[str, int]:
+    return {**{c: 0 for c in SCHEMA_CATEGORIES}, "manifestadas": 0}
+
+def _with_total(counts: dict[str, int]) -> dict[str, int]:
+    counts["todas"] = sum(counts[c] for c in SCHEMA_CATEGORIES)
+    return counts
+
+def count_grouped(db, empresa_id: int) -> dict[str, int]:
+    """Todas as categorias em uma consulta agrupada."""
+    # subconsulta: o GROUP BY referencia a coluna rotulada, não repete o CASE parametrizado
+    sub = (select(category_expr().label("cat"), DFEDocumento.manifest_cstat)
+           .where(DFEDocumento.empresa_id == empresa_id).subquery())
+    q = (select(sub.c.cat, func.count(), func.count().filter(sub.c.manifest_cstat.in_(MANIFEST_OK_CSTATS)))
+         .group_by(sub.c.cat))
+    counts = _empty()
+    for c, n, n_man in db.execute(q).all():
+        counts[c] = counts.get(c, 0) + n
+        counts["manifestadas"] += n_man
+    return _with_total(counts)
+
+def read_table(db, empresa_id: int) -> dict[str, int]:
+    counts = _empty()
+    for c, n in db.execute(select(DFEContador.categoria, DFEContador.total).where(DFEContador.empresa_id == empresa_id)).all():
+        counts[c] = n
+    return _with_total(counts)
+
+def get_counts(db, empresa_id: int) -> dict[str, int]:
+    if settings.DFE_COUNTERS_TABLE:
+        return read_table(db, empresa_id)
+    return count_grouped(db, empresa_id)
+
+def bump(db, empresa_id: int, deltas: dict[str, int]):
+    """Soma ``deltas`` (categoria -> n) em dfe_contadores; chamar na transação da escrita."""
+    rows = [{"empresa_id": empresa_id, "categoria": c, "total": n} for c, n in deltas.items() if n]
+    if not rows:
+        return
+    stmt = pg_insert(DFEContador).values(rows)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["empresa_id", "categoria"],
+        set_={"total": DFEContador.total + stmt.excluded.total},
+    ))
+
+def bump_schemas(db, empresa_id: int, schemas) -> None:
+    deltas: dict[str, int] = {}
+    for sch in schemas:
+        c = schema_category(sch)
+        deltas[c] = deltas.get(c, 0) + 1
+    bump(db, empresa_id, deltas)
+
+def rebuild(db, empresa_id: int):
+    """Recalcula a linha de contadores da empresa a partir do agregado (correção/manutenção)."""
+    counts = count_grouped(db, empresa_id)
+    db.execute(delete(DFEContador).where(DFEContador.empresa_id == empresa_id))
+    bump(db, empresa_id, {c: counts[c] for c in (*SCHEMA_CATEGORIES, "manifestadas")})
+
+if __name__ == "__main__":
+    # python -m src.core.counters  -> recalcula dfe_contadores de todas as empresas
+    from src.store.db import SessionLocal
+    from src.models import Empresa
+    with SessionLocal() as db:
+        for (eid,) in db.execute(select(Empresa.id)).all():
+            rebuild(db, eid)
+        db.commit()
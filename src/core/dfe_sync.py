@@ -1,12 +1,17 @@
-import os
-from pathlib import Path
+import asyncio, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
 from typing import Tuple
-from lxml import etree
 from sqlalchemy import select, insert, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from src.store.db import SessionLocal
+from src.store.xml_store import put_xml, put_xml_gzip
 from src.models import Empresa, CursorDFe, DFEDocumento
 from src.settings import settings
-from src.ws.dfe_client import pull_until_idle, nfe_consultar_nsu
+from src.core.doc_fields import extract_doc_fields, scan_gzip_fields
+from src.core import counters, nsu_gaps, auto_manifest, manifest_store, metrics, sync_runs
+from src.ws.dfe_client import pull_until_idle, pull_until_idle_async, nfe_consultar_nsu, nfe_consultar_nsu_async, nfe_consultar_chave
+from src.ws.manifest_client import enviar_manifestacao_lote
 
 def _cnpj_digits(s:str)->str: return "".join([c for c in s if c.isdigit()])
 
@@ -20,44 +25,322 @@ def ensure_cursor(empresa_id:int) -> str:
         return cur.ultimo_nsu
 
 def _save_xml(empresa_cnpj:str, nsu:str, schema:str, xml_bytes:bytes) -> str:
-    base = Path(settings.STORAGE_BASE_PATH)/empresa_cnpj
-    base.mkdir(parents=True, exist_ok=True)
-    filename = f"{nsu}_{schema}.xml"
-    path = base/filename
-    path.write_bytes(xml_bytes)
-    return str(path)
-
-def run_distribution(empresa_id:int, cnpj:str, cert_tuple:Tuple[str,str], verify_ca:str|bool=None) -> dict:
-    cnpj = _cnpj_digits(cnpj)
-    last_nsu = ensure_cursor(empresa_id)
-    processed = 0; last_ult = last_nsu; last_max = last_nsu
+    # backend configurado em XML_STORAGE_BACKEND (flat legado ou endereçado por conteúdo)
+    return put_xml(empresa_cnpj, f"{nsu}_{schema}.xml", xml_bytes)
+
+# Pool compartilhado para gravação dos XMLs de uma página em paralelo
+_io_pool = ThreadPoolExecutor(max_workers=max(1, settings.DFE_IO_WORKERS), thread_name_prefix="dfe-io")
+
+# Colunas do índice único uq_dfe_empresa_nsu_schema (alvo do ON CONFLICT)
+DOC_UNIQUE_COLS = ["empresa_id", "nsu", "schema"]
+
+def _persist_docs(empresa_id:int, cnpj:str, docs:list[dict], cursor:dict|None=None, in_tx=None,
+                  timing:dict|None=None) -> dict[str,int]:
+    """Grava os XMLs de um lote (página docZip ou NSUs recuperados) e insere todas as linhas
+    em um único INSERT multi-linha, junto com a atualização do cursor, em uma só transação.
+    ``in_tx(db)``, se dado, roda na mesma transação (lacunas de NSU da página/progresso da recuperação).
+    ``timing``, se dado, recebe os segundos gastos em ``write`` (arquivos) e ``db`` (transação).
+    Retorna a contagem por schema dos documentos do lote."""
     by_schema: dict[str,int] = {}
-    prev_nsu_int = int(last_nsu)
-    CONSNSU_CAP = 10  # máximo de NSUs faltantes a consultar por execução
-    for pack in pull_until_idle(cnpj, last_nsu, cert_tuple, verify_ca):
+    t0 = time.monotonic()
+    if docs:
+        def _prepare(d):
+            # gravação por documento, no pool; os metadados (colunas indexadas) já vêm do
+            # decodificador da resposta (src.ws.dist_response), sem novo parse do XML
+            if d.get("zip") is not None:
+                # DFE_STORE_DOCZIP_RAW: bytes GZip do AN gravados como vieram
+                path = put_xml_gzip(cnpj, f"{d['nsu']}_{d['schema']}.xml", d["zip"])
+                fields = d.get("fields") or scan_gzip_fields(d["zip"])
+            else:
+                path = _save_xml(cnpj, d["nsu"], d["schema"], d["xml"])
+                fields = d.get("fields") or extract_doc_fields(d["xml"])
+            return {"empresa_id": empresa_id, "nsu": d["nsu"], "schema": d["schema"],
+                    "caminho_xml": path, **fields}
+        rows = list(_io_pool.map(_prepare, docs))
+        for d in docs:
+            sch = d["schema"] or "?"
+            by_schema[sch] = by_schema.get(sch, 0) + 1
+    t1 = time.monotonic()
+    if timing is not None:
+        timing["write"] = timing.get("write", 0.0) + t1 - t0
+    if not docs and cursor is None and in_tx is None:
+        return by_schema
+    inserted = []
+    # página do distNSU (com cursor) ou lote avulso (lacunas, procNFe da manifestação automática)
+    with metrics.DB_WRITE.labels("page" if cursor is not None else "lote").time(), SessionLocal() as db:
+        if docs:
+            inserted = db.execute(pg_insert(DFEDocumento).values(rows)
+                                  .on_conflict_do_nothing(index_elements=DOC_UNIQUE_COLS)
+                                  .returning(DFEDocumento.id, DFEDocumento.schema, DFEDocumento.chave)).all()
+            # contadores só avançam pelas linhas efetivamente inseridas (conflitos são no-op)
+            counters.bump_schemas(db, empresa_id, [r.schema for r in inserted])
+            if settings.DFE_AUTO_MANIFEST:
+                # resNFe novo entra na fila de Ciência; procNFe da página conclui a nota pendente
+                auto_manifest.ingest(db, empresa_id, inserted, rows)
+        if cursor is not None:
+            db.execute(update(CursorDFe).where(CursorDFe.empresa_id==empresa_id).values(
+                ultimo_nsu=cursor["ultNSU"], max_nsu=cursor["maxNSU"]
+            ))
+        if in_tx is not None:
+            in_tx(db)
+        db.commit()
+    if timing is not None:
+        timing["db"] = timing.get("db", 0.0) + time.monotonic() - t1
+    metrics.docs_ingested([r.schema for r in inserted])
+    return by_schema
+
+def _merge_counts(dst:dict[str,int], src:dict[str,int]):
+    for k, v in src.items():
+        dst[k] = dst.get(k, 0) + v
+
+def _claim_gaps(empresa_id:int, budget:int|None) -> list:
+    budget = settings.DFE_GAP_MAX_PER_RUN if budget is None else budget
+    if budget <= 0:
+        return []
+    with SessionLocal() as db:
+        return nsu_gaps.claim(db, empresa_id, budget)
+
+def _apply_gap_results(empresa_id:int, cnpj:str, work:list, results:dict[int,dict]) -> dict:
+    """Progresso dos intervalos e lote único dos documentos recuperados (mesma transação)."""
+    out = {"processed": 0, "consulted": 0, "by_schema": {}, "cStat": None}
+    docs: list[dict] = []
+    progress: list[dict] = []
+    for gap, nsus in work:
+        nxt = gap.next_nsu; recovered = empty = 0; cstat = error = None
+        # avança só pelo prefixo contíguo consultado com sucesso; o resto fica para a próxima rodada
+        for n in nsus:
+            res = results[n]
+            if res.get("skipped"):
+                break
+            out["consulted"] += 1
+            if "error" in res:
+                error = f"{res.get('error')}: {res.get('detail') or ''}"
+                break
+            cstat = res.get("cStat")
+            if cstat == "138":
+                got = res.get("docs") or []
+                docs += got; recovered += 1
+            elif cstat == "137":
+                empty += 1
+            else:
+                error = f"cStat {cstat}: {res.get('xMotivo') or ''}"
+                break
+            nxt = n + 1
+        if cstat == "656":
+            out["cStat"] = "656"
+        progress.append({"gap": gap, "next_nsu": nxt, "recovered": recovered, "empty": empty, "cstat": cstat, "error": error})
+
+    def _advance(db):
+        for p in progress:
+            nsu_gaps.advance(db, **p)
+    out["by_schema"] = _persist_docs(empresa_id, cnpj, docs, in_tx=_advance)
+    out["processed"] = len(docs)
+    return out
+
+def recover_gaps(empresa_id:int, cnpj:str, cert_tuple:Tuple[str,str], verify_ca:str|bool=None,
+                 deadline:float|None=None, budget:int|None=None, heartbeat=None) -> dict:
+    """Consulta por consNSU até ``budget`` NSUs pendentes em ``dfe_nsu_gaps`` (menores primeiro),
+    com até ``DFE_GAP_WORKERS`` consultas simultâneas; o ritmo por host fica com o governador.
+    Documentos recuperados entram em um único lote (``_persist_docs``) junto com o progresso dos
+    intervalos. Um 656 interrompe a rodada (``cStat`` no retorno). ``heartbeat()``, se dado, é
+    chamado após cada consulta."""
+    cnpj = _cnpj_digits(cnpj)
+    work = _claim_gaps(empresa_id, budget)
+    if not work:
+        return {"processed": 0, "consulted": 0, "by_schema": {}, "cStat": None}
+    halt = threading.Event()
+
+    def _one(nsu:int) -> dict:
+        if halt.is_set() or (deadline is not None and time.time() >= deadline):
+            return {"skipped": True}
+        res = nfe_consultar_nsu(cnpj, str(nsu), cert_tuple, verify_ca)
+        if res.get("cStat") == "656":
+            halt.set()
+        if heartbeat is not None:
+            heartbeat()
+        return res
+
+    flat = [n for _, nsus in work for n in nsus]
+    with ThreadPoolExecutor(max_workers=max(1, settings.DFE_GAP_WORKERS), thread_name_prefix="dfe-gap") as pool:
+        results = dict(zip(flat, pool.map(_one, flat)))
+    return _apply_gap_results(empresa_id, cnpj, work, results)
+
+async def recover_gaps_async(empresa_id:int, cnpj:str, cert_tuple:Tuple[str,str], verify_ca:str|bool=None,
+                             deadline:float|None=None, budget:int|None=None, heartbeat=None) -> dict:
+    """``recover_gaps`` sobre o transporte assíncrono (``DFE_GAP_WORKERS`` consultas em voo)."""
+    cnpj = _cnpj_digits(cnpj)
+    work = await asyncio.to_thread(_claim_gaps, empresa_id, budget)
+    if not work:
+        return {"processed": 0, "consulted": 0, "by_schema": {}, "cStat": None}
+    sem = asyncio.Semaphore(max(1, settings.DFE_GAP_WORKERS))
+    halted = False
+
+    async def _one(nsu:int) -> dict:
+        nonlocal halted
+        async with sem:
+            if halted or (deadline is not None and time.time() >= deadline):
+                return {"skipped": True}
+            res = await nfe_consultar_nsu_async(cnpj, str(nsu), cert_tuple, verify_ca)
+            if res.get("cStat") == "656":
+                halted = True
+            if heartbeat is not None:
+                await asyncio.to_thread(heartbeat)
+            return res
+
+    flat = [n for _, nsus in work for n in nsus]
+    results = dict(zip(flat, await asyncio.gather(*(_one(n) for n in flat))))
+    return await asyncio.to_thread(_apply_gap_results, empresa_id, cnpj, work, results)
+
+def _apply_fetch_results(empresa_id:int, cnpj:str, work:list, results:list[dict]) -> dict:
+    """Documentos das chaves consultadas em um único lote; nota sem procNFe volta a esperar."""
+    out = {"consulted": 0, "fetched": 0, "docs": 0, "by_schema": {}, "cStat": None}
+    docs: list[dict] = []
+    pending: list[tuple] = []
+    for row, res in zip(work, results):
+        if res.get("skipped"):
+            continue
+        out["consulted"] += 1
+        cstat = res.get("cStat")
+        got = (res.get("docs") or []) if cstat == "138" else []
+        docs += got
+        if any((d.get("schema") or "").startswith("procNFe") for d in got):
+            out["fetched"] += 1  # ligado ao resNFe pelo gancho de _persist_docs
+            continue
+        if cstat == "656":
+            out["cStat"] = "656"
+        error = f"{res.get('error')}: {res.get('detail') or ''}" if "error" in res else None
+        if cstat and cstat not in ("137", "138"):
+            error = f"cStat {cstat}: {res.get('xMotivo') or ''}"
+        pending.append((row, cstat, error))
+
+    def _reschedule(db):
+        for row, cstat, error in pending:
+            auto_manifest.fetch_result(db, row, cstat, error)
+    out["by_schema"] = _persist_docs(empresa_id, cnpj, docs, in_tx=_reschedule)
+    out["docs"] = len(docs)
+    return out
+
+def run_auto_manifest(empresa_id:int, cnpj:str, cert_tuple:Tuple[str,str], verify_ca:str|bool=None,
+                      deadline:float|None=None, heartbeat=None) -> dict:
+    """Avança a manifestação automática da empresa (src/core/auto_manifest.py): Ciência em lotes
+    envEvento para até ``DFE_AUTO_MANIFEST_MAX_PER_RUN`` notas e consChNFe para até
+    ``DFE_AUTO_MANIFEST_FETCH_PER_RUN`` notas já com Ciência, ``DFE_GAP_WORKERS`` por vez (ritmo
+    por host com o governador). Um 656 interrompe as consultas (``cStat`` no retorno).
+    ``heartbeat()``, se dado, é chamado após o envio da Ciência e após cada consulta."""
+    cnpj = _cnpj_digits(cnpj)
+    out = {"ciencia": 0, "ciencia_ok": 0, "consulted": 0, "fetched": 0, "docs": 0, "by_schema": {}, "cStat": None}
+
+    def expired() -> bool:
+        return deadline is not None and time.time() >= deadline
+
+    with SessionLocal() as db:
+        auto_manifest.skip_manifested(db, empresa_id)
+        db.commit()
+        work = auto_manifest.claim(db, empresa_id, auto_manifest.CIENCIA, settings.DFE_AUTO_MANIFEST_MAX_PER_RUN)
+    if work and not expired():
+        results = enviar_manifestacao_lote(cnpj, [(r.chave, auto_manifest.TP_CIENCIA, 1) for r in work], cert_tuple, verify_ca)
+        with SessionLocal() as db:
+            manifest_store.update_lote(db, cnpj, empresa_id, results)
+            out["ciencia_ok"] = sum(auto_manifest.ciencia_result(db, row, res) for row, res in zip(work, results))
+            db.commit()
+        out["ciencia"] = len(work)
+        if heartbeat is not None:
+            heartbeat()
+    with SessionLocal() as db:
+        work = auto_manifest.claim(db, empresa_id, auto_manifest.WAITING, settings.DFE_AUTO_MANIFEST_FETCH_PER_RUN)
+    if not work:
+        return out
+    halt = threading.Event()
+
+    def _one(row) -> dict:
+        if halt.is_set() or expired():
+            return {"skipped": True}
+        res = nfe_consultar_chave(cnpj, row.chave, cert_tuple, verify_ca)
+        if res.get("cStat") == "656":
+            halt.set()
+        if heartbeat is not None:
+            heartbeat()
+        return res
+
+    with ThreadPoolExecutor(max_workers=max(1, settings.DFE_GAP_WORKERS), thread_name_prefix="dfe-chave") as pool:
+        results = list(pool.map(_one, work))
+    fetch = _apply_fetch_results(empresa_id, cnpj, work, results)
+    out.update({k: fetch[k] for k in ("consulted", "fetched", "docs", "by_schema", "cStat")})
+    return out
+
+_HEARTBEAT_SEC = 30  # bem abaixo de DFE_JOB_STALE_SEC
+
+class _DistributionRun:
+    """Estado de uma execução de ``run_distribution``: consome os pacotes do pull (síncrono ou
+    assíncrono), persiste cada página e monta o retorno."""
+
+    def __init__(self, empresa_id:int, cnpj:str, progress=None):
+        self.trace = sync_runs.RunTrace()
+        self.empresa_id = empresa_id
+        self.cnpj = _cnpj_digits(cnpj)
+        self.start_nsu = ensure_cursor(empresa_id)
+        self.processed = 0; self.last_ult = self.start_nsu; self.last_max = self.start_nsu; self.last_cstat = None
+        self.by_schema: dict[str,int] = {}
+        self.prev_nsu_int = int(self.start_nsu)
+        self.out: dict | None = None
+        self.recover = True  # drenar lacunas de NSU ao final
+        self.pages = 0
+        self.progress = progress  # callback(snapshot()) após cada página gravada (fila dfe_jobs)
+        self._beat_lock = threading.Lock()
+        self._beat_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        return {"processed": self.processed, "pages": self.pages, "startNSU": self.start_nsu,
+                "ultNSU": self.last_ult, "maxNSU": self.last_max}
+
+    def beat(self):
+        """Sinal de vida nas etapas sem página (lacunas, manifestação automática): repassa o
+        progresso no máximo a cada ``_HEARTBEAT_SEC``, para o job não ser dado como abandonado."""
+        if self.progress is None:
+            return
+        with self._beat_lock:
+            now = time.monotonic()
+            if now - self._beat_at < _HEARTBEAT_SEC:
+                return
+            self._beat_at = now
+        try:
+            self.progress(self.snapshot())
+        except Exception as e:
+            print(f"[DFE] empresa_id={self.empresa_id} falha ao registrar progresso: {e}")
+
+    def handle(self, pack:dict) -> bool:
+        """Processa um pacote do pull; True encerra o laço."""
         # Tratamento de erros e paradas explícitas
         if "error" in pack:
-            return {"ok": False, "error": pack}
+            self.out = {"ok": False, "error": pack}
+            self.recover = False
+            return True
         if pack.get("stopped"):
+            if pack.get("timing"):
+                # página que respondeu 656/108/109 (paradas por prazo/cota não chamaram o AN)
+                self.trace.page(self.pages + 1, pack, 0, pack["timing"])
             # Atualiza cursor e retorna status amigável (ex.: consumo indevido / serviço paralisado)
             try:
                 with SessionLocal() as db:
-                    db.execute(update(CursorDFe).where(CursorDFe.empresa_id==empresa_id).values(
-                        ultimo_nsu=pack.get("ultNSU", last_ult), max_nsu=pack.get("maxNSU", last_max)
+                    db.execute(update(CursorDFe).where(CursorDFe.empresa_id==self.empresa_id).values(
+                        ultimo_nsu=pack.get("ultNSU", self.last_ult), max_nsu=pack.get("maxNSU", self.last_max)
                     ))
                     db.commit()
             except Exception:
                 pass
-            return {
+            self.out = {
                 "ok": True,
-                "processed": processed,
-                "ultNSU": pack.get("ultNSU", last_ult),
-                "maxNSU": pack.get("maxNSU", last_max),
-                "by_schema": by_schema,
+                "processed": self.processed,
+                "ultNSU": pack.get("ultNSU", self.last_ult),
+                "maxNSU": pack.get("maxNSU", self.last_max),
+                "by_schema": self.by_schema,
                 "stopped": True,
                 "reason": pack.get("reason"),
                 "wait_sec": pack.get("wait_sec"),
+                "cStat": pack.get("cStat") or self.last_cstat,
             }
+            self.recover = pack.get("reason") == "page_quota"
+            return True
 
         docs = pack.get("docs") or pack.get("batch") or []
         # Ordenar NSUs recebidos para detectar lacunas
@@ -68,63 +351,93 @@ def run_distribution(empresa_id:int, cnpj:str, cert_tuple:Tuple[str,str], verify
             except Exception:
                 continue
         nsus_sorted.sort()
-        # Persistir
-        with SessionLocal() as db:
-            for d in docs:
-                xml = d["xml"]
-                # extrair chave se houver (procNFe/resNFe)
-                chave = None
-                try:
-                    node = etree.fromstring(xml)
-                    ns={"nfe":"http://www.portalfiscal.inf.br/nfe"}
-                    ch = node.find(".//nfe:chNFe", ns)
-                    if ch is not None: chave = ch.text
-                except Exception:
-                    pass
-                path = _save_xml(cnpj, d["nsu"], d["schema"], xml)
-                db.execute(insert(DFEDocumento).values(
-                    empresa_id=empresa_id, nsu=d["nsu"], schema=d["schema"], chave=chave, caminho_xml=path
-                ))
-                sch = d["schema"] or "?"
-                by_schema[sch] = by_schema.get(sch, 0) + 1
-            # atualizar cursor
-            db.execute(update(CursorDFe).where(CursorDFe.empresa_id==empresa_id).values(
-                ultimo_nsu=pack.get("ultNSU", last_ult), max_nsu=pack.get("maxNSU", last_max)
-            ))
-            db.commit()
-        processed += len(docs)
-        last_ult = pack.get("ultNSU", last_ult); last_max = pack.get("maxNSU", last_max)
-        # Recuperar lacunas com consNSU (limitado)
-        fetched_missing = 0
-        for nsu_int in nsus_sorted:
-            if fetched_missing >= CONSNSU_CAP:
+        gaps, self.prev_nsu_int = nsu_gaps.find_gaps(self.prev_nsu_int, nsus_sorted)
+        # Persistir página inteira (arquivos em paralelo + INSERT multi-linha + cursor + lacunas)
+        timing = dict(pack.get("timing") or {})
+        _merge_counts(self.by_schema, _persist_docs(self.empresa_id, self.cnpj, docs, {
+            "ultNSU": pack.get("ultNSU", self.last_ult), "maxNSU": pack.get("maxNSU", self.last_max)
+        }, in_tx=lambda db: nsu_gaps.record(db, self.empresa_id, gaps), timing=timing))
+        self.processed += len(docs)
+        self.last_ult = pack.get("ultNSU", self.last_ult); self.last_max = pack.get("maxNSU", self.last_max)
+        self.last_cstat = pack.get("cStat", self.last_cstat)
+        self.pages += 1
+        self.trace.page(self.pages, pack, len(docs), timing)
+        if self.progress is not None:
+            self._beat_at = time.monotonic()
+            self.progress(self.snapshot())
+        return False
+
+    def auto_manifest_due(self, rec:dict | None) -> bool:
+        """A manifestação automática roda depois das lacunas, se o ciclo não parou em erro/656."""
+        return settings.DFE_AUTO_MANIFEST and self.recover and (rec is None or rec["cStat"] != "656")
+
+    def finish(self, rec:dict | None, am:dict | None = None) -> dict:
+        """Retorno final, somando a recuperação de lacunas (``rec``) e a manifestação automática
+        (``am``) quando houve."""
+        out = self.out or {"ok":True,"processed":self.processed,"ultNSU":self.last_ult,"maxNSU":self.last_max,
+                           "by_schema": self.by_schema, "cStat": self.last_cstat}
+        halted = False
+        if rec is not None:
+            _merge_counts(self.by_schema, rec["by_schema"])
+            out["processed"] += rec["processed"]
+            out["gaps"] = {"consulted": rec["consulted"], "recovered": rec["processed"]}
+            halted = rec["cStat"] == "656"
+        if am is not None:
+            _merge_counts(self.by_schema, am["by_schema"])
+            out["processed"] += am["docs"]
+            out["auto_manifest"] = {k: am[k] for k in ("ciencia", "ciencia_ok", "consulted", "fetched")}
+            halted = halted or am["cStat"] == "656"
+        if halted:
+            out.update(stopped=True, reason="consumo_indevido", wait_sec=3600, cStat="656")
+        return out
+
+    def close(self, out:dict, origem:str, job_id:int | None) -> dict:
+        """Fecha o trace da execução: grava em dfe_sync_runs e o inclui no retorno (``trace``, ``run_id``)."""
+        self.trace.close()
+        out["run_id"] = sync_runs.record(self.empresa_id, self.trace, out, self.start_nsu, origem, job_id)
+        out["trace"] = self.trace.as_dict()
+        metrics.sync_run(out, self.trace.duration)
+        return out
+
+def run_distribution(empresa_id:int, cnpj:str, cert_tuple:Tuple[str,str], verify_ca:str|bool=None,
+                     deadline:float|None=None, max_pages:int|None=None, progress=None,
+                     origem:str="agendador", job_id:int|None=None) -> dict:
+    """Puxa documentos até ociosidade, 656, erro ou até ``deadline``/``max_pages`` (ver pull_until_idle).
+    ``progress(dict)``, se dado, recebe processed/pages/startNSU/ultNSU/maxNSU a cada página.
+    A execução fica em dfe_sync_runs (``origem``/``job_id``) com o tempo por etapa de cada página."""
+    run = _DistributionRun(empresa_id, cnpj, progress)
+    for pack in pull_until_idle(run.cnpj, run.start_nsu, cert_tuple, verify_ca, deadline=deadline, max_pages=max_pages):
+        if run.handle(pack):
+            break
+    rec = am = None
+    if run.recover:
+        # Lacunas de NSU (desta execução e das anteriores) por consNSU, dentro do mesmo prazo
+        with run.trace.timed("gaps"):
+            rec = recover_gaps(empresa_id, run.cnpj, cert_tuple, verify_ca, deadline=deadline, heartbeat=run.beat)
+    if run.auto_manifest_due(rec):
+        # Ciência das notas novas e busca dos procNFe já liberados (DFE_AUTO_MANIFEST)
+        with run.trace.timed("auto_manifest"):
+            am = run_auto_manifest(empresa_id, run.cnpj, cert_tuple, verify_ca, deadline=deadline, heartbeat=run.beat)
+    return run.close(run.finish(rec, am), origem, job_id)
+
+async def run_distribution_async(empresa_id:int, cnpj:str, cert_tuple:Tuple[str,str], verify_ca:str|bool=None,
+                                 deadline:float|None=None, max_pages:int|None=None, progress=None,
+                                 origem:str="api", job_id:int|None=None) -> dict:
+    """``run_distribution`` para as rotas async: a rede não ocupa threads; banco e gravação
+    dos XMLs de cada página rodam em thread (``asyncio.to_thread``)."""
+    run = await asyncio.to_thread(_DistributionRun, empresa_id, cnpj, progress)
+    async with aclosing(pull_until_idle_async(run.cnpj, run.start_nsu, cert_tuple, verify_ca,
+                                              deadline=deadline, max_pages=max_pages)) as packs:
+        async for pack in packs:
+            if await asyncio.to_thread(run.handle, pack):
                 break
-            if nsu_int - prev_nsu_int > 1:
-                gap_start = prev_nsu_int + 1
-                gap_end = min(nsu_int - 1, gap_start + (CONSNSU_CAP - fetched_missing) - 1)
-                for miss in range(gap_start, gap_end + 1):
-                    res = nfe_consultar_nsu(cnpj, str(miss), cert_tuple, verify_ca)
-                    if 'error' in res:
-                        break
-                    for d in (res.get('docs') or []):
-                        xml = d["xml"]
-                        chave = None
-                        try:
-                            node = etree.fromstring(xml)
-                            ns={"nfe":"http://www.portalfiscal.inf.br/nfe"}
-                            ch = node.find(".//nfe:chNFe", ns)
-                            if ch is not None: chave = ch.text
-                        except Exception:
-                            pass
-                        path = _save_xml(cnpj, d["nsu"], d["schema"], xml)
-                        with SessionLocal() as db:
-                            db.execute(insert(DFEDocumento).values(
-                                empresa_id=empresa_id, nsu=d["nsu"], schema=d["schema"], chave=chave, caminho_xml=path
-                            ))
-                            db.commit()
-                        processed += 1
-                        sch = d["schema"] or "?"
-                        by_schema[sch] = by_schema.get(sch, 0) + 1
-                    fetched_missing += 1
-            prev_nsu_int = nsu_int
-    return {"ok":True,"processed":processed,"ultNSU":last_ult,"maxNSU":last_max, "by_schema": by_schema}
\ No newline at end of file
+    rec = am = None
+    if run.recover:
+        with run.trace.timed("gaps"):
+            rec = await recover_gaps_async(empresa_id, run.cnpj, cert_tuple, verify_ca, deadline=deadline,
+                                           heartbeat=run.beat)
+    if run.auto_manifest_due(rec):
+        with run.trace.timed("auto_manifest"):
+            am = await asyncio.to_thread(run_auto_manifest, empresa_id, run.cnpj, cert_tuple, verify_ca, deadline,
+                                         run.beat)
+    return await asyncio.to_thread(run.close, run.finish(rec, am), origem, job_id)
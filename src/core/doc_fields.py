@@ -0,0 +1,155 @@
+"""Extração dos metadados de um documento DF-e (resNFe, procNFe, resEvento, procEventoNFe).
+
+Executada uma vez na ingestão (``run_distribution``) e no backfill; o resultado vai
+para colunas indexadas de ``dfe_documentos``, de modo que a listagem da UI não
+precisa abrir nem parsear o XML de cada linha.
+"""
+import zlib
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from lxml import etree
+
+NS = {"nfe": "http://www.portalfiscal.inf.br/nfe"}
+
+# Código IBGE da UF (2 primeiros dígitos da chave) -> sigla
+CUF_SIGLA = {
+    "11":"RO","12":"AC","13":"AM","14":"RR","15":"PA","16":"AP","17":"TO",
+    "21":"MA","22":"PI","23":"CE","24":"RN","25":"PB","26":"PE","27":"AL","28":"SE","29":"BA",
+    "31":"MG","32":"ES","33":"RJ","35":"SP","41":"PR","42":"SC","43":"RS",
+    "50":"MS","51":"MT","52":"GO","53":"DF",
+}
+
+# Colunas de dfe_documentos preenchidas por extract_doc_fields
+FIELD_COLUMNS = ("chave", "emitente_cnpj", "emitente_nome", "data_emissao", "valor", "uf", "destinatario_cnpj", "tp_evento")
+
+def _text(root, *paths):
+    for xp in paths:
+        el = root.find(xp, NS)
+        if el is not None and el.text:
+            return el.text.strip()
+    return None
+
+def _date(txt):
+    try:
+        return date.fromisoformat(txt[:10]) if txt else None
+    except ValueError:
+        return None
+
+def _decimal(txt):
+    try:
+        return Decimal(txt) if txt else None
+    except InvalidOperation:
+        return None
+
+def fields_from_tree(root) -> dict:
+    """Metadados a partir de um elemento já parseado (raiz do documento)."""
+    data: dict = {}
+    data["chave"] = _text(root, ".//nfe:chNFe", ".//nfe:infProt/nfe:chNFe")
+    if data["chave"] is None:
+        # procNFe: chave no Id do infNFe (NFe + 44 dígitos)
+        inf = root.find(".//nfe:infNFe", NS)
+        if inf is not None and (inf.get("Id") or "").startswith("NFe"):
+            data["chave"] = inf.get("Id")[3:]
+    if root.find(".//nfe:emit", NS) is not None:
+        # procNFe/NFe completa
+        data["emitente_cnpj"] = _text(root, ".//nfe:emit/nfe:CNPJ", ".//nfe:emit/nfe:CPF")
+        data["emitente_nome"] = _text(root, ".//nfe:emit/nfe:xNome")
+        data["uf"] = _text(root, ".//nfe:emit/nfe:enderEmit/nfe:UF")
+        data["destinatario_cnpj"] = _text(root, ".//nfe:dest/nfe:CNPJ", ".//nfe:dest/nfe:CPF")
+    else:
+        # Resumos (resNFe/resEvento): CNPJ/CPF e xNome do emitente/autor no primeiro nível
+        data["emitente_cnpj"] = _text(root, "nfe:CNPJ", "nfe:CPF", ".//nfe:CNPJ", ".//nfe:CPF")
+        data["emitente_nome"] = _text(root, "nfe:xNome", ".//nfe:xNome")
+    if not data.get("uf") and data["chave"]:
+        data["uf"] = CUF_SIGLA.get(data["chave"][:2])
+    data["data_emissao"] = _date(_text(root, ".//nfe:dhEmi", ".//nfe:dEmi"))
+    data["valor"] = _decimal(_text(root, ".//nfe:ICMSTot/nfe:vNF", ".//nfe:vNF"))
+    data["tp_evento"] = _text(root, ".//nfe:tpEvento")
+    return {k: data.get(k) for k in FIELD_COLUMNS}
+
+def extract_doc_fields(xml_bytes: bytes) -> dict:
+    """Metadados do documento; campos ausentes ou XML inválido resultam em None."""
+    try:
+        root = etree.fromstring(xml_bytes)
+    except Exception:
+        return {k: None for k in FIELD_COLUMNS}
+    return fields_from_tree(root)
+
+def as_json(fields: dict) -> dict:
+    """Versão serializável (datas ISO, valor como texto) para respostas da API."""
+    out = {}
+    for k, v in fields.items():
+        if isinstance(v, date):
+            v = v.isoformat()
+        elif isinstance(v, Decimal):
+            v = str(v)
+        out[k] = v
+    return out
+
+# Varredura em streaming (docZip guardado comprimido, DFE_STORE_DOCZIP_RAW)
+_SCAN_CHUNK = 16 * 1024
+_EMIT_PATHS = {("emit", "CNPJ"): "emitente_cnpj", ("emit", "CPF"): "emitente_cnpj",
+               ("emit", "xNome"): "emitente_nome", ("enderEmit", "UF"): "uf",
+               ("dest", "CNPJ"): "destinatario_cnpj", ("dest", "CPF"): "destinatario_cnpj"}
+
+def _local(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+def scan_gzip_fields(gz: bytes) -> dict:
+    """Mesmos campos de ``fields_from_tree``, lidos de um docZip GZip sem inflar o documento
+    inteiro em memória: descomprime em blocos, alimenta um parser incremental e para ao fim
+    de ``infNFe`` (em procNFe, o que vem depois — Signature e protNFe — não é lido)."""
+    found: dict = {}
+    first_level: dict = {}
+    any_level: dict = {}
+    stack: list[str] = []
+    parser = etree.XMLPullParser(events=("start", "end"))
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    done = False
+    try:
+        for i in range(0, len(gz), _SCAN_CHUNK):
+            parser.feed(inflater.decompress(gz[i:i + _SCAN_CHUNK]))
+            for ev, el in parser.read_events():
+                name = _local(el.tag)
+                if ev == "start":
+                    stack.append(name)
+                    if name == "infNFe" and (el.get("Id") or "").startswith("NFe"):
+                        found.setdefault("chave_id", el.get("Id")[3:])
+                    continue
+                stack.pop()
+                txt = (el.text or "").strip() or None
+                if txt:
+                    parent = stack[-1] if stack else ""
+                    key = _EMIT_PATHS.get((parent, name))
+                    if key:
+                        found.setdefault(key, txt)
+                    if name in ("CNPJ", "CPF", "xNome"):
+                        target = first_level if len(stack) == 1 else any_level
+                        target.setdefault("nome" if name == "xNome" else name, txt)
+                    if name in ("chNFe", "dhEmi", "dEmi", "tpEvento", "vNF"):
+                        found.setdefault(name, txt)
+                    if name == "vNF" and parent == "ICMSTot":
+                        found.setdefault("vNF_tot", txt)
+                el.clear()  # libera os nós já processados
+                if name == "infNFe":
+                    done = True
+                    break
+            if done:
+                break
+    except (zlib.error, etree.XMLSyntaxError):
+        return {k: None for k in FIELD_COLUMNS}
+
+    data: dict = {"chave": found.get("chNFe") or found.get("chave_id")}
+    if "emitente_cnpj" in found or "emitente_nome" in found:
+        for k in ("emitente_cnpj", "emitente_nome", "uf", "destinatario_cnpj"):
+            data[k] = found.get(k)
+    else:
+        data["emitente_cnpj"] = (first_level.get("CNPJ") or first_level.get("CPF")
+                                 or any_level.get("CNPJ") or any_level.get("CPF"))
+        data["emitente_nome"] = first_level.get("nome") or any_level.get("nome")
+    if not data.get("uf") and data["chave"]:
+        data["uf"] = CUF_SIGLA.get(data["chave"][:2])
+    data["data_emissao"] = _date(found.get("dhEmi") or found.get("dEmi"))
+    data["valor"] = _decimal(found.get("vNF_tot") or found.get("vNF"))
+    data["tp_evento"] = found.get("tpEvento")
+    return {k: data.get(k) for k in FIELD_COLUMNS}
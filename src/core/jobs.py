@@ -0,0 +1,228 @@
+"""Fila de sincronizações disparadas pela API (tabela ``dfe_jobs``).
+
+``POST /api/dfe/sync`` só enfileira e devolve o id do job: um backfill leva minutos e não
+cabe em uma requisição HTTP. Os workers (threads no processo da API, ``DFE_JOB_WORKERS``,
+e/ou ``python -m src.jobs.sync_worker``) tomam os jobs com ``FOR UPDATE SKIP LOCKED``,
+executam ``run_distribution`` e gravam o progresso a cada página; ``GET /api/dfe/jobs/{id}``
+devolve documentos processados, NSU atual vs maxNSU, taxa e ETA.
+
+Duas travas consultivas (advisory locks) do Postgres por empresa:
+
+- enfileirar (transação): "existe job ativo?" + INSERT são serializados; pedidos repetidos
+  devolvem o job em fila/execução em vez de criar outro;
+- executar (sessão dedicada): mantida pelo worker e pelo agendador durante todo o ciclo;
+  quem não a obtém não puxa. Evita duas execuções simultâneas sobre o mesmo ``cursor_dfe``.
+
+Job em execução sem progresso há ``DFE_JOB_STALE_SEC`` (processo encerrado no meio) é
+marcado como ``erro`` e deixa de bloquear a empresa. O progresso é gravado a cada página e,
+na recuperação de lacunas e na manifestação automática, a cada 30 s (``_DistributionRun.beat``).
+"""
+import threading, time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import certifi
+from sqlalchemy import select, update, text
+from src.store.db import SessionLocal, lock_engine
+from src.models import Empresa, DFEJob
+from src.cert import cert_manager
+from src.core import agenda
+from src.core.dfe_sync import run_distribution
+from src.settings import settings
+
+QUEUED, RUNNING, DONE, FAILED = "fila", "executando", "concluido", "erro"
+ACTIVE = (QUEUED, RUNNING)
+
+# classe das travas consultivas (1º inteiro); o 2º é o empresa_id
+_LOCK_ENQUEUE = 0x44460001
+_LOCK_RUN = 0x44460002
+
+_wakeup = threading.Event()  # enfileirado neste processo: acorda os workers sem esperar a varredura
+_stop = threading.Event()
+_threads: list[threading.Thread] = []
+
+def _reap_stale(db):
+    now = datetime.utcnow()
+    db.execute(update(DFEJob).where(
+        DFEJob.status==RUNNING, DFEJob.updated_at < now - timedelta(seconds=settings.DFE_JOB_STALE_SEC)
+    ).values(status=FAILED, error="abandonado: worker sem progresso", finished_at=now, updated_at=now))
+
+def enqueue(empresa_id:int, force:bool=False) -> tuple[dict, bool]:
+    """Job de sincronização da empresa: o ativo (fila/executando), se houver, ou um novo.
+    Devolve (job, criado)."""
+    with SessionLocal() as db:
+        db.execute(text("SELECT pg_advisory_xact_lock(:k, :id)"), {"k": _LOCK_ENQUEUE, "id": empresa_id})
+        _reap_stale(db)
+        job = db.execute(select(DFEJob).where(DFEJob.empresa_id==empresa_id, DFEJob.status.in_(ACTIVE))
+                         .order_by(DFEJob.id).limit(1)).scalar_one_or_none()
+        created = job is None
+        if created:
+            job = DFEJob(empresa_id=empresa_id, status=QUEUED, force=force)
+            db.add(job)
+        elif force and job.status == QUEUED:
+            job.force = True
+        db.commit()  # libera a trava
+        out = as_dict(job)
+    if created:
+        _wakeup.set()
+    return out, created
+
+def get(job_id:int) -> dict | None:
+    with SessionLocal() as db:
+        job = db.get(DFEJob, job_id)
+        return as_dict(job) if job is not None else None
+
+def recent(empresa_id:int, limit:int=20) -> list[dict]:
+    with SessionLocal() as db:
+        return [as_dict(j) for j in db.execute(select(DFEJob).where(DFEJob.empresa_id==empresa_id)
+                                               .order_by(DFEJob.id.desc()).limit(limit)).scalars()]
+
+@contextmanager
+def empresa_lock(empresa_id:int):
+    """Trava de execução da empresa em uma conexão própria (``lock_engine``, fora do pool das
+    sessões); produz True se obtida (sem esperar). Se a conexão cair, o Postgres libera a trava."""
+    with lock_engine.connect() as conn:
+        locked = bool(conn.execute(text("SELECT pg_try_advisory_lock(:k, :id)"), {"k": _LOCK_RUN, "id": empresa_id}).scalar())
+        conn.commit()  # a trava é de sessão: não segura transação aberta durante o ciclo
+        try:
+            yield locked
+        finally:
+            if locked:
+                conn.execute(text("SELECT pg_advisory_unlock(:k, :id)"), {"k": _LOCK_RUN, "id": empresa_id})
+                conn.commit()
+
+def _claim() -> DFEJob | None:
+    with SessionLocal() as db:
+        _reap_stale(db)
+        job = db.execute(select(DFEJob).where(DFEJob.status==QUEUED).order_by(DFEJob.id)
+                         .limit(1).with_for_update(skip_locked=True)).scalar_one_or_none()
+        if job is not None:
+            now = datetime.utcnow()
+            job.status = RUNNING; job.started_at = now; job.updated_at = now
+        db.commit()
+        if job is not None:
+            db.refresh(job)
+            db.expunge(job)
+        return job
+
+def _update(job_id:int, **values):
+    values["updated_at"] = datetime.utcnow()
+    with SessionLocal() as db:
+        db.execute(update(DFEJob).where(DFEJob.id==job_id).values(**values))
+        db.commit()
+
+def _progress(job_id:int, snap:dict):
+    _update(job_id, processed=snap["processed"], pages=snap["pages"], start_nsu=snap["startNSU"],
+            ult_nsu=snap["ultNSU"], max_nsu=snap["maxNSU"])
+
+def _finish(job_id:int, res:dict):
+    err = res.get("error")
+    values = {"status": DONE if res.get("ok") else FAILED, "result": res, "finished_at": datetime.utcnow()}
+    if isinstance(err, dict):
+        err = err.get("detail") or err.get("error")
+    if err:
+        values["error"] = str(err)[:1000]
+    if "ultNSU" in res:
+        values.update(processed=res.get("processed") or 0, ult_nsu=res.get("ultNSU"), max_nsu=res.get("maxNSU"))
+    _update(job_id, **values)
+
+def _run_locked(job:DFEJob) -> dict:
+    started_at = datetime.utcnow()
+    with SessionLocal() as db:
+        emp = db.get(Empresa, job.empresa_id)
+        row = agenda.get(db, job.empresa_id)
+    if emp is None:
+        return {"ok": False, "error": {"error": "empresa_nao_encontrada"}}
+    # o agendador pode ter rodado a empresa enquanto o job esperava a trava
+    wait = agenda.hold_sec(row, started_at, job.force)
+    if wait:
+        return {"ok": True, "skipped": True, "retry_after_sec": wait, "agenda": agenda.as_dict(row)}
+    lc = cert_manager.get(emp.id)
+    if lc is None:
+        return {"ok": False, "error": {"error": "sem_certificado"}}
+    try:
+        res = run_distribution(emp.id, emp.cnpj, lc.cert_tuple, certifi.where(),
+                               progress=lambda snap: _progress(job.id, snap), origem="api", job_id=job.id)
+    except Exception as e:
+        res = {"ok": False, "error": {"error": "exception", "detail": str(e)}}
+    with SessionLocal() as db:
+        res["agenda"] = agenda.as_dict(agenda.record_result(db, emp.id, res, started_at))
+        db.commit()
+    return res
+
+def execute(job:DFEJob):
+    """Executa um job já tomado da fila; espera a trava da empresa se o agendador a estiver usando."""
+    while True:
+        with empresa_lock(job.empresa_id) as locked:
+            if locked:
+                try:
+                    res = _run_locked(job)
+                except Exception as e:
+                    res = {"ok": False, "error": {"error": "exception", "detail": str(e)}}
+                _finish(job.id, res)
+                return
+        if _stop.is_set():
+            _update(job.id, status=QUEUED, started_at=None)  # devolve à fila para outro worker
+            return
+        _update(job.id)  # heartbeat enquanto espera
+        _stop.wait(settings.DFE_JOB_POLL_SEC)
+
+def work_forever():
+    """Laço de um worker: toma o próximo job da fila ou espera até ``DFE_JOB_POLL_SEC``."""
+    while not _stop.is_set():
+        try:
+            job = _claim()
+        except Exception as e:
+            print(f"[jobs] falha ao consultar a fila: {e}")
+            job = None
+        if job is None:
+            _wakeup.wait(settings.DFE_JOB_POLL_SEC)
+            _wakeup.clear()
+            continue
+        execute(job)
+
+def start_workers(n:int | None = None):
+    n = settings.DFE_JOB_WORKERS if n is None else n
+    _stop.clear()
+    for i in range(len(_threads), n):
+        t = threading.Thread(target=work_forever, name=f"dfe-job-{i}", daemon=True)
+        t.start()
+        _threads.append(t)
+
+def stop_workers(timeout:float=5.0):
+    """Sinaliza parada; jobs em execução terminam a página atual só se couber em ``timeout``."""
+    _stop.set(); _wakeup.set()
+    deadline = time.time() + timeout
+    for t in _threads:
+        t.join(max(0.0, deadline - time.time()))
+    _threads[:] = [t for t in _threads if t.is_alive()]
+
+def as_dict(job:DFEJob) -> dict:
+    """Job com progresso: NSU atual vs maxNSU, percentual, taxa (docs/s e NSU/s) e ETA."""
+    end = job.finished_at or datetime.utcnow()
+    elapsed = (end - job.started_at).total_seconds() if job.started_at else 0.0
+    done_nsu = agenda.backlog(job.start_nsu, job.ult_nsu)
+    remaining = agenda.backlog(job.ult_nsu, job.max_nsu)
+    total = done_nsu + remaining
+    nsu_rate = done_nsu / elapsed if elapsed > 0 else None
+    return {
+        "id": job.id,
+        "empresa_id": job.empresa_id,
+        "status": job.status,
+        "force": bool(job.force),
+        "processed": job.processed or 0,
+        "pages": job.pages or 0,
+        "start_nsu": job.start_nsu,
+        "ult_nsu": job.ult_nsu,
+        "max_nsu": job.max_nsu,
+        "percent": round(100.0 * done_nsu / total, 1) if total else (100.0 if job.status == DONE else None),
+        "elapsed_sec": round(elapsed, 1),
+        "docs_per_sec": round((job.processed or 0) / elapsed, 2) if elapsed > 0 else None,
+        "nsu_per_sec": round(nsu_rate, 2) if nsu_rate is not None else None,
+        "eta_sec": int(remaining / nsu_rate) if job.status == RUNNING and nsu_rate else None,
+        "error": job.error,
+        "result": job.result,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
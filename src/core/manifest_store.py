@@ -0,0 +1,103 @@
+"""Gravação do retorno da manifestação do destinatário em ``dfe_documentos``.
+
+Usada pelas rotas ``/api/dfe/manifestar`` e pela manifestação automática
+(src/core/auto_manifest.py). O retorno vai para o documento mais recente da chave.
+Repetir um evento já registrado com sucesso (mesmo tpEvento/nSeq) não altera a linha, e
+uma retentativa (ex.: 573 Duplicidade) não sobrescreve o cStat 135/136 já gravado. O
+contador ``manifestadas`` acompanha na mesma transação, pelas transições de cStat que o
+próprio UPDATE devolve (sobe ao registrar, desce quando um retorno rejeitado substitui um 135/136).
+"""
+from datetime import datetime
+from sqlalchemy import select, update, func, and_, or_, not_, column, values, Integer, String, Text
+from src.store.xml_store import put_xml
+from src.models import DFEDocumento
+from src.core import counters
+from src.core.counters import MANIFEST_OK_CSTATS
+
+def save_response(cnpj:str, chNFe:str, tpEvento:str, nSeq:int, resp_xml:str|None) -> str|None:
+    """Salva o XML de resposta do evento no storage; falha de I/O não interrompe a gravação."""
+    if not resp_xml:
+        return None
+    try:
+        return put_xml(cnpj, f"evento_{chNFe}_{tpEvento}_{nSeq}.xml", resp_xml.encode('utf-8'))
+    except Exception:
+        return None
+
+def _old_cstat(cond):
+    """Linhas-alvo travadas (FOR UPDATE) com o cStat anterior: o RETURNING do UPDATE devolve
+    antes/depois na mesma instrução, sem leitura prévia sujeita a corrida."""
+    return select(DFEDocumento.id, DFEDocumento.manifest_cstat.label("old_cstat")).where(cond).with_for_update().subquery("old")
+
+def _bump_transitions(db, empresa_id:int, changed):
+    """Ajusta ``manifestadas`` pelas transições (cStat anterior, novo) de cada documento:
+    +1 ao passar a 135/136, -1 ao sair (ex.: evento posterior rejeitado gravado por cima)."""
+    delta = sum((new in MANIFEST_OK_CSTATS) - (old in MANIFEST_OK_CSTATS) for old, new in changed)
+    if delta:
+        counters.bump(db, empresa_id, {"manifestadas": delta})
+
+def _not_already_ok(tp, nseq):
+    # repetir um evento já registrado com sucesso (mesmo tpEvento/nSeq) não altera a linha
+    return or_(DFEDocumento.manifest_tp.is_(None), not_(and_(
+        DFEDocumento.manifest_tp==tp,
+        DFEDocumento.manifest_nseq==nseq,
+        DFEDocumento.manifest_cstat.in_(MANIFEST_OK_CSTATS),
+    )))
+
+def update_manifest(db, doc_id:int, tpEvento:str, nSeq:int, res:dict, saved_path:str|None):
+    """Grava o retorno de um evento no documento ``doc_id`` (sem commit)."""
+    old = _old_cstat(DFEDocumento.id==doc_id)
+    rows = db.execute(update(DFEDocumento).where(DFEDocumento.id==old.c.id, _not_already_ok(tpEvento, nSeq)).values(
+        manifest_tp=tpEvento,
+        manifest_nseq=nSeq,
+        manifest_cstat=str(res.get("cStat") or ""),
+        manifest_xmotivo=res.get("xMotivo"),
+        manifest_xml_path=saved_path,
+        manifest_updated_at=datetime.utcnow(),
+    ).returning(DFEDocumento.empresa_id, old.c.old_cstat, DFEDocumento.manifest_cstat)).all()
+    if rows:
+        _bump_transitions(db, rows[0][0], [(old, new) for _, old, new in rows])
+
+def _pick(current:dict|None, r:dict) -> dict:
+    # várias respostas para o mesmo documento no lote (tpEvento distintos): uma linha por
+    # documento no UPDATE; a registrada (135/136) prevalece, senão a última
+    if current is None or str(r["cStat"]) in MANIFEST_OK_CSTATS or str(current["cStat"]) not in MANIFEST_OK_CSTATS:
+        return r
+    return current
+
+def update_lote(db, cnpj:str, empresa_id:int, results:list[dict]) -> dict[tuple[str, str, int], str|None]:
+    """Versão em lote de ``update_manifest`` (sem commit): salva o XML de cada retEvento e atualiza
+    o documento mais recente de cada chave em um único UPDATE. Devolve (chave, tpEvento, nSeq) ->
+    caminho do XML salvo."""
+    done = [r for r in results if r.get("cStat")]
+    if not done:
+        return {}
+    latest = dict(db.execute(select(DFEDocumento.chave, func.max(DFEDocumento.id))
+                             .where(DFEDocumento.empresa_id==empresa_id, DFEDocumento.chave.in_([r["chNFe"] for r in done]))
+                             .group_by(DFEDocumento.chave)).all())
+    if not latest:
+        return {}
+    saved: dict[tuple[str, str, int], str|None] = {}
+    by_doc: dict[int, dict] = {}
+    for r in done:
+        doc_id = latest.get(r["chNFe"])
+        if not doc_id:
+            continue
+        path = save_response(cnpj, r["chNFe"], r["tpEvento"], r["nSeq"], r.get("resp_xml"))
+        saved[(r["chNFe"], r["tpEvento"], int(r["nSeq"]))] = path
+        by_doc[doc_id] = _pick(by_doc.get(doc_id), {**r, "path": path})
+    rows = [(doc_id, r["tpEvento"], int(r["nSeq"]), str(r["cStat"]), r.get("xMotivo"), r["path"]) for doc_id, r in by_doc.items()]
+    v = values(column("id", Integer), column("tp", String), column("nseq", Integer), column("cstat", String),
+               column("xmotivo", Text), column("path", Text), name="v").data(rows)
+    old = _old_cstat(DFEDocumento.id.in_(list(by_doc)))
+    changed = db.execute(update(DFEDocumento).where(
+        DFEDocumento.id==v.c.id, old.c.id==v.c.id, _not_already_ok(v.c.tp, v.c.nseq),
+    ).values(
+        manifest_tp=v.c.tp,
+        manifest_nseq=v.c.nseq,
+        manifest_cstat=v.c.cstat,
+        manifest_xmotivo=v.c.xmotivo,
+        manifest_xml_path=v.c.path,
+        manifest_updated_at=datetime.utcnow(),
+    ).returning(old.c.old_cstat, DFEDocumento.manifest_cstat)).all()
+    _bump_transitions(db, empresa_id, [(old, new) for old, new in changed])
+    return saved
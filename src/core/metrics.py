@@ -0,0 +1,136 @@
+"""Métricas Prometheus do pipeline de sincronização.
+
+Registro próprio (``REGISTRY``, sem as métricas padrão de processo do cliente), alimentado
+pelas camadas que já medem o próprio trabalho:
+
+- ``dfe_ws_request_seconds`` / ``dfe_ws_requests_total``: latência e resultado de cada POST
+  aos web services, por serviço (dist|evento), endpoint e versão SOAP;
+- ``dfe_ws_cstat_total``: cStat das respostas da distribuição (137/138/656/108...) por operação;
+- ``dfe_retries_total`` / ``dfe_backoff_seconds_total``: retentativas após erro de rede e o
+  tempo dormido em backoff;
+- ``dfe_docs_ingested_total``: documentos efetivamente inseridos, por schema (sem a versão);
+- ``dfe_db_write_seconds``: duração da transação de gravação de cada página/lote;
+- ``dfe_storage_bytes_written_total``: bytes gravados no storage de XML, por backend
+  (arquivo deduplicado no CAS não conta);
+- ``dfe_sync_runs_total`` / ``dfe_sync_run_seconds``: execuções de ``run_distribution``;
+- ``dfe_backlog_nsu``: maxNSU - ultNSU por empresa, lido de ``cursor_dfe`` a cada coleta
+  (``BacklogCollector``, registrado pela rota ``/metrics`` da API).
+
+A API expõe ``GET /metrics``; o agendador e o ``sync_worker`` sobem um servidor HTTP próprio
+em ``DFE_METRICS_PORT`` (``serve``). Cada processo tem os seus contadores.
+"""
+import threading
+from urllib.parse import urlsplit
+from prometheus_client import CollectorRegistry, Counter, Histogram, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+from src.settings import settings
+
+REGISTRY = CollectorRegistry(auto_describe=True)
+
+WS_LATENCY = Histogram("dfe_ws_request_seconds", "Latência das requisições aos web services",
+                       ["service", "endpoint", "soap"], registry=REGISTRY,
+                       buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 45))
+WS_REQUESTS = Counter("dfe_ws_requests_total", "Requisições aos web services por resultado (HTTP ou erro)",
+                      ["service", "endpoint", "soap", "result"], registry=REGISTRY)
+CSTAT = Counter("dfe_ws_cstat_total", "cStat das respostas da distribuição", ["op", "cstat"], registry=REGISTRY)
+RETRIES = Counter("dfe_retries_total", "Retentativas após falha de rede", ["kind"], registry=REGISTRY)
+BACKOFF = Counter("dfe_backoff_seconds_total", "Tempo em backoff antes das retentativas", ["kind"], registry=REGISTRY)
+DOCS = Counter("dfe_docs_ingested_total", "Documentos inseridos em dfe_documentos", ["schema"], registry=REGISTRY)
+DB_WRITE = Histogram("dfe_db_write_seconds", "Duração das transações de gravação", ["op"], registry=REGISTRY,
+                     buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+STORAGE_BYTES = Counter("dfe_storage_bytes_written_total", "Bytes gravados no storage de XML",
+                        ["backend"], registry=REGISTRY)
+RUNS = Counter("dfe_sync_runs_total", "Execuções de run_distribution por resultado", ["result"], registry=REGISTRY)
+RUN_SECONDS = Histogram("dfe_sync_run_seconds", "Duração das execuções de run_distribution", registry=REGISTRY,
+                        buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600))
+
+def _endpoint(url: str | None) -> str:
+    # host + caminho: os candidatos são uma lista fixa, então a cardinalidade é limitada
+    if not url:
+        return "wsdl"
+    u = urlsplit(url)
+    return u.netloc + u.path
+
+def ws_request(service: str, url: str | None, soap: str, seconds: float | None, status: int | None):
+    """Uma tentativa de POST; ``status`` None = exceção de rede (sem latência)."""
+    ep = _endpoint(url)
+    if seconds is not None:
+        WS_LATENCY.labels(service, ep, soap).observe(seconds)
+    WS_REQUESTS.labels(service, ep, soap, str(status) if status is not None else "erro").inc()
+
+def cstat(op: str, code: str | None):
+    CSTAT.labels(op, code or "?").inc()
+
+def retry(kind: str, wait: float):
+    RETRIES.labels(kind).inc()
+    BACKOFF.labels(kind).inc(wait)
+
+def schema_label(schema: str | None) -> str:
+    # "resNFe_v1.01.xsd" -> "resNFe"
+    return (schema or "?").split("_", 1)[0]
+
+def docs_ingested(schemas: list[str | None]):
+    by_schema: dict[str, int] = {}
+    for s in schemas:
+        s = schema_label(s)
+        by_schema[s] = by_schema.get(s, 0) + 1
+    for s, n in by_schema.items():
+        DOCS.labels(s).inc(n)
+
+def storage_written(backend: str, n: int):
+    STORAGE_BYTES.labels(backend).inc(n)
+
+def sync_run(res: dict, seconds: float):
+    if not res.get("ok"):
+        result = "erro"
+    elif res.get("stopped"):
+        result = res.get("reason") or "stopped"
+    else:
+        result = "ok"
+    RUNS.labels(result).inc()
+    RUN_SECONDS.observe(seconds)
+
+class BacklogCollector:
+    """``dfe_backlog_nsu`` por empresa, lido do banco a cada coleta (vale para o que qualquer
+    processo sincronizou). Falha de banco não derruba a coleta das demais métricas."""
+
+    def describe(self):
+        # evita que o registro chame collect() (consulta ao banco) só para descobrir os nomes
+        yield GaugeMetricFamily("dfe_backlog_nsu", "NSUs pendentes (maxNSU - ultNSU) por empresa",
+                                labels=["empresa_id", "cnpj"])
+
+    def collect(self):
+        from sqlalchemy import select
+        from src.store.db import SessionLocal
+        from src.models import CursorDFe, Empresa
+        from src.core.agenda import backlog
+        g = GaugeMetricFamily("dfe_backlog_nsu", "NSUs pendentes (maxNSU - ultNSU) por empresa",
+                              labels=["empresa_id", "cnpj"])
+        try:
+            with SessionLocal() as db:
+                rows = db.execute(select(Empresa.id, Empresa.cnpj, CursorDFe.ultimo_nsu, CursorDFe.max_nsu)
+                                  .join(CursorDFe, CursorDFe.empresa_id==Empresa.id)).all()
+        except Exception:
+            rows = []
+        for emp_id, cnpj, ult, mx in rows:
+            g.add_metric([str(emp_id), cnpj], backlog(ult, mx))
+        yield g
+
+_backlog_lock = threading.Lock()
+_backlog_registered = False
+
+def register_backlog():
+    """Inclui ``dfe_backlog_nsu`` no registro (idempotente)."""
+    global _backlog_registered
+    with _backlog_lock:
+        if not _backlog_registered:
+            REGISTRY.register(BacklogCollector())
+            _backlog_registered = True
+
+def serve(port: int | None = None) -> bool:
+    """Servidor HTTP de métricas para processos sem a API (agendador, sync_worker)."""
+    port = settings.DFE_METRICS_PORT if port is None else port
+    if not port:
+        return False
+    start_http_server(port, registry=REGISTRY)
+    return True
@@ -0,0 +1,112 @@
+"""Registro persistente das lacunas de NSU (tabela ``dfe_nsu_gaps``).
+
+Cada página do distNSU que chega com NSUs fora de sequência grava os intervalos
+faltantes, na mesma transação que avança o cursor: a lacuna não se perde se a
+execução terminar antes de recuperá-la. ``recover_gaps`` (src/core/dfe_sync.py)
+consome o registro por consNSU e avança ``next_nsu`` de cada intervalo:
+
+- ``pendente``: ainda há NSUs a consultar (a partir de ``next_nsu``);
+- ``concluida``: todos consultados (com documento ou cStat 137);
+- ``falha``: esgotou ``DFE_GAP_MAX_ATTEMPTS`` tentativas com erro; fica visível
+  em ``GET /api/dfe/gaps`` em vez de sumir.
+
+Após erro, o intervalo espera (``next_attempt_at``) com a mesma progressão
+exponencial da agenda; após 656, espera 1 h sem contar tentativa.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from src.models import DFENsuGap
+from src.core.agenda import retry_delay
+from src.settings import settings
+
+PENDING, DONE, FAILED = "pendente", "concluida", "falha"
+
+def find_gaps(prev_nsu: int, nsus_sorted: list[int]) -> tuple[list[tuple[int, int]], int]:
+    """Intervalos (ini, fim) ausentes entre ``prev_nsu`` e os NSUs recebidos; e o último NSU visto."""
+    gaps = []
+    for n in nsus_sorted:
+        if n - prev_nsu > 1:
+            gaps.append((prev_nsu + 1, n - 1))
+        prev_nsu = max(prev_nsu, n)
+    return gaps, prev_nsu
+
+def record(db, empresa_id: int, gaps: list[tuple[int, int]]):
+    """Grava intervalos novos; reprocessar a mesma página é no-op (ON CONFLICT)."""
+    if not gaps:
+        return
+    db.execute(pg_insert(DFENsuGap).values([
+        {"empresa_id": empresa_id, "nsu_ini": ini, "nsu_fim": fim, "next_nsu": ini} for ini, fim in gaps
+    ]).on_conflict_do_nothing(index_elements=["empresa_id", "nsu_ini"]))
+
+def _due():
+    return (DFENsuGap.status==PENDING) & or_(DFENsuGap.next_attempt_at.is_(None), DFENsuGap.next_attempt_at <= datetime.utcnow())
+
+def claim(db, empresa_id: int, budget: int) -> list[tuple[DFENsuGap, list[int]]]:
+    """Intervalos pendentes elegíveis (menor NSU primeiro) e os NSUs a consultar, até ``budget``."""
+    out = []
+    for gap in db.execute(select(DFENsuGap).where(DFENsuGap.empresa_id==empresa_id, _due())
+                          .order_by(DFENsuGap.nsu_ini)).scalars():
+        if budget <= 0:
+            break
+        nsus = list(range(gap.next_nsu, min(gap.nsu_fim, gap.next_nsu + budget - 1) + 1))
+        budget -= len(nsus)
+        out.append((gap, nsus))
+    return out
+
+def empresas_pendentes(db) -> list[int]:
+    return list(db.execute(select(DFENsuGap.empresa_id).where(_due()).distinct()).scalars())
+
+def advance(db, gap: DFENsuGap, next_nsu: int, recovered: int, empty: int,
+            cstat: str | None = None, error: str | None = None):
+    """Progresso de um intervalo após uma rodada: ``next_nsu`` é o primeiro NSU não consultado."""
+    now = datetime.utcnow()
+    values = {
+        "next_nsu": next_nsu,
+        "recovered": DFENsuGap.recovered + recovered,
+        "empty": DFENsuGap.empty + empty,
+        "updated_at": now,
+    }
+    if cstat:
+        values["last_cstat"] = cstat
+    if next_nsu > gap.nsu_fim:
+        values.update(status=DONE, next_attempt_at=None)
+    elif cstat == "656":
+        values["next_attempt_at"] = now + timedelta(seconds=3600)
+    elif error:
+        attempts = gap.attempts + 1
+        values.update(attempts=attempts, last_error=error[:500])
+        if attempts >= settings.DFE_GAP_MAX_ATTEMPTS:
+            values["status"] = FAILED
+        else:
+            values["next_attempt_at"] = now + timedelta(seconds=retry_delay(attempts))
+    db.execute(update(DFENsuGap).where(DFENsuGap.id==gap.id).values(**values))
+
+def status(db, empresa_id: int, limit: int = 100) -> dict:
+    """Resumo por situação e intervalos ainda abertos (pendentes/falha) da empresa."""
+    remaining = DFENsuGap.nsu_fim - DFENsuGap.next_nsu + 1
+    summary = {s: {"intervalos": 0, "nsus_restantes": 0, "recuperados": 0} for s in (PENDING, DONE, FAILED)}
+    for st, n, rest, rec in db.execute(
+        select(DFENsuGap.status, func.count(), func.coalesce(func.sum(remaining), 0), func.coalesce(func.sum(DFENsuGap.recovered), 0))
+        .where(DFENsuGap.empresa_id==empresa_id).group_by(DFENsuGap.status)
+    ).all():
+        summary[st] = {"intervalos": n, "nsus_restantes": int(rest) if st != DONE else 0, "recuperados": int(rec)}
+    open_gaps = db.execute(select(DFENsuGap).where(DFENsuGap.empresa_id==empresa_id, DFENsuGap.status != DONE)
+                           .order_by(DFENsuGap.nsu_ini).limit(limit)).scalars().all()
+    return {
+        "empresa_id": empresa_id,
+        "resumo": summary,
+        "abertas": [{
+            "id": g.id,
+            "nsu_ini": str(g.nsu_ini).zfill(15),
+            "nsu_fim": str(g.nsu_fim).zfill(15),
+            "next_nsu": str(g.next_nsu).zfill(15),
+            "status": g.status,
+            "recovered": g.recovered,
+            "empty": g.empty,
+            "attempts": g.attempts,
+            "last_cstat": g.last_cstat,
+            "last_error": g.last_error,
+            "next_attempt_at": g.next_attempt_at.isoformat() if g.next_attempt_at else None,
+        } for g in open_gaps],
+    }
@@ -0,0 +1,142 @@
+"""Histórico das execuções de ``run_distribution`` com o tempo por etapa (tabela ``dfe_sync_runs``).
+
+Cada página do distNSU registra onde o tempo foi gasto:
+
+- ``rate_wait``: espera no governador por host (src/ws/rate_limit.py);
+- ``connect``: TCP + handshake TLS das conexões novas (0 com keep-alive);
+- ``server``: envio, espera e leitura da resposta, incluindo candidatos que falharam;
+- ``inflate``: base64 + descompressão dos docZip; ``parse``: restante da decodificação;
+- ``write``: gravação dos XMLs no storage; ``db``: transação da página (INSERT, cursor, lacunas);
+- ``other``: o que sobra do intervalo entre páginas (backoff, gerador do pull).
+
+Na execução somam-se ainda a recuperação de lacunas (``gaps``) e a manifestação automática
+(``auto_manifest``). Guardam-se até ``DFE_SYNC_TRACE_MAX_PAGES`` páginas detalhadas por
+execução; as demais entram só nos totais. O agendador apaga execuções com mais de
+``DFE_SYNC_RUNS_RETENTION_DAYS`` dias.
+"""
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete
+from src.store.db import SessionLocal
+from src.models import DFESyncRun
+from src.settings import settings
+
+PAGE_STAGES = ("rate_wait", "connect", "server", "inflate", "parse", "write", "db")
+RUN_STAGES = ("gaps", "auto_manifest")
+
+def _ms(sec: float) -> float:
+    return round(sec * 1000, 1)
+
+class RunTrace:
+    """Tempos de uma execução, acumulados página a página."""
+
+    def __init__(self):
+        self.started_at = datetime.utcnow()
+        self._t0 = self._last = time.monotonic()
+        self.totals = dict.fromkeys(PAGE_STAGES + ("other",) + RUN_STAGES, 0.0)
+        self.pages: list[dict] = []
+        self.omitted = 0
+        self.duration = 0.0
+
+    def page(self, n: int, pack: dict, docs: int, timing: dict):
+        """Página ``n`` recebida (lote ou parada 656/108) com o tempo por etapa em segundos."""
+        now = time.monotonic()
+        total, self._last = now - self._last, now
+        ms = {}
+        for k in PAGE_STAGES:
+            sec = timing.get(k, 0.0)
+            self.totals[k] += sec
+            ms[k] = _ms(sec)
+        other = max(0.0, total - sum(timing.get(k, 0.0) for k in PAGE_STAGES))
+        self.totals["other"] += other
+        if len(self.pages) >= settings.DFE_SYNC_TRACE_MAX_PAGES:
+            self.omitted += 1
+            return
+        self.pages.append({"page": n, "docs": docs, "cStat": pack.get("cStat"), "ultNSU": pack.get("ultNSU"),
+                           "ms": {**ms, "other": _ms(other), "total": _ms(total)}})
+
+    @contextmanager
+    def timed(self, stage: str):
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.totals[stage] += time.monotonic() - t0
+
+    def close(self):
+        self.duration = time.monotonic() - self._t0
+
+    def as_dict(self) -> dict:
+        return {"duration_ms": _ms(self.duration), "stages_ms": {k: _ms(v) for k, v in self.totals.items()},
+                "pages": self.pages, "pages_omitted": self.omitted}
+
+def _reason(out: dict) -> str | None:
+    if not out.get("ok"):
+        err = out.get("error")
+        return str((err.get("error") if isinstance(err, dict) else err) or "erro")[:40]
+    return out.get("reason") if out.get("stopped") else None
+
+def record(empresa_id: int, trace: RunTrace, out: dict, start_nsu: str | None,
+           origem: str = "agendador", job_id: int | None = None) -> int | None:
+    """Grava a execução; devolve o id (None se a gravação falhar: o histórico não derruba o ciclo)."""
+    data = trace.as_dict()
+    try:
+        with SessionLocal() as db:
+            run = DFESyncRun(empresa_id=empresa_id, job_id=job_id, origem=origem, ok=bool(out.get("ok")),
+                             reason=_reason(out), cstat=out.get("cStat"), processed=out.get("processed") or 0,
+                             pages=len(trace.pages) + trace.omitted, start_nsu=start_nsu,
+                             ult_nsu=out.get("ultNSU"), max_nsu=out.get("maxNSU"),
+                             duration_ms=int(trace.duration * 1000), stages=data["stages_ms"], trace=data["pages"],
+                             started_at=trace.started_at, finished_at=datetime.utcnow())
+            db.add(run)
+            db.commit()
+            return run.id
+    except Exception as e:
+        print(f"[DFE] empresa_id={empresa_id} falha ao gravar dfe_sync_runs: {e}")
+        return None
+
+def as_dict(run: DFESyncRun, pages: bool = False) -> dict:
+    out = {
+        "id": run.id,
+        "empresa_id": run.empresa_id,
+        "job_id": run.job_id,
+        "origem": run.origem,
+        "ok": bool(run.ok),
+        "reason": run.reason,
+        "cStat": run.cstat,
+        "processed": run.processed,
+        "pages": run.pages,
+        "start_nsu": run.start_nsu,
+        "ult_nsu": run.ult_nsu,
+        "max_nsu": run.max_nsu,
+        "duration_ms": run.duration_ms,
+        "stages_ms": run.stages or {},
+        "started_at": run.started_at.isoformat() if run.started_at else None,
+        "finished_at": run.finished_at.isoformat() if run.finished_at else None,
+    }
+    if pages:
+        out["trace"] = run.trace or []
+        out["pages_omitted"] = max(0, run.pages - len(out["trace"]))
+    return out
+
+def recent(empresa_id: int, limit: int = 20) -> list[dict]:
+    """Execuções mais recentes da empresa (totais por etapa, sem as páginas)."""
+    with SessionLocal() as db:
+        return [as_dict(r) for r in db.execute(select(DFESyncRun).where(DFESyncRun.empresa_id==empresa_id)
+                                               .order_by(DFESyncRun.id.desc()).limit(limit)).scalars()]
+
+def get(run_id: int) -> dict | None:
+    with SessionLocal() as db:
+        run = db.get(DFESyncRun, run_id)
+        return as_dict(run, pages=True) if run is not None else None
+
+def prune() -> int:
+    """Apaga execuções mais antigas que ``DFE_SYNC_RUNS_RETENTION_DAYS`` (0 = manter tudo)."""
+    days = settings.DFE_SYNC_RUNS_RETENTION_DAYS
+    if not days:
+        return 0
+    with SessionLocal() as db:
+        res = db.execute(delete(DFESyncRun).where(DFESyncRun.started_at < datetime.utcnow() - timedelta(days=days)))
+        db.commit()
+        return res.rowcount
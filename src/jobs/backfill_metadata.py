@@ -0,0 +1,53 @@
+"""Preenche os metadados materializados (migração 0004) de documentos já gravados.
+
+Uso:
+    python -m src.jobs.backfill_metadata [--empresa-id N] [--batch 500] [--all]
+
+Percorre ``dfe_documentos`` por id (keyset), lê o XML de cada linha sem metadados
+e grava as colunas em lote. ``--all`` reprocessa também linhas já preenchidas.
+"""
+import argparse
+from sqlalchemy import select, update, bindparam, and_
+from src.store.db import SessionLocal
+from src.store.xml_store import read_xml, xml_exists
+from src.models import DFEDocumento
+from src.core.doc_fields import FIELD_COLUMNS, extract_doc_fields
+
+def backfill(empresa_id: int | None = None, batch: int = 500, reprocess: bool = False) -> dict:
+    last_id = 0; scanned = 0; updated = 0; missing = 0
+    while True:
+        with SessionLocal() as db:
+            q = select(DFEDocumento.id, DFEDocumento.caminho_xml).where(DFEDocumento.id > last_id)
+            if empresa_id is not None:
+                q = q.where(DFEDocumento.empresa_id == empresa_id)
+            if not reprocess:
+                q = q.where(and_(DFEDocumento.emitente_cnpj.is_(None), DFEDocumento.data_emissao.is_(None), DFEDocumento.tp_evento.is_(None)))
+            rows = db.execute(q.order_by(DFEDocumento.id).limit(batch)).all()
+            if not rows:
+                break
+            params = []
+            for doc_id, caminho in rows:
+                scanned += 1
+                if not xml_exists(caminho or ""):
+                    missing += 1
+                    continue
+                fields = extract_doc_fields(read_xml(caminho))
+                params.append({"b_id": doc_id, **{f"b_{k}": v for k, v in fields.items()}})
+            if params:
+                stmt = update(DFEDocumento).where(DFEDocumento.id == bindparam("b_id")).values(
+                    **{k: bindparam(f"b_{k}") for k in FIELD_COLUMNS}
+                )
+                db.connection().execute(stmt, params)
+                db.commit()
+                updated += len(params)
+            last_id = rows[-1][0]
+        print(f"[backfill] até id={last_id} lidos={scanned} atualizados={updated} sem_arquivo={missing}")
+    return {"scanned": scanned, "updated": updated, "missing_files": missing}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Backfill de metadados de dfe_documentos")
+    ap.add_argument("--empresa-id", type=int, default=None)
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--all", action="store_true", help="reprocessar também linhas já preenchidas")
+    a = ap.parse_args()
+    print(backfill(a.empresa_id, a.batch, a.all))
@@ -0,0 +1,84 @@
+"""Migra XMLs do layout plano (``{cnpj}/{nsu}_{schema}.xml``, ou ``.xml.gz`` gravados com
+``DFE_STORE_DOCZIP_RAW``) para o armazenamento endereçado por conteúdo
+(``XML_STORAGE_BACKEND=cas``).
+
+Uso:
+    python -m src.jobs.migrate_storage [--empresa-id N] [--batch 500] [--delete-old]
+
+Percorre ``dfe_documentos`` por id (keyset), copia ``caminho_xml`` e
+``manifest_xml_path`` para o CAS (comprimido, deduplicado) e atualiza as referências
+em lote. Arquivos ``.gz`` já estão em GZip e vão byte a byte por ``put_gzip``. Os arquivos antigos só são removidos com ``--delete-old``, após o commit.
+Pode ser interrompido e reexecutado: linhas já migradas são ignoradas.
+"""
+import argparse, os
+from pathlib import Path
+from sqlalchemy import select, update, bindparam
+from src.store.db import SessionLocal
+from src.store.xml_store import CasStore
+from src.models import DFEDocumento
+from src.settings import settings
+
+def migrate(empresa_id: int | None = None, batch: int = 500, delete_old: bool = False) -> dict:
+    store = CasStore(settings.STORAGE_BASE_PATH, settings.XML_STORAGE_COMPRESSION)
+    cas_root = str(store.root)
+    last_id = 0; migrated = 0; missing = 0; deleted = 0
+    # caminho antigo -> novo: um mesmo arquivo pode ser referenciado por várias linhas
+    # (ex.: retorno de evento) e já ter sido removido em um lote anterior
+    moved: dict[str, str] = {}
+
+    def move(path: str | None, old: list[str]):
+        nonlocal missing
+        if not path or path.startswith(cas_root):
+            return path
+        if path in moved:
+            return moved[path]
+        p = Path(path)
+        if not p.is_file():
+            missing += 1
+            return path
+        old.append(path)
+        if p.name.endswith(".gz"):
+            # docZip guardado como veio do AN: recomprimir faria read_xml devolver GZip
+            moved[path] = store.put_gzip(p.parent.name, p.name[:-3], p.read_bytes())
+        else:
+            moved[path] = store.put(p.parent.name, p.name, p.read_bytes())
+        return moved[path]
+
+    while True:
+        with SessionLocal() as db:
+            q = select(DFEDocumento.id, DFEDocumento.caminho_xml, DFEDocumento.manifest_xml_path).where(DFEDocumento.id > last_id)
+            if empresa_id is not None:
+                q = q.where(DFEDocumento.empresa_id == empresa_id)
+            rows = db.execute(q.order_by(DFEDocumento.id).limit(batch)).all()
+            if not rows:
+                break
+            params = []; old: list[str] = []
+            for doc_id, caminho, man_path in rows:
+                new_caminho = move(caminho, old)
+                new_man = move(man_path, old)
+                if (new_caminho, new_man) != (caminho, man_path):
+                    params.append({"b_id": doc_id, "b_caminho": new_caminho, "b_man": new_man})
+            if params:
+                stmt = update(DFEDocumento).where(DFEDocumento.id == bindparam("b_id")).values(
+                    caminho_xml=bindparam("b_caminho"), manifest_xml_path=bindparam("b_man"),
+                )
+                db.connection().execute(stmt, params)
+                db.commit()
+                migrated += len(params)
+            last_id = rows[-1][0]
+        if delete_old:
+            for path in set(old):
+                try:
+                    os.remove(path); deleted += 1
+                except FileNotFoundError:
+                    pass
+        print(f"[migrate_storage] até id={last_id} migrados={migrated} sem_arquivo={missing} removidos={deleted}")
+    return {"migrated": migrated, "missing_files": missing, "deleted": deleted}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Migra XMLs do layout plano para o armazenamento endereçado por conteúdo")
+    ap.add_argument("--empresa-id", type=int, default=None)
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--delete-old", action="store_true", help="remover os arquivos do layout plano após migrar")
+    a = ap.parse_args()
+    print(migrate(a.empresa_id, a.batch, a.delete_old))
@@ -0,0 +1,57 @@
+"""Recupera por consNSU as lacunas de NSU registradas em ``dfe_nsu_gaps``.
+
+Uso:
+    python -m src.jobs.recover_gaps [--empresa-id N] [--budget 200]
+
+``run_distribution`` já drena as lacunas ao fim de cada ciclo (até
+``DFE_GAP_MAX_PER_RUN`` NSUs); este job serve para fechar lacunas grandes fora do
+agendador. Empresas segurando um 656 na agenda, ou já em sincronização (trava de
+``jobs.empresa_lock``, a mesma do agendador e dos jobs da API), são puladas.
+"""
+import argparse, certifi
+from datetime import datetime
+from sqlalchemy import select
+from src.store.db import SessionLocal
+from src.models import Empresa
+from src.cert import cert_manager
+from src.core import agenda, jobs, nsu_gaps
+from src.core.dfe_sync import recover_gaps
+
+def _recover_locked(emp: Empresa, budget: int | None) -> dict:
+    lc = cert_manager.get(emp.id)
+    if lc is None:
+        return {"skipped": "sem_certificado"}
+    res = recover_gaps(emp.id, emp.cnpj, lc.cert_tuple, certifi.where(), budget=budget)
+    print(f"[gaps] empresa={emp.cnpj} consultados={res['consulted']} recuperados={res['processed']}"
+          + (" cStat=656" if res["cStat"] == "656" else ""))
+    if res["cStat"] == "656":
+        with SessionLocal() as db:
+            agenda.record_result(db, emp.id, {"ok": True, "stopped": True, "reason": "consumo_indevido", "wait_sec": 3600, "cStat": "656"})
+            db.commit()
+    return res
+
+def recover(empresa_id: int | None = None, budget: int | None = None) -> dict:
+    with SessionLocal() as db:
+        ids = [empresa_id] if empresa_id is not None else nsu_gaps.empresas_pendentes(db)
+        empresas = db.execute(select(Empresa).where(Empresa.id.in_(ids))).scalars().all()
+        holds = {e.id: agenda.get(db, e.id) for e in empresas}
+    out = {}
+    for emp in empresas:
+        row = holds[emp.id]
+        if row is not None and row.last_reason == "consumo_indevido" and row.next_allowed_at and row.next_allowed_at > datetime.utcnow():
+            out[emp.id] = {"skipped": "consumo_indevido", "next_allowed_at": row.next_allowed_at.isoformat()}
+            continue
+        # mesma trava do agendador: não consulta as lacunas em paralelo a um ciclo da empresa
+        with jobs.empresa_lock(emp.id) as locked:
+            if not locked:
+                out[emp.id] = {"skipped": "em_sincronizacao"}
+                continue
+            out[emp.id] = _recover_locked(emp, budget)
+    return out
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Recupera lacunas de NSU registradas (consNSU)")
+    ap.add_argument("--empresa-id", type=int, default=None)
+    ap.add_argument("--budget", type=int, default=None, help="NSUs por empresa (padrão: DFE_GAP_MAX_PER_RUN)")
+    a = ap.parse_args()
+    print(recover(a.empresa_id, a.budget))
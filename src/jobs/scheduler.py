@@ -1,46 +1,91 @@
 from apscheduler.schedulers.blocking import BlockingScheduler
-from sqlalchemy import select
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
 from src.store.db import SessionLocal
 from src.models import Empresa
-from src.api.routes.dfe import _load_cert_tuple
+from src.cert import cert_manager
+from src.core import agenda, jobs, metrics, sync_runs
 from src.core.dfe_sync import run_distribution
-import os, certifi
+from src.ws import session_pool
+import certifi, heapq
 from src.settings import settings
 import time
 
-# Janela dinâmica: se ultNSU==maxNSU, aguardar ~1h para empresa antes de nova execução
-_next_allowed_ts = {}
+# Janela por empresa (ociosa ~1h, 656, erros) e prioridade por backlog: tabela dfe_agenda (src/core/agenda.py)
 
 sched = BlockingScheduler()
 
+def _run_deadline(started: float) -> float:
+    # Prazo da varredura: DFE_SYNC_DEADLINE_SEC ou o intervalo do job menos uma folga
+    sec = settings.DFE_SYNC_DEADLINE_SEC or max(60, settings.JOB_INTERVAL_MINUTES * 60 - 30)
+    return started + sec
+
+def _sync_empresa(emp: Empresa, deadline: float) -> dict | None:
+    # mesma trava de execução dos jobs da API (dfe_jobs): empresa já em sincronização fica para a próxima varredura
+    with jobs.empresa_lock(emp.id) as locked:
+        if not locked:
+            print(f"[DFE] empresa={emp.cnpj} em sincronização por job da API; pulando")
+            return None
+        return _sync_locked(emp, deadline)
+
+def _sync_locked(emp: Empresa, deadline: float) -> dict:
+    started_at = datetime.utcnow()
+    try:
+        lc = cert_manager.get(emp.id)
+        if lc is None:
+            print(f"[DFE] empresa={emp.cnpj} sem certificado cadastrado")
+            res = {"ok": False, "error": {"error": "sem_certificado"}}
+        else:
+            verify = certifi.where()
+            res = run_distribution(emp.id, emp.cnpj, lc.cert_tuple, verify, deadline=deadline,
+                                   max_pages=settings.DFE_MAX_PAGES_PER_RUN or None)
+            print(f"[DFE] empresa={emp.cnpj} ok={res.get('ok')} nsu={res.get('ultNSU')}/{res.get('maxNSU')} processed={res.get('processed')}"
+                  + (f" stopped={res.get('reason')}" if res.get('stopped') else ""))
+    except Exception as e:
+        print(f"[DFE] empresa={emp.cnpj} erro: {e}")
+        res = {"ok": False, "error": {"error": "exception", "detail": str(e)}}
+    try:
+        with SessionLocal() as db:
+            agenda.record_result(db, emp.id, res, started_at)
+            db.commit()
+    except Exception as e:
+        print(f"[DFE] empresa={emp.cnpj} falha ao gravar agenda: {e}")
+    return res
+
 @sched.scheduled_job("interval", minutes=settings.JOB_INTERVAL_MINUTES)
 def sync_all():
+    started = time.time()
+    deadline = _run_deadline(started)
     with SessionLocal() as db:
-        empresas = [e for (e,) in db.execute(select(Empresa).where(Empresa.ativo==1)).all()]
-    for emp in empresas:
-        now = time.time()
-        nxt = _next_allowed_ts.get(emp.id, 0)
-        if now < nxt:
-            # pular empresa temporariamente ociosa
-            continue
-        cert_tuple = None
-        try:
-            emp2, cert_path, key_path = _load_cert_tuple(emp.id)
-            cert_tuple = (cert_path, key_path)
-            verify = certifi.where()
-            res = run_distribution(emp.id, emp.cnpj, cert_tuple, verify)
-            print(f"[DFE] empresa={emp.cnpj} ok={res.get('ok')} nsu={res.get('ultNSU')}/{res.get('maxNSU')} processed={res.get('processed')}")
-            if res.get('ok') and res.get('ultNSU') == res.get('maxNSU'):
-                # idle: segura por ~1h
-                _next_allowed_ts[emp.id] = now + 3600
-        except Exception as e:
-            print(f"[DFE] empresa={emp.cnpj} erro: {e}")
-        finally:
-            if cert_tuple:
-                for p in cert_tuple:
-                    try:
-                        if p and os.path.exists(p): os.remove(p)
-                    except: pass
+        # só empresas elegíveis, maior backlog primeiro
+        queue = agenda.due_queue(db)
+    workers = max(1, settings.DFE_SYNC_WORKERS)
+    running = {}
+    # Empresas em backoff/timeout ocupam apenas o seu worker; o ritmo por host fica a cargo de src.ws.rate_limit
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dfe-sync") as pool:
+        while queue or running:
+            while queue and len(running) < workers and time.time() < deadline:
+                emp = heapq.heappop(queue)[-1]
+                running[pool.submit(_sync_empresa, emp, deadline)] = emp
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                emp = running.pop(fut)
+                res = fut.result() or {}
+                if res.get("reason") == "page_quota" and time.time() < deadline:
+                    # cota esgotada com backlog restante: volta à fila pela nova prioridade
+                    heapq.heappush(queue, agenda.entry(emp, agenda.backlog(res.get("ultNSU"), res.get("maxNSU")), datetime.utcnow()))
+    # Fecha sessões mTLS de empresas que ficaram ociosas além de DFE_SESSION_IDLE_SEC
+    session_pool.evict_idle()
+    # Histórico de execuções (dfe_sync_runs) além de DFE_SYNC_RUNS_RETENTION_DAYS
+    try:
+        sync_runs.prune()
+    except Exception as e:
+        print(f"[DFE] falha ao limpar dfe_sync_runs: {e}")
 
 if __name__ == "__main__":
+    # métricas deste processo (runs, latência dos WS, gravações) em DFE_METRICS_PORT, se definido
+    if metrics.serve():
+        print(f"[DFE] métricas em :{settings.DFE_METRICS_PORT}/metrics")
     sched.start()
\ No newline at end of file
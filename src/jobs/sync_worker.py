@@ -0,0 +1,26 @@
+"""Worker da fila de sincronizações da API (``dfe_jobs``).
+
+Uso:
+    python -m src.jobs.sync_worker [--workers 2]
+
+A API já executa ``DFE_JOB_WORKERS`` workers no próprio processo; este processo serve para
+tirar os ciclos longos da API (rode a API com ``DFE_JOB_WORKERS=0``) ou para somar
+capacidade. Vários processos podem consumir a mesma fila (``FOR UPDATE SKIP LOCKED``).
+"""
+import argparse, signal, threading
+from src.core import jobs, metrics
+from src.settings import settings
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Consome a fila de sincronizações (dfe_jobs)")
+    ap.add_argument("--workers", type=int, default=max(1, settings.DFE_JOB_WORKERS))
+    a = ap.parse_args()
+    done = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: done.set())
+    if metrics.serve():
+        print(f"[jobs] métricas em :{settings.DFE_METRICS_PORT}/metrics")
+    jobs.start_workers(a.workers)
+    print(f"[jobs] {a.workers} worker(s) aguardando a fila")
+    done.wait()
+    jobs.stop_workers(timeout=30)
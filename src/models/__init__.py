@@ -1,6 +1,7 @@
 from sqlalchemy.orm import declarative_base, Mapped, mapped_column
-from sqlalchemy import String, Integer, DateTime, Text, ForeignKey, Index, Numeric, LargeBinary
-from datetime import datetime
+from sqlalchemy import String, Integer, BigInteger, Boolean, DateTime, Date, Text, ForeignKey, Index, Numeric, LargeBinary, JSON
+from datetime import datetime, date
+from decimal import Decimal
 
 Base = declarative_base()
 
@@ -44,5 +45,129 @@ class DFEDocumento(Base):
     manifest_xmotivo: Mapped[str | None] = mapped_column(Text, nullable=True)
     manifest_xml_path: Mapped[str | None] = mapped_column(Text, nullable=True)
     manifest_updated_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Metadados extraídos na ingestão (src/core/doc_fields.py); evita reabrir o XML na listagem
+    emitente_cnpj: Mapped[str | None] = mapped_column(String(14), nullable=True)
+    emitente_nome: Mapped[str | None] = mapped_column(String(200), nullable=True)
+    data_emissao: Mapped[date | None] = mapped_column(Date, nullable=True)
+    valor: Mapped[Decimal | None] = mapped_column(Numeric(15, 2), nullable=True)
+    uf: Mapped[str | None] = mapped_column(String(2), nullable=True)
+    destinatario_cnpj: Mapped[str | None] = mapped_column(String(14), nullable=True)
+    tp_evento: Mapped[str | None] = mapped_column(String(6), nullable=True)
 
-Index("ix_dfe_empresa_nsu", DFEDocumento.empresa_id, DFEDocumento.nsu)
\ No newline at end of file
+class DFEContador(Base):
+    """Contadores por empresa/categoria mantidos incrementalmente (src/core/counters.py)."""
+    __tablename__ = "dfe_contadores"
+    empresa_id: Mapped[int] = mapped_column(ForeignKey("empresas.id"), primary_key=True)
+    categoria: Mapped[str] = mapped_column(String(20), primary_key=True)  # registradas|pendentes|eventos|manifestadas
+    total: Mapped[int] = mapped_column(BigInteger, default=0)
+
+class DFEAgenda(Base):
+    """Próximo horário permitido de sincronização por empresa (src/core/agenda.py)."""
+    __tablename__ = "dfe_agenda"
+    empresa_id: Mapped[int] = mapped_column(ForeignKey("empresas.id"), primary_key=True)
+    next_allowed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, index=True)
+    last_run_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    last_cstat: Mapped[str | None] = mapped_column(String(6), nullable=True)
+    last_reason: Mapped[str | None] = mapped_column(String(30), nullable=True)  # idle|consumo_indevido|service_down|deadline|page_quota|http|...
+    consecutive_errors: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class DFENsuGap(Base):
+    """Intervalo de NSUs faltantes a recuperar por consNSU (src/core/nsu_gaps.py)."""
+    __tablename__ = "dfe_nsu_gaps"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    empresa_id: Mapped[int] = mapped_column(ForeignKey("empresas.id"))
+    nsu_ini: Mapped[int] = mapped_column(BigInteger)
+    nsu_fim: Mapped[int] = mapped_column(BigInteger)
+    next_nsu: Mapped[int] = mapped_column(BigInteger)                   # primeiro NSU ainda não consultado
+    status: Mapped[str] = mapped_column(String(12), default="pendente")  # pendente|concluida|falha
+    recovered: Mapped[int] = mapped_column(Integer, default=0)          # NSUs com documento
+    empty: Mapped[int] = mapped_column(Integer, default=0)              # NSUs sem documento (cStat 137)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_cstat: Mapped[str | None] = mapped_column(String(6), nullable=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    next_attempt_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class DFEJob(Base):
+    """Sincronização enfileirada por ``POST /api/dfe/sync`` e seu progresso (src/core/jobs.py)."""
+    __tablename__ = "dfe_jobs"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    empresa_id: Mapped[int] = mapped_column(ForeignKey("empresas.id"))
+    status: Mapped[str] = mapped_column(String(12), default="fila")  # fila|executando|concluido|erro
+    force: Mapped[bool] = mapped_column(Boolean, default=False)
+    processed: Mapped[int] = mapped_column(Integer, default=0)      # documentos gravados
+    pages: Mapped[int] = mapped_column(Integer, default=0)
+    start_nsu: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    ult_nsu: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    max_nsu: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    result: Mapped[dict | None] = mapped_column(JSON, nullable=True)  # retorno de run_distribution
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)  # heartbeat do worker
+
+class DFEAutoManifest(Base):
+    """Nota resNFe na manifestação automática: Ciência da Operação e busca do procNFe (src/core/auto_manifest.py)."""
+    __tablename__ = "dfe_auto_manifest"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    empresa_id: Mapped[int] = mapped_column(ForeignKey("empresas.id"))
+    chave: Mapped[str] = mapped_column(String(44))
+    doc_id: Mapped[int] = mapped_column(ForeignKey("dfe_documentos.id"))  # linha resNFe de origem
+    status: Mapped[str] = mapped_column(String(12), default="ciencia")  # ciencia|aguardando|concluida|falha
+    ciencia_cstat: Mapped[str | None] = mapped_column(String(6), nullable=True)
+    ciencia_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    proc_doc_id: Mapped[int | None] = mapped_column(ForeignKey("dfe_documentos.id"), nullable=True)  # procNFe obtido
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_cstat: Mapped[str | None] = mapped_column(String(6), nullable=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    next_attempt_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class DFESyncRun(Base):
+    """Execução de ``run_distribution`` com o tempo por etapa de cada página (src/core/sync_runs.py)."""
+    __tablename__ = "dfe_sync_runs"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    empresa_id: Mapped[int] = mapped_column(ForeignKey("empresas.id"))
+    job_id: Mapped[int | None] = mapped_column(ForeignKey("dfe_jobs.id"), nullable=True)  # POST /api/dfe/sync
+    origem: Mapped[str] = mapped_column(String(12), default="agendador")  # agendador|api
+    ok: Mapped[bool] = mapped_column(Boolean, default=True)
+    reason: Mapped[str | None] = mapped_column(String(40), nullable=True)  # motivo da parada ou erro
+    cstat: Mapped[str | None] = mapped_column(String(6), nullable=True)
+    processed: Mapped[int] = mapped_column(Integer, default=0)
+    pages: Mapped[int] = mapped_column(Integer, default=0)
+    start_nsu: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    ult_nsu: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    max_nsu: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    duration_ms: Mapped[int] = mapped_column(Integer, default=0)
+    stages: Mapped[dict | None] = mapped_column(JSON, nullable=True)  # ms por etapa, soma da execução
+    trace: Mapped[list | None] = mapped_column(JSON, nullable=True)   # ms por etapa de cada página
+    started_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    finished_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+# Único: reprocessar uma página ou recuperar por consNSU um NSU já gravado é no-op (ON CONFLICT)
+Index("uq_dfe_empresa_nsu_schema", DFEDocumento.empresa_id, DFEDocumento.nsu, DFEDocumento.schema, unique=True)
+# Paginação por keyset (id) e filtros da listagem de documentos
+Index("ix_dfe_empresa_id", DFEDocumento.empresa_id, DFEDocumento.id)
+Index("ix_dfe_empresa_schema_id", DFEDocumento.empresa_id, DFEDocumento.schema, DFEDocumento.id)
+Index("ix_dfe_empresa_data_emissao_id", DFEDocumento.empresa_id, DFEDocumento.data_emissao, DFEDocumento.id)
+Index("ix_dfe_empresa_emitente_id", DFEDocumento.empresa_id, DFEDocumento.emitente_cnpj, DFEDocumento.id)
+Index("ix_dfe_empresa_valor", DFEDocumento.empresa_id, DFEDocumento.valor)
+Index("ix_dfe_empresa_manifest_id", DFEDocumento.empresa_id, DFEDocumento.manifest_tp, DFEDocumento.id)
+Index("ix_dfe_empresa_chave_prefix", DFEDocumento.empresa_id, DFEDocumento.chave, postgresql_ops={"chave": "varchar_pattern_ops"})
+# Lacunas: uma linha por início de intervalo (gravação idempotente) e fila de pendentes por empresa
+Index("uq_dfe_gap_empresa_ini", DFENsuGap.empresa_id, DFENsuGap.nsu_ini, unique=True)
+Index("ix_dfe_gap_empresa_status", DFENsuGap.empresa_id, DFENsuGap.status, DFENsuGap.nsu_ini)
+# Jobs: fila (status, id) e no máximo um job ativo por empresa (reforço da trava de enfileiramento)
+Index("ix_dfe_jobs_status_id", DFEJob.status, DFEJob.id)
+Index("ix_dfe_jobs_empresa_id", DFEJob.empresa_id, DFEJob.id)
+Index("uq_dfe_jobs_empresa_ativo", DFEJob.empresa_id, unique=True, postgresql_where=DFEJob.status.in_(("fila", "executando")))
+# Manifestação automática: uma linha por chave (enfileirar é idempotente) e fila por situação/horário
+Index("uq_dfe_auto_manifest_empresa_chave", DFEAutoManifest.empresa_id, DFEAutoManifest.chave, unique=True)
+Index("ix_dfe_auto_manifest_empresa_status", DFEAutoManifest.empresa_id, DFEAutoManifest.status, DFEAutoManifest.next_attempt_at)
+# Histórico de execuções: mais recentes por empresa e limpeza por data
+Index("ix_dfe_sync_runs_empresa_id", DFESyncRun.empresa_id, DFESyncRun.id)
+Index("ix_dfe_sync_runs_started_at", DFESyncRun.started_at)
\ No newline at end of file
@@ -1,5 +1,6 @@
-import re, time, hashlib, datetime
+import asyncio, re, time, hashlib, datetime
 from typing import Optional, Dict, Any
+import httpx
 import requests
 from lxml import html
 
@@ -26,13 +27,21 @@ class SPNFePublicClient:
         self.min_interval_sec = min_interval_sec
         self.timeout = timeout
         self._last_fetch: Dict[str, float] = {}
+        self._aclient: Optional[httpx.AsyncClient] = None
+        self._aclient_loop = None
 
-    def _rate_limit(self, chave: str):
+    def _rate_limit_wait(self, chave: str) -> float:
+        """Reserva a próxima consulta da chave; devolve quanto esperar até ela."""
         now = time.time()
         last = self._last_fetch.get(chave)
-        if last and (now - last) < self.min_interval_sec:
-            time.sleep(self.min_interval_sec - (now - last))
-        self._last_fetch[chave] = time.time()
+        wait = self.min_interval_sec - (now - last) if last and (now - last) < self.min_interval_sec else 0.0
+        self._last_fetch[chave] = now + wait
+        return wait
+
+    def _rate_limit(self, chave: str):
+        wait = self._rate_limit_wait(chave)
+        if wait > 0:
+            time.sleep(wait)
 
     @staticmethod
     def _clean_text(t: Optional[str]) -> Optional[str]:
@@ -163,6 +172,31 @@ class SPNFePublicClient:
 
         return data
 
+    def _result(self, initial_status: int, status: int, text: str) -> Dict[str, Any]:
+        """Interpreta as respostas do GET inicial e do GET com a chave."""
+        if initial_status >= 500:
+            return {"status": "error", "detail": f"http_{initial_status}_initial"}
+        if status == 404:
+            return {"status": "not_found"}
+        if status >= 500:
+            return {"status": "error", "detail": f"http_{status}"}
+
+        tree = html.fromstring(text)
+        if self._detect_captcha(tree):
+            return {"status": "captcha_required"}
+
+        data = self._parse_sections(tree)
+        if "chave" not in data:
+            return {"status": "not_found"}
+
+        raw_hash = hashlib.sha256(text.encode('utf-8', errors='ignore')).hexdigest()
+        data.update({
+            "status": "ok",
+            "raw_html_hash": f"sha256:{raw_hash}",
+            "fetched_at": datetime.datetime.utcnow().isoformat() + 'Z'
+        })
+        return data
+
     def consulta_publica_chave(self, chave: str) -> Dict[str, Any]:
         chave = re.sub(r"\D", "", chave)
         if len(chave) != 44:
@@ -172,36 +206,42 @@ class SPNFePublicClient:
             # Passo 1: GET inicial (cookies / viewstate se necessário)
             resp = self.session.get(self.BASE_URL, timeout=self.timeout)
             if resp.status_code >= 500:
-                return {"status": "error", "detail": f"http_{resp.status_code}_initial"}
+                return self._result(resp.status_code, 0, "")
             # Sem viewstate handling por enquanto (placeholder). Se necessário, extrair hidden inputs.
 
             # Passo 2: Submeter chave.
             # Sem HTML do form real, tentamos GET com parâmetro nfe=<chave>. Ajustaremos se necessário.
             params = {"nfe": chave}
             resp2 = self.session.get(self.BASE_URL, params=params, timeout=self.timeout)
-            if resp2.status_code == 404:
-                return {"status": "not_found"}
-            if resp2.status_code >= 500:
-                return {"status": "error", "detail": f"http_{resp2.status_code}"}
-
-            tree = html.fromstring(resp2.text)
-            if self._detect_captcha(tree):
-                return {"status": "captcha_required"}
-
-            data = self._parse_sections(tree)
-            if "chave" not in data:
-                return {"status": "not_found"}
-
-            raw_hash = hashlib.sha256(resp2.text.encode('utf-8', errors='ignore')).hexdigest()
-            data.update({
-                "status": "ok",
-                "raw_html_hash": f"sha256:{raw_hash}",
-                "fetched_at": datetime.datetime.utcnow().isoformat() + 'Z'
-            })
-            return data
+            return self._result(resp.status_code, resp2.status_code, resp2.text)
         except requests.RequestException as e:
             return {"status": "error", "detail": str(e)}
 
+    def _async_client(self) -> httpx.AsyncClient:
+        # criado no primeiro uso, dentro do event loop; recriado se o loop mudar
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            self._aclient = httpx.AsyncClient(headers=dict(self.session.headers), timeout=self.timeout, follow_redirects=True)
+            self._aclient_loop = loop
+        return self._aclient
+
+    async def consulta_publica_chave_async(self, chave: str) -> Dict[str, Any]:
+        """``consulta_publica_chave`` sem bloquear o event loop (httpx)."""
+        chave = re.sub(r"\D", "", chave)
+        if len(chave) != 44:
+            return {"status": "error", "detail": "chave_invalida"}
+        await asyncio.sleep(self._rate_limit_wait(chave))
+        client = self._async_client()
+        try:
+            resp = await client.get(self.BASE_URL)
+            if resp.status_code >= 500:
+                return self._result(resp.status_code, 0, "")
+            resp2 = await client.get(self.BASE_URL, params={"nfe": chave})
+            # parse do HTML é CPU: fora do event loop
+            return await asyncio.to_thread(self._result, resp.status_code, resp2.status_code, resp2.text)
+        except httpx.HTTPError as e:
+            return {"status": "error", "detail": str(e)}
+
 
 _default_client: Optional[SPNFePublicClient] = None
 
@@ -210,3 +250,9 @@ def consulta_publica_sp(chave: str) -> Dict[str, Any]:
     if _default_client is None:
         _default_client = SPNFePublicClient()
     return _default_client.consulta_publica_chave(chave)
+
+async def consulta_publica_sp_async(chave: str) -> Dict[str, Any]:
+    global _default_client
+    if _default_client is None:
+        _default_client = SPNFePublicClient()
+    return await _default_client.consulta_publica_chave_async(chave)
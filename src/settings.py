@@ -7,6 +7,13 @@ class Settings(BaseSettings):
 
     STORAGE_BASE_PATH: str = "storage/xml"
     CERTS_BASE_PATH: str = "storage/certs"
+    # Armazenamento dos XMLs: flat ({cnpj}/{nsu}_{schema}.xml) ou cas (SHA-256, deduplicado,
+    # comprimido, diretórios fragmentados). Compressão do cas: gzip|zstd|none (zstd requer zstandard)
+    XML_STORAGE_BACKEND: str = "flat"
+    XML_STORAGE_COMPRESSION: str = "gzip"
+    # Guarda o docZip exatamente como o AN envia (GZip), sem inflar na ingestão; o download
+    # é servido com Content-Encoding: gzip quando o cliente aceita
+    DFE_STORE_DOCZIP_RAW: bool = False
 
     NFE_AMBIENTE: str = "HOMOLOG"  # HOMOLOG|PRODUCAO
     AN_WSDL_HOMOLOG: str
@@ -21,15 +28,62 @@ class Settings(BaseSettings):
 
     # Em 2025 muitos hosts do AN não servem mais o ?WSDL (404). Por padrão, usar SOAP direto.
     DFE_USE_WSDL: bool = False
+    # Modo WSDL: bytes do WSDL/XSD persistidos (SqliteCache do zeep) e validade do documento
+    # parseado em memória (recarregado em segundo plano após o prazo)
+    DFE_WSDL_CACHE_PATH: str | None = "storage/wsdl_cache.db"
+    DFE_WSDL_TTL_SEC: int = 86400
 
     # Endpoints de RecepcaoEvento v4.00 (serviço de eventos da NF-e)
     # São URLs do serviço (SOAP endpoint), não necessariamente WSDL.
     EV_URL_HOMOLOG: str = "https://hom.nfe.fazenda.gov.br/ws/NFeRecepcaoEvento4/NFeRecepcaoEvento4.asmx"
     EV_URL_PRODUCAO: str = "https://www.nfe.fazenda.gov.br/ws/NFeRecepcaoEvento4/NFeRecepcaoEvento4.asmx"
+    # Manifestação em lote: eventos por envEvento (o serviço aceita até 20) e lotes enviados em paralelo
+    DFE_EVENT_BATCH_SIZE: int = 20
+    DFE_EVENT_BATCH_WORKERS: int = 4
 
     JOB_INTERVAL_MINUTES: int = 10
+    # Agendador: empresas sincronizadas em paralelo (teto global), cota de páginas por
+    # empresa em cada varredura (0 = sem limite) e prazo da varredura (None = intervalo - 30 s)
+    DFE_SYNC_WORKERS: int = 8
+    DFE_MAX_PAGES_PER_RUN: int = 0
+    DFE_SYNC_DEADLINE_SEC: int | None = None
+    # Agenda persistente (dfe_agenda): espera após ciclo ocioso (ultNSU==maxNSU) e espera
+    # exponencial após erro/serviço paralisado (base dobrando por falha seguida, até o teto)
+    DFE_IDLE_HOLD_SEC: int = 3600
+    DFE_AGENDA_RETRY_BASE_SEC: int = 120
+    DFE_AGENDA_RETRY_CAP_SEC: int = 3600
+    # Recuperação de lacunas de NSU (dfe_nsu_gaps) por consNSU: consultas simultâneas por empresa
+    # (ritmo por host segue o governador), NSUs por execução e tentativas com erro por intervalo
+    DFE_GAP_WORKERS: int = 4
+    DFE_GAP_MAX_PER_RUN: int = 200
+    DFE_GAP_MAX_ATTEMPTS: int = 5
+    # Fila de sincronizações da API (dfe_jobs): threads worker no processo da API (0 = só o
+    # processo src.jobs.sync_worker), intervalo de varredura da fila e prazo sem progresso
+    # após o qual um job em execução é dado como abandonado
+    DFE_JOB_WORKERS: int = 2
+    DFE_JOB_POLL_SEC: float = 2.0
+    DFE_JOB_STALE_SEC: int = 900
+    # Manifestação automática (dfe_auto_manifest; desligada por padrão, pois envia eventos fiscais):
+    # resNFe novo recebe Ciência da Operação em lote ao final do ciclo e, após a espera, o procNFe
+    # é buscado por consChNFe (DFE_GAP_WORKERS consultas simultâneas). Ciências e consultas por
+    # execução, espera após a Ciência e tentativas sem sucesso por nota
+    DFE_AUTO_MANIFEST: bool = False
+    DFE_AUTO_MANIFEST_MAX_PER_RUN: int = 100
+    DFE_AUTO_MANIFEST_FETCH_PER_RUN: int = 20
+    DFE_AUTO_MANIFEST_PROC_DELAY_SEC: int = 300
+    DFE_AUTO_MANIFEST_MAX_ATTEMPTS: int = 10
 
+    # Obsoleto (sem efeito): a pausa fixa entre páginas foi substituída pelo governador adaptativo
     DFE_SLEEP_BETWEEN_CALLS_MS: int = 350
+    # Governador de taxa por host (somando todas as empresas/threads/processos): teto e piso
+    # de requisições por segundo, passo de aumento e latência-alvo; estado compartilhado em arquivo
+    DFE_HOST_MAX_RPS: float = 4.0
+    DFE_GOV_MIN_RPS: float = 0.2
+    DFE_GOV_STEP_RPS: float = 0.1
+    DFE_GOV_LATENCY_TARGET_MS: int = 2000
+    DFE_GOVERNOR_STATE_PATH: str | None = "storage/rate_governor.json"
+    # Intervalo mínimo (s) entre trocas da taxa com o arquivo; o balde de fichas fica em memória
+    DFE_GOV_SYNC_SEC: float = 1.0
     DFE_MAX_ATTEMPTS: int = 4
     DFE_BACKOFF_BASE_SEC: int = 8
     DFE_BACKOFF_CAP_SEC: int = 180
@@ -37,6 +91,26 @@ class Settings(BaseSettings):
     DFE_CA_BUNDLE: str | None = None
     # Ativa logs detalhados de chamadas DF-e
     DFE_DEBUG: bool = False
+    # Threads para gravar os XMLs de uma página em paralelo
+    DFE_IO_WORKERS: int = 8
+    # Contadores da tela de importação lidos de dfe_contadores (O(1)) em vez do agregado agrupado
+    DFE_COUNTERS_TABLE: bool = False
+    # Sessões mTLS reutilizadas (keep-alive) por empresa/certificado/serviço
+    DFE_SESSION_IDLE_SEC: int = 900
+    DFE_SESSION_POOL_MAXSIZE: int = 4
+    # Afinidade URL/versão SOAP + circuit breaker dos endpoints (ranking persistido em JSON)
+    DFE_ENDPOINT_CACHE_PATH: str | None = "storage/endpoint_health.json"
+    DFE_CB_FAIL_THRESHOLD: int = 3
+    DFE_CB_OPEN_SEC: int = 600
+    # Prazo da sonda em meia-abertura: enquanto corre, o candidato fica como aberto para os demais
+    DFE_CB_PROBE_SEC: int = 60
+    # Histórico das execuções (dfe_sync_runs): páginas com tempo por etapa guardadas por execução
+    # (as demais só nos totais) e dias mantidos antes da limpeza pelo agendador (0 = manter tudo)
+    DFE_SYNC_TRACE_MAX_PAGES: int = 200
+    DFE_SYNC_RUNS_RETENTION_DAYS: int = 30
+    # Métricas Prometheus: a API expõe GET /metrics; agendador e sync_worker sobem um servidor
+    # próprio nesta porta (0 = desligado)
+    DFE_METRICS_PORT: int = 0
 
     class Config:
         env_file = ".env"
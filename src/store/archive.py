@@ -0,0 +1,94 @@
+"""Pacotes ZIP/tar.gz gerados sob demanda, em memória constante.
+
+Os geradores recebem entradas ``(nome no pacote, referência no storage, data)`` e devolvem
+os bytes do pacote aos pedaços, à medida que cada XML é lido (``open_xml``: descomprime
+gzip/zstd do storage). Nada é montado em disco nem acumulado além do arquivo corrente
+(no ZIP, também o índice do diretório central, ~1 KB por arquivo), então servem de corpo
+para ``StreamingResponse`` mesmo com dezenas de milhares de XMLs.
+
+- ZIP: ``zipfile`` sobre um destino sem ``seek`` (descritor de dados após cada arquivo),
+  deflate por entrada e ZIP64 automático quando o pacote passa de 4 GiB;
+- tar.gz: ``tarfile`` em modo fluxo (``w|gz``). O cabeçalho tar exige o tamanho antes do
+  conteúdo: arquivo ``.xml`` sem compressão é copiado do disco; comprimido é inflado
+  em memória (um documento por vez).
+"""
+import io, os, tarfile, time, zipfile
+from datetime import datetime
+from typing import Iterable, Iterator
+from src.store.xml_store import open_xml, read_xml
+
+CHUNK = 64 * 1024
+
+Entry = tuple[str, str, datetime | None]
+
+class _Sink:
+    """Destino de escrita sem ``seek``: acumula o que o zipfile/tarfile escreve até o próximo ``drain``."""
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+
+    def write(self, b) -> int:
+        self._parts.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts.clear()
+        return out
+
+def _zip_time(ts: datetime | None) -> tuple:
+    ts = ts or datetime.now()
+    return (max(ts.year, 1980), ts.month, ts.day, ts.hour, ts.minute, ts.second)
+
+def zip_stream(entries: Iterable[Entry]) -> Iterator[bytes]:
+    """ZIP das entradas; arquivos ausentes no storage são pulados e listados em ``ausentes.txt``."""
+    sink = _Sink(); missing = []
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, ref, ts in entries:
+            try:
+                src = open_xml(ref)
+            except OSError:
+                missing.append(name)
+                continue
+            info = zipfile.ZipInfo(name, _zip_time(ts))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with src, zf.open(info, "w") as dst:
+                while chunk := src.read(CHUNK):
+                    dst.write(chunk)
+                    if len(sink._parts) > 8:
+                        yield sink.drain()
+            yield sink.drain()
+        if missing:
+            zf.writestr("ausentes.txt", "\n".join(missing) + "\n")
+    yield sink.drain()  # diretório central
+
+def tar_gz_stream(entries: Iterable[Entry]) -> Iterator[bytes]:
+    """tar.gz das entradas; mesmas regras de ``zip_stream`` para arquivos ausentes."""
+    sink = _Sink(); missing = []
+    with tarfile.open(fileobj=sink, mode="w|gz") as tf:
+        for name, ref, ts in entries:
+            info = tarfile.TarInfo(name)
+            info.mtime = int(ts.timestamp()) if ts else int(time.time())
+            info.mode = 0o644
+            try:
+                if ref.endswith(".xml"):
+                    info.size = os.path.getsize(ref)
+                    with open(ref, "rb") as src:
+                        tf.addfile(info, src)
+                else:
+                    data = read_xml(ref)
+                    info.size = len(data)
+                    tf.addfile(info, io.BytesIO(data))
+            except OSError:
+                missing.append(name)
+                continue
+            tf.members.clear()  # índice só serve para leitura; no fluxo, cresceria com o pacote
+            yield sink.drain()
+        if missing:
+            data = ("\n".join(missing) + "\n").encode()
+            info = tarfile.TarInfo("ausentes.txt"); info.size = len(data); info.mtime = int(time.time())
+            tf.addfile(info, io.BytesIO(data))
+    yield sink.drain()
@@ -1,5 +1,9 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from src.settings import settings
 engine = create_engine(settings.DB_URL, pool_pre_ping=True, future=True)
+# Travas consultivas de sessão (src/core/jobs.py) seguram a conexão durante o ciclo inteiro da
+# empresa: conexões próprias, fora do pool das sessões, que fica livre para o trabalho dos workers
+lock_engine = create_engine(settings.DB_URL, poolclass=NullPool, future=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
\ No newline at end of file
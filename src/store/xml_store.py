@@ -0,0 +1,144 @@
+"""Armazenamento dos XMLs (documentos DF-e e retornos de eventos).
+
+Backends (``XML_STORAGE_BACKEND``):
+- ``flat``: layout legado ``{STORAGE_BASE_PATH}/{cnpj}/{nome}.xml``, sem compressão;
+- ``cas``: endereçado por conteúdo (SHA-256), com deduplicação, compressão em repouso
+  (``XML_STORAGE_COMPRESSION`` = gzip|zstd|none) e diretórios fragmentados
+  ``{STORAGE_BASE_PATH}/cas/ab/cd/abcd...xml.gz`` para não acumular milhões de
+  arquivos em uma só pasta.
+
+A referência devolvida por ``put`` é o caminho gravado em ``caminho_xml``. A leitura
+(``read_xml``/``open_xml``) decide a descompressão pela extensão, então documentos
+de ambos os layouts continuam legíveis qualquer que seja o backend configurado.
+Com ``DFE_STORE_DOCZIP_RAW`` os docZip chegam já em GZip e são gravados como vieram
+(``put_xml_gzip``), sem inflar/recomprimir. Migração do layout plano:
+``python -m src.jobs.migrate_storage``.
+"""
+import gzip, hashlib, logging, os, tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO
+from src.settings import settings
+from src.core import metrics
+
+try:  # dependência opcional
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+logger = logging.getLogger("dfe.store")
+
+class XmlStore(ABC):
+    @abstractmethod
+    def put(self, cnpj: str, name: str, data: bytes) -> str:
+        """Grava o XML e devolve a referência (caminho) para ``caminho_xml``."""
+
+    @abstractmethod
+    def put_gzip(self, cnpj: str, name: str, gz: bytes) -> str:
+        """Grava um XML já comprimido em GZip (docZip do AN) sem inflar; ref termina em .gz."""
+
+class FlatStore(XmlStore):
+    def __init__(self, base: str):
+        self.base = Path(base)
+
+    def put(self, cnpj: str, name: str, data: bytes) -> str:
+        d = self.base/cnpj
+        d.mkdir(parents=True, exist_ok=True)
+        path = d/name
+        path.write_bytes(data)
+        metrics.storage_written("flat", len(data))
+        return str(path)
+
+    def put_gzip(self, cnpj: str, name: str, gz: bytes) -> str:
+        return self.put(cnpj, name + ".gz", gz)
+
+class CasStore(XmlStore):
+    def __init__(self, base: str, compression: str = "gzip"):
+        self.root = Path(base)/"cas"
+        if compression == "zstd" and zstandard is None:
+            logger.warning("zstandard não instalado; usando gzip no armazenamento de XML")
+            compression = "gzip"
+        self.compression = compression
+
+    @property
+    def suffix(self) -> str:
+        return {"gzip": ".xml.gz", "zstd": ".xml.zst"}.get(self.compression, ".xml")
+
+    def path_for(self, digest: str) -> Path:
+        return self.root/digest[:2]/digest[2:4]/(digest + self.suffix)
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.compression == "gzip":
+            # mtime=0: mesma entrada -> mesmos bytes (arquivo idêntico entre réplicas/backups)
+            return gzip.compress(data, compresslevel=6, mtime=0)
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=9).compress(data)
+        return data
+
+    def _write(self, path: Path, blob: bytes) -> str:
+        if path.exists():
+            return str(path)  # deduplicado: mesmo conteúdo já armazenado
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, path)  # atômico: leitores nunca veem arquivo parcial
+        except BaseException:
+            try: os.remove(tmp)
+            except OSError: pass
+            raise
+        metrics.storage_written("cas", len(blob))
+        return str(path)
+
+    def put(self, cnpj: str, name: str, data: bytes) -> str:
+        return self._write(self.path_for(hashlib.sha256(data).hexdigest()), self._compress(data))
+
+    def put_gzip(self, cnpj: str, name: str, gz: bytes) -> str:
+        # endereçado pelo hash dos bytes comprimidos (não infla); o mesmo docZip recebido
+        # de novo deduplica, mas não coincide com o mesmo XML gravado via put()
+        digest = hashlib.sha256(gz).hexdigest()
+        return self._write(self.root/digest[:2]/digest[2:4]/(digest + ".xml.gz"), gz)
+
+_store: XmlStore | None = None
+
+def get_store() -> XmlStore:
+    global _store
+    if _store is None:
+        if settings.XML_STORAGE_BACKEND == "cas":
+            _store = CasStore(settings.STORAGE_BASE_PATH, settings.XML_STORAGE_COMPRESSION)
+        else:
+            _store = FlatStore(settings.STORAGE_BASE_PATH)
+    return _store
+
+def put_xml(cnpj: str, name: str, data: bytes) -> str:
+    return get_store().put(cnpj, name, data)
+
+def put_xml_gzip(cnpj: str, name: str, gz: bytes) -> str:
+    return get_store().put_gzip(cnpj, name, gz)
+
+def _ref(doc_or_ref) -> str:
+    return doc_or_ref if isinstance(doc_or_ref, str) else doc_or_ref.caminho_xml
+
+def open_xml(doc_or_ref) -> BinaryIO:
+    """Stream do XML descomprimido (aceita DFEDocumento ou o caminho gravado)."""
+    ref = _ref(doc_or_ref)
+    if ref.endswith(".gz"):
+        return gzip.open(ref, "rb")
+    if ref.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("zstandard não instalado para ler " + ref)
+        return zstandard.ZstdDecompressor().stream_reader(open(ref, "rb"), closefd=True)
+    return open(ref, "rb")
+
+def read_xml(doc_or_ref) -> bytes:
+    with open_xml(doc_or_ref) as f:
+        return f.read()
+
+def is_gzip(doc_or_ref) -> bool:
+    """Arquivo guardado em GZip: pode ser servido como está com Content-Encoding: gzip."""
+    return _ref(doc_or_ref).endswith(".gz")
+
+def xml_exists(doc_or_ref) -> bool:
+    ref = _ref(doc_or_ref)
+    return bool(ref) and os.path.isfile(ref)
@@ -0,0 +1,97 @@
+"""Transporte assíncrono (httpx) para as rotas da API.
+
+Contraparte do ``session_pool`` para código ``async``: um ``httpx.AsyncClient`` com
+keep-alive por (empresa, serviço), montado sobre o mesmo ``SSLContext`` (cert cliente e
+CAs carregados uma vez) e refeito quando o certificado ou o ``verify`` mudam. Assim uma
+chamada ao AN que demora não prende uma thread do servidor: o processo atende muitas
+consultas/sincronizações simultâneas, limitadas apenas pelo governador por host.
+
+O cliente pertence ao event loop em que foi criado; em outro loop (ex.: testes), é
+recriado. O agendador e os jobs continuam no transporte síncrono (``requests``).
+"""
+import asyncio, threading, time
+from typing import Optional, Tuple
+import httpx
+from src.settings import settings
+from src.ws.session_pool import cert_fingerprint, ssl_context
+
+class _Entry:
+    __slots__ = ("client", "fingerprint", "verify", "loop", "last_used")
+
+    def __init__(self, client: httpx.AsyncClient, fingerprint: str, verify, loop):
+        self.client = client
+        self.fingerprint = fingerprint
+        self.verify = verify
+        self.loop = loop
+        self.last_used = time.monotonic()
+
+    def close(self):
+        # fechamento assíncrono agendado no loop dono do cliente (se ainda ativo)
+        try:
+            if not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(lambda: self.loop.create_task(self.client.aclose()))
+        except RuntimeError:
+            pass
+
+# (empresa, serviço) -> entrada
+_registry: dict[tuple[str, str], _Entry] = {}
+_lock = threading.Lock()
+
+class ConnectTimer:
+    """Extensão ``trace`` do httpx: soma o tempo de TCP + TLS das conexões novas de um POST."""
+
+    def __init__(self):
+        self.sec = 0.0
+        self._t0 = None
+
+    async def __call__(self, name: str, info: dict):
+        if name == "connection.connect_tcp.started":
+            self._t0 = time.monotonic()
+        elif name in ("connection.start_tls.complete", "connection.start_tls.failed",
+                      "connection.connect_tcp.failed") and self._t0 is not None:
+            self.sec += time.monotonic() - self._t0
+            self._t0 = None
+
+def _new_client(cert_tuple: Tuple[str, str], verify) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=settings.DFE_SESSION_POOL_MAXSIZE,
+                          max_keepalive_connections=settings.DFE_SESSION_POOL_MAXSIZE,
+                          keepalive_expiry=settings.DFE_SESSION_IDLE_SEC)
+    return httpx.AsyncClient(verify=ssl_context(cert_tuple, verify), limits=limits, timeout=45)
+
+def _evict_idle_locked(now: float):
+    ttl = settings.DFE_SESSION_IDLE_SEC
+    for key in [k for k, e in _registry.items() if now - e.last_used > ttl]:
+        _registry.pop(key).close()
+
+def get_client(empresa: str, cert_tuple: Tuple[str, str], verify, service: str = "dist") -> httpx.AsyncClient:
+    """Cliente mTLS assíncrono da empresa para o serviço (chamar de dentro do event loop)."""
+    fp = cert_fingerprint(cert_tuple)
+    loop = asyncio.get_running_loop()
+    key = (empresa, service)
+    now = time.monotonic()
+    with _lock:
+        _evict_idle_locked(now)
+        entry = _registry.get(key)
+        if entry is not None and (entry.fingerprint != fp or entry.verify != verify or entry.loop is not loop):
+            _registry.pop(key).close()
+            entry = None
+        if entry is None:
+            entry = _Entry(_new_client(cert_tuple, verify), fp, verify, loop)
+            _registry[key] = entry
+        entry.last_used = now
+        return entry.client
+
+def invalidate(empresa: Optional[str] = None):
+    """Fecha os clientes da empresa (ou todos, se ``empresa`` for None)."""
+    with _lock:
+        for key in [k for k in _registry if empresa is None or k[0] == empresa]:
+            _registry.pop(key).close()
+
+async def aclose_all():
+    """Fecha todos os clientes do loop atual (desligamento da API)."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        mine = [k for k, e in _registry.items() if e.loop is loop]
+        entries = [_registry.pop(k) for k in mine]
+    for e in entries:
+        await e.client.aclose()
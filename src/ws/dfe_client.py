@@ -1,15 +1,16 @@
-import time, random, zlib, gzip, base64, certifi, logging
-from typing import Tuple, List, Dict, Optional, Generator
+import asyncio, time, random, certifi, logging
+from typing import Tuple, List, Dict, Optional, Generator, AsyncGenerator
+import httpx
 import requests
-from lxml import etree
-from zeep import Client, Settings
-from zeep.transports import Transport
-import os
 from src.settings import settings
+from src.ws.session_pool import get_session, take_connect_time
+from src.ws import async_transport, endpoint_health, wsdl_cache
+from src.ws.rate_limit import limiter
+from src.ws.dist_response import decode_ret_dist
 
-NS_WS  = "http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe"
-NS_NFE = "http://www.portalfiscal.inf.br/nfe"
-ACTION = "http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe/nfeDistDFeInteresse"
+from src.ws.soap_builder import HEADERS, SOAP_VERSIONS
+from src.ws import soap_builder
+from src.core import metrics
 
 def _wsdl():
     return settings.AN_WSDL_PRODUCAO if settings.NFE_AMBIENTE.upper().startswith("PROD") else settings.AN_WSDL_HOMOLOG
@@ -54,240 +55,106 @@ def _dist_url_candidates() -> list[str]:
 def _create_client_with_fallback(session: requests.Session):
     if not settings.DFE_USE_WSDL:
         return None
-    transport = Transport(session=session, timeout=45)
-    remote_wsdl = _wsdl()
-    local_wsdl = settings.AN_WSDL_LOCAL_PATH or os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "wsdl", "NFeDistribuicaoDFe.wsdl")
-    local_wsdl = os.path.abspath(local_wsdl)
-    # Tenta remoto primeiro
-    try:
-        return Client(wsdl=remote_wsdl, transport=transport, settings=Settings(strict=False, xml_huge_tree=True))
-    except Exception as e:
-        if settings.DFE_DEBUG:
-            logger.warning(f"Falha ao carregar WSDL remoto ({remote_wsdl}): {e}. Tentando fallback local: {local_wsdl}")
-        if os.path.exists(local_wsdl):
-            return Client(wsdl=local_wsdl, transport=transport, settings=Settings(strict=False, xml_huge_tree=True))
-        # Sem WSDL: retornar None e forçar modo SOAP direto
-        return None
+    # WSDL parseado uma vez por processo/ambiente (remoto, com fallback local); ver src.ws.wsdl_cache
+    return wsdl_cache.get_client(session)
 
 def _endpoint_url_from_wsdl(wsdl_url: str) -> str:
         # Remove sufixo ?WSDL
         return (wsdl_url or '').split('?')[0]
 
-def _post_soap_dist(session: requests.Session, cnpj: str, ult_nsu: str) -> Optional[dict]:
-        # Tentar SOAP 1.1 e 1.2 em múltiplos endpoints
-        tpAmb = "1" if settings.NFE_AMBIENTE.upper().startswith("PROD") else "2"
-        # Envelope SOAP 1.1 com wrapper nfeDadosMsg
-        envelope11 = f'''<?xml version="1.0" encoding="utf-8"?>
-<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ws="{NS_WS}" xmlns:nfe="{NS_NFE}">
-    <soap:Body>
-        <ws:nfeDistDFeInteresse>
-            <ws:nfeDadosMsg>
-                <distDFeInt xmlns="{NS_NFE}" versao="1.01">
-                    <tpAmb>{tpAmb}</tpAmb>
-                    <CNPJ>{_digits(cnpj)}</CNPJ>
-                    <distNSU>
-                        <ultNSU>{_ensure_nsu15(ult_nsu)}</ultNSU>
-                    </distNSU>
-                </distDFeInt>
-            </ws:nfeDadosMsg>
-        </ws:nfeDistDFeInteresse>
-    </soap:Body>
-</soap:Envelope>'''
-        # Envelope SOAP 1.2 com wrapper nfeDadosMsg
-        envelope12 = f'''<?xml version="1.0" encoding="utf-8"?>
-<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope" xmlns:ws="{NS_WS}" xmlns:nfe="{NS_NFE}">
-    <soap12:Body>
-        <ws:nfeDistDFeInteresse>
-            <ws:nfeDadosMsg>
-                <distDFeInt xmlns="{NS_NFE}" versao="1.01">
-                    <tpAmb>{tpAmb}</tpAmb>
-                    <CNPJ>{_digits(cnpj)}</CNPJ>
-                    <distNSU>
-                        <ultNSU>{_ensure_nsu15(ult_nsu)}</ultNSU>
-                    </distNSU>
-                </distDFeInt>
-            </ws:nfeDadosMsg>
-        </ws:nfeDistDFeInteresse>
-    </soap12:Body>
-</soap12:Envelope>'''
-        headers11 = {'Content-Type': 'text/xml; charset=utf-8','SOAPAction': ACTION}
-        headers12 = {'Content-Type': 'application/soap+xml; charset=utf-8; action="'+ACTION+'"'}
-        attempts_log = []
-        for candidate in _dist_url_candidates():
-            # 1) Tenta SOAP 1.1
-            try:
-                r = session.post(candidate, data=envelope11.encode('utf-8'), headers=headers11, timeout=45)
-                if r.status_code == 200:
-                    return {"ok": True, "raw": r.content, "url": candidate, "ver": "1.1"}
-                if settings.DFE_DEBUG:
-                    logger.error(f"SOAP11 HTTP={r.status_code} url={candidate} body={r.text[:300]}")
-                attempts_log.append(f"SOAP11 {candidate} -> HTTP {r.status_code}")
-            except Exception as e:
-                if settings.DFE_DEBUG:
-                    logger.error(f"SOAP11 erro url={candidate} err={e}")
-                attempts_log.append(f"SOAP11 {candidate} -> EXC {e}")
-            # 2) Tenta SOAP 1.2
-            try:
-                r = session.post(candidate, data=envelope12.encode('utf-8'), headers=headers12, timeout=45)
-                if r.status_code == 200:
-                    return {"ok": True, "raw": r.content, "url": candidate, "ver": "1.2"}
-                if settings.DFE_DEBUG:
-                    logger.error(f"SOAP12 HTTP={r.status_code} url={candidate} body={r.text[:300]}")
-                attempts_log.append(f"SOAP12 {candidate} -> HTTP {r.status_code}")
-            except Exception as e:
-                if settings.DFE_DEBUG:
-                    logger.error(f"SOAP12 erro url={candidate} err={e}")
-                attempts_log.append(f"SOAP12 {candidate} -> EXC {e}")
-        return {"ok": False, "log": "; ".join(attempts_log)}
-
-def _post_soap_consnsu(session: requests.Session, cnpj: str, nsu: str) -> Optional[dict]:
-        tpAmb = "1" if settings.NFE_AMBIENTE.upper().startswith("PROD") else "2"
-        envelope11 = f'''<?xml version="1.0" encoding="utf-8"?>
-<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ws="{NS_WS}" xmlns:nfe="{NS_NFE}">
-    <soap:Body>
-        <ws:nfeDistDFeInteresse>
-            <ws:nfeDadosMsg>
-                <distDFeInt xmlns="{NS_NFE}" versao="1.01">
-                    <tpAmb>{tpAmb}</tpAmb>
-                    <CNPJ>{_digits(cnpj)}</CNPJ>
-                    <consNSU>
-                        <NSU>{_ensure_nsu15(nsu)}</NSU>
-                    </consNSU>
-                </distDFeInt>
-            </ws:nfeDadosMsg>
-        </ws:nfeDistDFeInteresse>
-    </soap:Body>
-</soap:Envelope>'''
-        envelope12 = f'''<?xml version="1.0" encoding="utf-8"?>
-<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope" xmlns:ws="{NS_WS}" xmlns:nfe="{NS_NFE}">
-    <soap12:Body>
-        <ws:nfeDistDFeInteresse>
-            <ws:nfeDadosMsg>
-                <distDFeInt xmlns="{NS_NFE}" versao="1.01">
-                    <tpAmb>{tpAmb}</tpAmb>
-                    <CNPJ>{_digits(cnpj)}</CNPJ>
-                    <consNSU>
-                        <NSU>{_ensure_nsu15(nsu)}</NSU>
-                    </consNSU>
-                </distDFeInt>
-            </ws:nfeDadosMsg>
-        </ws:nfeDistDFeInteresse>
-    </soap12:Body>
-</soap12:Envelope>'''
-        headers11 = {'Content-Type':'text/xml; charset=utf-8','SOAPAction': ACTION}
-        headers12 = {'Content-Type':'application/soap+xml; charset=utf-8; action="'+ACTION+'"'}
+def _net_timing(timing:dict, started:float, connect:float) -> dict:
+        # servidor = todo o resto do laço de candidatos (envio, espera da resposta, corpo, falhas)
+        timing["connect"] = connect
+        timing["server"] = max(0.0, time.monotonic() - started - timing["rate_wait"] - connect)
+        return timing
+
+def _post_soap(session: requests.Session, op: str, cnpj: str, value: str) -> dict:
+        """Envia a operação ``op`` (distNSU|consNSU|consChNFe) aos candidatos (URL × SOAP 1.1/1.2)
+        na ordem aprendida por endpoint_health. O envelope de cada versão é montado a partir
+        dos modelos pré-compilados de soap_builder, só quando a versão é tentada.
+        ``timing``: espera no governador, conexão (TCP+TLS) e servidor, somando as tentativas."""
+        envelopes: dict[str, bytes] = {}
         attempts_log = []
-        for candidate in _dist_url_candidates():
+        started = time.monotonic(); timing = {"rate_wait": 0.0}
+        take_connect_time()  # zera o acumulado da thread
+        for candidate, ver in endpoint_health.ordered("dist", _dist_url_candidates(), SOAP_VERSIONS):
+            tag = "SOAP11" if ver == "1.1" else "SOAP12"
+            data = envelopes.get(ver)
+            if data is None:
+                data = envelopes[ver] = soap_builder.envelope(op, ver, cnpj, value)
             try:
-                r = session.post(candidate, data=envelope11.encode('utf-8'), headers=headers11, timeout=45)
+                w0 = time.monotonic()
+                limiter.acquire(candidate)
+                t0 = time.monotonic()
+                timing["rate_wait"] += t0 - w0
+                r = session.post(candidate, data=data, headers=HEADERS[ver], timeout=45)
+                dt = time.monotonic() - t0
+                limiter.observe(candidate, dt, r.status_code == 200)
+                metrics.ws_request("dist", candidate, ver, dt, r.status_code)
                 if r.status_code == 200:
-                    return {"ok": True, "raw": r.content, "url": candidate, "ver": "1.1"}
+                    endpoint_health.health.success("dist", candidate, ver)
+                    return {"ok": True, "raw": r.content, "url": candidate, "ver": ver,
+                            "timing": _net_timing(timing, started, take_connect_time())}
+                endpoint_health.health.failure("dist", candidate, ver)
                 if settings.DFE_DEBUG:
-                    logger.error(f"SOAP11 consNSU HTTP=={r.status_code} url={candidate} body={r.text[:300]}")
-                attempts_log.append(f"SOAP11 {candidate} -> HTTP {r.status_code}")
+                    logger.error(f"{tag} {op} HTTP={r.status_code} url={candidate} body={r.text[:300]}")
+                attempts_log.append(f"{tag} {candidate} -> HTTP {r.status_code}")
             except Exception as e:
+                endpoint_health.health.failure("dist", candidate, ver)
+                metrics.ws_request("dist", candidate, ver, None, None)
+                if isinstance(e, requests.RequestException):
+                    limiter.observe(candidate, None, False)
                 if settings.DFE_DEBUG:
-                    logger.error(f"SOAP11 consNSU erro url={candidate} err={e}")
-                attempts_log.append(f"SOAP11 {candidate} -> EXC {e}")
-            try:
-                r = session.post(candidate, data=envelope12.encode('utf-8'), headers=headers12, timeout=45)
-                if r.status_code == 200:
-                    return {"ok": True, "raw": r.content, "url": candidate, "ver": "1.2"}
-                if settings.DFE_DEBUG:
-                    logger.error(f"SOAP12 consNSU HTTP=={r.status_code} url={candidate} body={r.text[:300]}")
-                attempts_log.append(f"SOAP12 {candidate} -> HTTP {r.status_code}")
-            except Exception as e:
-                if settings.DFE_DEBUG:
-                    logger.error(f"SOAP12 consNSU erro url={candidate} err={e}")
-                attempts_log.append(f"SOAP12 {candidate} -> EXC {e}")
-        return {"ok": False, "log": "; ".join(attempts_log)}
+                    logger.error(f"{tag} {op} erro url={candidate} err={e}")
+                attempts_log.append(f"{tag} {candidate} -> EXC {e}")
+        return {"ok": False, "log": "; ".join(attempts_log), "timing": _net_timing(timing, started, take_connect_time())}
 
-def _post_soap_conschave(session: requests.Session, cnpj: str, chNFe: str) -> Optional[dict]:
-        tpAmb = "1" if settings.NFE_AMBIENTE.upper().startswith("PROD") else "2"
-        envelope11 = f'''<?xml version="1.0" encoding="utf-8"?>
-<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ws="{NS_WS}" xmlns:nfe="{NS_NFE}">
-    <soap:Body>
-        <ws:nfeDistDFeInteresse>
-            <ws:nfeDadosMsg>
-                <distDFeInt xmlns="{NS_NFE}" versao="1.01">
-                    <tpAmb>{tpAmb}</tpAmb>
-                    <CNPJ>{_digits(cnpj)}</CNPJ>
-                    <consChNFe>
-                        <chNFe>{''.join(ch for ch in (chNFe or '') if ch.isdigit())[:44]}</chNFe>
-                    </consChNFe>
-                </distDFeInt>
-            </ws:nfeDadosMsg>
-        </ws:nfeDistDFeInteresse>
-    </soap:Body>
-</soap:Envelope>'''
-        envelope12 = f'''<?xml version="1.0" encoding="utf-8"?>
-<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope" xmlns:ws="{NS_WS}" xmlns:nfe="{NS_NFE}">
-    <soap12:Body>
-        <ws:nfeDistDFeInteresse>
-            <ws:nfeDadosMsg>
-                <distDFeInt xmlns="{NS_NFE}" versao="1.01">
-                    <tpAmb>{tpAmb}</tpAmb>
-                    <CNPJ>{_digits(cnpj)}</CNPJ>
-                    <consChNFe>
-                        <chNFe>{''.join(ch for ch in (chNFe or '') if ch.isdigit())[:44]}</chNFe>
-                    </consChNFe>
-                </distDFeInt>
-            </ws:nfeDadosMsg>
-        </ws:nfeDistDFeInteresse>
-    </soap12:Body>
-</soap12:Envelope>'''
-        headers11 = {'Content-Type':'text/xml; charset=utf-8','SOAPAction': ACTION}
-        headers12 = {'Content-Type':'application/soap+xml; charset=utf-8; action="'+ACTION+'"'}
+async def _post_soap_async(client: httpx.AsyncClient, op: str, cnpj: str, value: str) -> dict:
+        """``_post_soap`` sobre o transporte assíncrono (mesma ordem de candidatos e registro de saúde)."""
+        envelopes: dict[str, bytes] = {}
         attempts_log = []
-        for candidate in _dist_url_candidates():
-            try:
-                r = session.post(candidate, data=envelope11.encode('utf-8'), headers=headers11, timeout=45)
-                if r.status_code == 200:
-                    return {"ok": True, "raw": r.content, "url": candidate, "ver": "1.1"}
-                if settings.DFE_DEBUG:
-                    logger.error(f"SOAP11 consChave HTTP=={r.status_code} url={candidate} body={r.text[:300]}")
-                attempts_log.append(f"SOAP11 {candidate} -> HTTP {r.status_code}")
-            except Exception as e:
-                if settings.DFE_DEBUG:
-                    logger.error(f"SOAP11 consChave erro url={candidate} err={e}")
-                attempts_log.append(f"SOAP11 {candidate} -> EXC {e}")
+        started = time.monotonic(); timing = {"rate_wait": 0.0}
+        conn = async_transport.ConnectTimer()
+        for candidate, ver in endpoint_health.ordered("dist", _dist_url_candidates(), SOAP_VERSIONS):
+            tag = "SOAP11" if ver == "1.1" else "SOAP12"
+            data = envelopes.get(ver)
+            if data is None:
+                data = envelopes[ver] = soap_builder.envelope(op, ver, cnpj, value)
             try:
-                r = session.post(candidate, data=envelope12.encode('utf-8'), headers=headers12, timeout=45)
+                w0 = time.monotonic()
+                await limiter.acquire_async(candidate)
+                t0 = time.monotonic()
+                timing["rate_wait"] += t0 - w0
+                r = await client.post(candidate, content=data, headers=HEADERS[ver], extensions={"trace": conn})
+                dt = time.monotonic() - t0
+                limiter.observe(candidate, dt, r.status_code == 200)
+                metrics.ws_request("dist", candidate, ver, dt, r.status_code)
                 if r.status_code == 200:
-                    return {"ok": True, "raw": r.content, "url": candidate, "ver": "1.2"}
+                    endpoint_health.health.success("dist", candidate, ver)
+                    return {"ok": True, "raw": r.content, "url": candidate, "ver": ver,
+                            "timing": _net_timing(timing, started, conn.sec)}
+                endpoint_health.health.failure("dist", candidate, ver)
                 if settings.DFE_DEBUG:
-                    logger.error(f"SOAP12 consChave HTTP=={r.status_code} url={candidate} body={r.text[:300]}")
-                attempts_log.append(f"SOAP12 {candidate} -> HTTP {r.status_code}")
+                    logger.error(f"{tag} {op} HTTP={r.status_code} url={candidate} body={r.text[:300]}")
+                attempts_log.append(f"{tag} {candidate} -> HTTP {r.status_code}")
             except Exception as e:
+                endpoint_health.health.failure("dist", candidate, ver)
+                metrics.ws_request("dist", candidate, ver, None, None)
+                if isinstance(e, httpx.TransportError):
+                    limiter.observe(candidate, None, False)
                 if settings.DFE_DEBUG:
-                    logger.error(f"SOAP12 consChave erro url={candidate} err={e}")
-                attempts_log.append(f"SOAP12 {candidate} -> EXC {e}")
-        return {"ok": False, "log": "; ".join(attempts_log)}
-
-def _sleep_between():
-    time.sleep(settings.DFE_SLEEP_BETWEEN_CALLS_MS / 1000.0)
+                    logger.error(f"{tag} {op} erro url={candidate} err={e}")
+                attempts_log.append(f"{tag} {candidate} -> EXC {e}")
+        return {"ok": False, "log": "; ".join(attempts_log), "timing": _net_timing(timing, started, conn.sec)}
 
-def _backoff(attempt:int):
+def _backoff_wait(attempt:int, deadline:Optional[float]=None) -> float:
     base = settings.DFE_BACKOFF_BASE_SEC
     cap  = settings.DFE_BACKOFF_CAP_SEC
     wait = min(base * (2 ** (attempt-1)), cap) * random.uniform(0.5, 1.5)
-    time.sleep(wait)
-
-def _inflate_doczip(b64: str) -> bytes:
-    raw = base64.b64decode(b64)
-    # NT indica GZip; alguns ambientes enviam DEFLATE/zlib. Tentar nessa ordem.
-    try:
-        # gzip header 0x1f 0x8b
-        if len(raw) >= 2 and raw[0] == 0x1F and raw[1] == 0x8B:
-            return gzip.decompress(raw)
-    except Exception:
-        pass
-    # tentar zlib com auto header (gzip/zlib) wbits=15+32
-    try:
-        return zlib.decompress(raw, 15 | 32)
-    except zlib.error:
-        # fallback: DEFLATE raw (-15)
-        return zlib.decompress(raw, -15)
+    if deadline is not None:
+        # não dormir além do prazo da execução; o laço encerra no topo com reason=deadline
+        wait = max(0.0, min(wait, deadline - time.time()))
+    return wait
 
 def _ensure_nsu15(nsu: str) -> str:
     digits = ''.join(ch for ch in (nsu or '') if ch.isdigit())
@@ -311,209 +178,188 @@ if settings.DFE_DEBUG and not logger.handlers:
     logger.addHandler(h)
     logger.setLevel(logging.DEBUG)
 
-def nfe_distribuicao_dfe(cnpj:str, ult_nsu:str, cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> Dict:
-    started = time.time()
-    session = requests.Session()
-    session.cert = cert_tuple
-    session.verify = _resolve_verify(verify_ca)
-    client = _create_client_with_fallback(session)
+# operação -> rótulo nos logs
+_OP_LABEL = {"distNSU": "distDFe", "consNSU": "consNSU", "consChNFe": "consChave"}
+
+def _dist_result(op:str, ret:Optional[dict], url:Optional[str], started:float, net:Optional[dict]=None) -> Dict:
+    """Retorno comum das consultas a partir do retDistDFeInt decodificado. ``timing``: tempo
+    por etapa (rede de ``_post_soap``, quando houver, + inflate/parse da decodificação)."""
+    if ret is None:
+        return {"error":"parse","detail":"retDistDFeInt não encontrado"}
+    cStat, xMotivo, maxNSU, ultNSU = ret["cStat"], ret["xMotivo"], ret["maxNSU"], ret["ultNSU"]
+    metrics.cstat(op, cStat)
+    if cStat == "656":
+        # consumo indevido: reduz o ritmo de todas as empresas no host que respondeu (ou em todos, via WSDL)
+        limiter.penalize(url)
+    docs = ret["docs"]
+    elapsed = time.time() - started
+    if settings.DFE_DEBUG:
+        logger.debug(f"WS {_OP_LABEL[op]} cStat={cStat} xMotivo={xMotivo} ultNSU={ultNSU} maxNSU={maxNSU} docs={len(docs)} t={elapsed:.2f}s")
+    return {"cStat":cStat,"xMotivo":xMotivo,"maxNSU":maxNSU,"ultNSU":ultNSU,"docs":docs,"elapsed":elapsed,
+            "timing":{**(net or {}), **ret["timing"]}}
 
-    # Monta distDFeInt (por NSU) usando namespace padrão (sem prefixo) para evitar erro 404 (prefixo de namespace)
-    root = etree.Element("distDFeInt", nsmap={None: NS_NFE}, versao="1.01")
-    etree.SubElement(root, "tpAmb").text = "1" if settings.NFE_AMBIENTE.upper().startswith("PROD") else "2"
-    etree.SubElement(root, "CNPJ").text = cnpj
-    cons = etree.SubElement(root, "distNSU")
-    etree.SubElement(cons, "ultNSU").text = _ensure_nsu15(ult_nsu)
+def _soap_failure(raw) -> Dict:
+    det = raw.get("log") if isinstance(raw, dict) else None
+    return {"error":"wsdl_404","detail":"Falha WSDL e SOAP direto sem sucesso" + (f" | tentativas: {det}" if det else "")}
 
-    # Chama serviço
+def _consult(op:str, cnpj:str, value:str, cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> Dict:
+    started = time.time()
+    session = get_session(_digits(cnpj), cert_tuple, _resolve_verify(verify_ca))
+    client = _create_client_with_fallback(session)
     if client is not None:
+        # distDFeInt com namespace padrão (sem prefixo) para evitar erro 404 (prefixo de namespace)
+        root = soap_builder.dist_element(op, cnpj, value)
         try:
+            t0 = time.monotonic()
             resp = client.service.nfeDistDFeInteresse(nfeDistDFeInteresse=root)
         except Exception as e:
-            logger.error(f"Falha chamada WS: {e}") if settings.DFE_DEBUG else None
+            logger.error(f"Falha chamada WS {_OP_LABEL[op]}: {e}") if settings.DFE_DEBUG else None
             return {"error":"ws_call","detail":str(e)}
-        xml = etree.tostring(resp, encoding="utf-8")
-    else:
-        raw = _post_soap_dist(session, cnpj, ult_nsu)
-        if not raw or not raw.get("ok"):
-            det = raw.get("log") if isinstance(raw, dict) else None
-            return {"error":"wsdl_404","detail":"Falha WSDL e SOAP direto sem sucesso" + (f" | tentativas: {det}" if det else "")}
-        # extrair o retDistDFeInt do envelope SOAP
-        env = etree.fromstring(raw["raw"] if isinstance(raw, dict) else raw)
-        ret = env.find('.//{http://www.portalfiscal.inf.br/nfe}retDistDFeInt')
-        if ret is None:
-            # tentar buscar por namespace default
-            ret = env.find('.//retDistDFeInt')
-        if ret is None:
-            return {"error":"parse","detail":"retDistDFeInt não encontrado"}
-        xml = etree.tostring(ret, encoding='utf-8')
-    doc = etree.fromstring(xml)
-
-    def gx(p): 
-        el = doc.find(p, namespaces={"nfe":NS_NFE})
-        return el.text if el is not None else None
-
-    cStat  = gx(".//nfe:cStat")
-    xMotivo= gx(".//nfe:xMotivo")
-    maxNSU = gx(".//nfe:maxNSU")
-    ultNSU = gx(".//nfe:ultNSU")
-
-    docs = []
-    for el in doc.findall(".//nfe:docZip", namespaces={"nfe":NS_NFE}):
-        nsu   = el.get("NSU")
-        schema= el.get("schema")
-        conteudo = _inflate_doczip(el.text)
-        docs.append({"nsu":nsu, "schema":schema, "xml":conteudo})
+        # zeep não separa conexão e resposta
+        return _dist_result(op, decode_ret_dist(resp), None, started, {"server": time.monotonic() - t0})
+    raw = _post_soap(session, op, cnpj, value)
+    if not raw or not raw.get("ok"):
+        return _soap_failure(raw)
+    # envelope SOAP lido uma única vez: cabeçalho e docZip (inflados, com metadados) em uma passada
+    return _dist_result(op, decode_ret_dist(raw["raw"]), raw.get("url"), started, raw.get("timing"))
+
+async def _consult_async(op:str, cnpj:str, value:str, cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> Dict:
+    if settings.DFE_USE_WSDL:
+        # zeep é síncrono: o caminho via WSDL roda em thread
+        return await asyncio.to_thread(_consult, op, cnpj, value, cert_tuple, verify_ca)
+    started = time.time()
+    client = async_transport.get_client(_digits(cnpj), cert_tuple, _resolve_verify(verify_ca))
+    raw = await _post_soap_async(client, op, cnpj, value)
+    if not raw.get("ok"):
+        return _soap_failure(raw)
+    # inflar/parsear os docZip é CPU: fora do event loop
+    ret = await asyncio.to_thread(decode_ret_dist, raw["raw"])
+    return _dist_result(op, ret, raw.get("url"), started, raw.get("timing"))
 
-    elapsed = time.time() - started
-    if settings.DFE_DEBUG:
-        logger.debug(f"WS distDFe cStat={cStat} xMotivo={xMotivo} ultNSU={ultNSU} maxNSU={maxNSU} docs={len(docs)} t={elapsed:.2f}s")
-    return {"cStat":cStat,"xMotivo":xMotivo,"maxNSU":maxNSU,"ultNSU":ultNSU,"docs":docs,"elapsed":elapsed}
+def nfe_distribuicao_dfe(cnpj:str, ult_nsu:str, cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> Dict:
+    return _consult("distNSU", cnpj, ult_nsu, cert_tuple, verify_ca)
 
 def nfe_consultar_nsu(cnpj:str, nsu:str, cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> Dict:
     """
     Consulta pontual por NSU faltante (consNSU), conforme NT 2014/002.
     """
-    started = time.time()
-    session = requests.Session()
-    session.cert = cert_tuple
-    session.verify = _resolve_verify(verify_ca)
-    client = _create_client_with_fallback(session)
-
-    root = etree.Element("distDFeInt", nsmap={None: NS_NFE}, versao="1.01")
-    etree.SubElement(root, "tpAmb").text = "1" if settings.NFE_AMBIENTE.upper().startswith("PROD") else "2"
-    etree.SubElement(root, "CNPJ").text = cnpj
-    c = etree.SubElement(root, "consNSU")
-    etree.SubElement(c, "NSU").text = _ensure_nsu15(nsu)
-
-    if client is not None:
-        try:
-            resp = client.service.nfeDistDFeInteresse(nfeDistDFeInteresse=root)
-        except Exception as e:
-            logger.error(f"Falha chamada WS consNSU: {e}") if settings.DFE_DEBUG else None
-            return {"error":"ws_call","detail":str(e)}
-        xml = etree.tostring(resp, encoding="utf-8")
-    else:
-        raw = _post_soap_consnsu(session, cnpj, nsu)
-        if not raw or not raw.get("ok"):
-            det = raw.get("log") if isinstance(raw, dict) else None
-            return {"error":"wsdl_404","detail":"Falha WSDL e SOAP direto sem sucesso" + (f" | tentativas: {det}" if det else "")}
-        env = etree.fromstring(raw["raw"] if isinstance(raw, dict) else raw)
-        ret = env.find('.//{http://www.portalfiscal.inf.br/nfe}retDistDFeInt')
-        if ret is None:
-            ret = env.find('.//retDistDFeInt')
-        if ret is None:
-            return {"error":"parse","detail":"retDistDFeInt não encontrado"}
-        xml = etree.tostring(ret, encoding='utf-8')
-    doc = etree.fromstring(xml)
-    def gx(p): 
-        el = doc.find(p, namespaces={"nfe":NS_NFE})
-        return el.text if el is not None else None
-    cStat  = gx(".//nfe:cStat"); xMotivo= gx(".//nfe:xMotivo"); maxNSU = gx(".//nfe:maxNSU"); ultNSU = gx(".//nfe:ultNSU")
-    docs = []
-    for el in doc.findall(".//nfe:docZip", namespaces={"nfe":NS_NFE}):
-        docs.append({"nsu": el.get("NSU"), "schema": el.get("schema"), "xml": _inflate_doczip(el.text)})
-    elapsed = time.time() - started
-    if settings.DFE_DEBUG:
-        logger.debug(f"WS consNSU cStat={cStat} xMotivo={xMotivo} ultNSU={ultNSU} maxNSU={maxNSU} docs={len(docs)} t={elapsed:.2f}s")
-    return {"cStat":cStat,"xMotivo":xMotivo,"maxNSU":maxNSU,"ultNSU":ultNSU,"docs":docs,"elapsed":elapsed}
+    return _consult("consNSU", cnpj, nsu, cert_tuple, verify_ca)
 
 def nfe_consultar_chave(cnpj:str, chNFe:str, cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> Dict:
     """
     Consulta por chave específica (consChNFe) via Distribuição DF-e.
     Retorna metadados e, se autorizado/pertinente, o(s) docZip (procNFe/resNFe/eventos).
     """
-    started = time.time()
-    session = requests.Session()
-    session.cert = cert_tuple
-    session.verify = _resolve_verify(verify_ca)
-    client = _create_client_with_fallback(session)
-
-    # Payload raiz (para caminho WSDL, se usado)
-    root = etree.Element("distDFeInt", nsmap={None: NS_NFE}, versao="1.01")
-    etree.SubElement(root, "tpAmb").text = "1" if settings.NFE_AMBIENTE.upper().startswith("PROD") else "2"
-    etree.SubElement(root, "CNPJ").text = _digits(cnpj)
-    cg = etree.SubElement(root, "consChNFe")
-    etree.SubElement(cg, "chNFe").text = ''.join(ch for ch in (chNFe or '') if ch.isdigit())[:44]
-
-    if client is not None:
-        try:
-            resp = client.service.nfeDistDFeInteresse(nfeDistDFeInteresse=root)
-        except Exception as e:
-            logger.error(f"Falha chamada WS consChave: {e}") if settings.DFE_DEBUG else None
-            return {"error":"ws_call","detail":str(e)}
-        xml = etree.tostring(resp, encoding="utf-8")
-    else:
-        raw = _post_soap_conschave(session, cnpj, chNFe)
-        if not raw or not raw.get("ok"):
-            det = raw.get("log") if isinstance(raw, dict) else None
-            return {"error":"wsdl_404","detail":"Falha WSDL e SOAP direto sem sucesso" + (f" | tentativas: {det}" if det else "")}
-        env = etree.fromstring(raw["raw"] if isinstance(raw, dict) else raw)
-        ret = env.find('.//{http://www.portalfiscal.inf.br/nfe}retDistDFeInt')
-        if ret is None:
-            ret = env.find('.//retDistDFeInt')
-        if ret is None:
-            return {"error":"parse","detail":"retDistDFeInt não encontrado"}
-        xml = etree.tostring(ret, encoding='utf-8')
-
-    doc = etree.fromstring(xml)
-    def gx(p):
-        el = doc.find(p, namespaces={"nfe":NS_NFE})
-        return el.text if el is not None else None
-    cStat  = gx(".//nfe:cStat"); xMotivo= gx(".//nfe:xMotivo"); maxNSU = gx(".//nfe:maxNSU"); ultNSU = gx(".//nfe:ultNSU")
-    docs = []
-    for el in doc.findall(".//nfe:docZip", namespaces={"nfe":NS_NFE}):
-        docs.append({"nsu": el.get("NSU"), "schema": el.get("schema"), "xml": _inflate_doczip(el.text)})
-    elapsed = time.time() - started
-    if settings.DFE_DEBUG:
-        logger.debug(f"WS consChave cStat={cStat} xMotivo={xMotivo} ultNSU={ultNSU} maxNSU={maxNSU} docs={len(docs)} t={elapsed:.2f}s")
-    return {"cStat":cStat,"xMotivo":xMotivo,"maxNSU":maxNSU,"ultNSU":ultNSU,"docs":docs,"elapsed":elapsed}
-
-def pull_until_idle(cnpj:str, start_nsu:str, cert_tuple:Tuple[str,str], verify_ca:str|bool=None) -> Generator[Dict, None, None]:
+    return _consult("consChNFe", cnpj, chNFe, cert_tuple, verify_ca)
+
+async def nfe_distribuicao_dfe_async(cnpj:str, ult_nsu:str, cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> Dict:
+    return await _consult_async("distNSU", cnpj, ult_nsu, cert_tuple, verify_ca)
+
+async def nfe_consultar_nsu_async(cnpj:str, nsu:str, cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> Dict:
+    return await _consult_async("consNSU", cnpj, nsu, cert_tuple, verify_ca)
+
+async def nfe_consultar_chave_async(cnpj:str, chNFe:str, cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> Dict:
+    return await _consult_async("consChNFe", cnpj, chNFe, cert_tuple, verify_ca)
+
+def _limit_stop(deadline, max_pages, pages, cursor_ult, last_max, total_docs) -> Optional[Dict]:
+    if deadline is not None and time.time() >= deadline:
+        return {"stopped": True, "reason": "deadline", "ultNSU": cursor_ult, "maxNSU": last_max, "total_docs": total_docs}
+    if max_pages and pages >= max_pages:
+        return {"stopped": True, "reason": "page_quota", "ultNSU": cursor_ult, "maxNSU": last_max, "total_docs": total_docs}
+    return None
+
+def _page_pack(res:Dict, cursor_ult:str, last_max:str, total_docs:int) -> Dict:
+    """Pacote do pull para a resposta de uma página: erro, parada (108/109, 656) ou lote (``batch``)."""
+    if 'error' in res:
+        return {"error":res.get("error"),"detail":res.get("detail"),"ultNSU":cursor_ult,"maxNSU":last_max}
+    cStat = res["cStat"]; ultNSU=res["ultNSU"] or cursor_ult; maxNSU=res["maxNSU"] or last_max
+    if cStat in ("108","109"):
+        # Serviço paralisado: interrompe ciclo e deixe orquestração agendar nova tentativa.
+        return {"stopped": True, "reason": "service_down", "cStat": cStat, "xMotivo": res.get("xMotivo"), "ultNSU": cursor_ult, "maxNSU": maxNSU, "total_docs": total_docs,
+                "timing": res.get("timing")}
+    if cStat == "656":
+        # Consumo Indevido: o AN orienta aguardar ~1h e usar sempre o ultNSU da última resposta.
+        # Em vez de retentar agressivamente, pausamos o ciclo e deixamos o agendador reagendar.
+        return {"stopped": True, "reason": "consumo_indevido", "wait_sec": 3600,
+                "cStat": cStat, "xMotivo": res.get("xMotivo"),
+                "ultNSU": ultNSU, "maxNSU": maxNSU, "total_docs": total_docs, "timing": res.get("timing")}
+    return {"batch":res["docs"] or [], "ultNSU":ultNSU, "maxNSU":maxNSU, "cStat":cStat, "xMotivo":res["xMotivo"],
+            "timing":res.get("timing")}
+
+def pull_until_idle(cnpj:str, start_nsu:str, cert_tuple:Tuple[str,str], verify_ca:str|bool=None,
+                    deadline:Optional[float]=None, max_pages:Optional[int]=None) -> Generator[Dict, None, None]:
     """
     Faz pulls em loop atÃ© ultNSU == maxNSU (sem pendÃªncias) ou atÃ© atingir limites de retentativa.
     Trate cStat: 138=Documentos localizados; 137=Nenhum doc; 656=Consumo indevido (aplicar backoff).
+    deadline (time.time()) e max_pages interrompem o ciclo com stopped/reason=deadline|page_quota,
+    devolvendo a vez para as demais empresas; a próxima execução continua do ultNSU salvo.
     """
     attempts = 0
     cursor_ult = _ensure_nsu15(start_nsu)
     total_docs = 0
     last_max = start_nsu
+    pages = 0
     while True:
+        stop = _limit_stop(deadline, max_pages, pages, cursor_ult, last_max, total_docs)
+        if stop:
+            yield stop
+            break
         try:
             res = nfe_distribuicao_dfe(cnpj, cursor_ult, cert_tuple, verify_ca)
-            if 'error' in res:
-                yield {"error":res.get("error"),"detail":res.get("detail"),"ultNSU":cursor_ult,"maxNSU":last_max}
-                break
-            cStat = res["cStat"]; ultNSU=res["ultNSU"] or cursor_ult; maxNSU=res["maxNSU"] or last_max
-            if cStat in ("108","109"):
-                # Serviço paralisado: interrompe ciclo e deixe orquestração agendar nova tentativa.
-                yield {"stopped": True, "reason": "service_down", "cStat": cStat, "xMotivo": res.get("xMotivo"), "ultNSU": cursor_ult, "maxNSU": maxNSU, "total_docs": total_docs}
-                break
-
-            if cStat == "656":
-                # Consumo Indevido: o AN orienta aguardar ~1h e usar sempre o ultNSU da última resposta.
-                # Em vez de retentar agressivamente, pausamos o ciclo e deixamos o agendador reagendar.
-                yield {"stopped": True, "reason": "consumo_indevido", "wait_sec": 3600,
-                       "cStat": cStat, "xMotivo": res.get("xMotivo"),
-                       "ultNSU": ultNSU, "maxNSU": maxNSU, "total_docs": total_docs}
-                break
-            attempts = 0  # reset se sucesso
-
-            docs = res["docs"] or []
-            total_docs += len(docs)
-
-            yield {"batch":docs, "ultNSU":ultNSU, "maxNSU":maxNSU, "cStat":cStat, "xMotivo":res["xMotivo"]}
-
-            cursor_ult = ultNSU; last_max = maxNSU
-            _sleep_between()
-
-            if ultNSU == maxNSU:
-                break
-
         except requests.RequestException as e:
             attempts += 1
             if attempts > settings.DFE_MAX_ATTEMPTS:
                 yield {"error":"http","attempts":attempts,"detail":str(e),"ultNSU":cursor_ult,"maxNSU":last_max}
                 break
-            _backoff(attempts)
-            continue
\ No newline at end of file
+            wait = _backoff_wait(attempts, deadline)
+            metrics.retry("dist", wait)
+            time.sleep(wait)
+            continue
+        attempts = 0  # reset se sucesso
+        pack = _page_pack(res, cursor_ult, last_max, total_docs)
+        if "batch" in pack:
+            total_docs += len(pack["batch"])
+        yield pack
+        if "batch" not in pack:
+            break
+        cursor_ult = pack["ultNSU"]; last_max = pack["maxNSU"]
+        pages += 1
+        # ritmo entre páginas: governado por src.ws.rate_limit no próximo POST
+        if cursor_ult == last_max:
+            break
+
+async def pull_until_idle_async(cnpj:str, start_nsu:str, cert_tuple:Tuple[str,str], verify_ca:str|bool=None,
+                                deadline:Optional[float]=None, max_pages:Optional[int]=None) -> AsyncGenerator[Dict, None]:
+    """``pull_until_idle`` sobre o transporte assíncrono (mesmos pacotes e critérios de parada)."""
+    attempts = 0
+    cursor_ult = _ensure_nsu15(start_nsu)
+    total_docs = 0
+    last_max = start_nsu
+    pages = 0
+    while True:
+        stop = _limit_stop(deadline, max_pages, pages, cursor_ult, last_max, total_docs)
+        if stop:
+            yield stop
+            break
+        try:
+            res = await nfe_distribuicao_dfe_async(cnpj, cursor_ult, cert_tuple, verify_ca)
+        except httpx.HTTPError as e:
+            attempts += 1
+            if attempts > settings.DFE_MAX_ATTEMPTS:
+                yield {"error":"http","attempts":attempts,"detail":str(e),"ultNSU":cursor_ult,"maxNSU":last_max}
+                break
+            wait = _backoff_wait(attempts, deadline)
+            metrics.retry("dist", wait)
+            await asyncio.sleep(wait)
+            continue
+        attempts = 0
+        pack = _page_pack(res, cursor_ult, last_max, total_docs)
+        if "batch" in pack:
+            total_docs += len(pack["batch"])
+        yield pack
+        if "batch" not in pack:
+            break
+        cursor_ult = pack["ultNSU"]; last_max = pack["maxNSU"]
+        pages += 1
+        if cursor_ult == last_max:
+            break
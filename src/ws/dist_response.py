@@ -0,0 +1,101 @@
+"""Decodificação do retorno ``retDistDFeInt`` (distNSU, consNSU e consChNFe) em uma passada.
+
+O envelope SOAP é lido uma única vez com ``iterparse``: cStat/xMotivo/ultNSU/maxNSU
+são capturados ao passar e cada ``docZip`` é decodificado assim que termina —
+inflado, parseado uma vez para os metadados (``fields``, colunas de
+``dfe_documentos``) e descartado da árvore. Antes o envelope era parseado,
+reserializado e parseado de novo, e cada documento era parseado outra vez na
+persistência.
+"""
+import base64, gzip, io, time, zlib
+from lxml import etree
+from src.settings import settings
+from src.core.doc_fields import FIELD_COLUMNS, fields_from_tree, scan_gzip_fields
+
+_HEADER = ("cStat", "xMotivo", "ultNSU", "maxNSU")
+
+def inflate_raw(raw: bytes) -> bytes:
+    # NT indica GZip; alguns ambientes enviam DEFLATE/zlib. Tentar nessa ordem.
+    try:
+        # gzip header 0x1f 0x8b
+        if len(raw) >= 2 and raw[0] == 0x1F and raw[1] == 0x8B:
+            return gzip.decompress(raw)
+    except Exception:
+        pass
+    # tentar zlib com auto header (gzip/zlib) wbits=15+32
+    try:
+        return zlib.decompress(raw, 15 | 32)
+    except zlib.error:
+        # fallback: DEFLATE raw (-15)
+        return zlib.decompress(raw, -15)
+
+def doczip_entry(el, timing: dict | None = None) -> dict:
+    """Documento de um docZip, com ``fields`` já extraídos. Com DFE_STORE_DOCZIP_RAW, payloads
+    GZip seguem comprimidos em "zip" (bytes exatamente como vieram do AN); os demais são
+    inflados em "xml". ``timing["inflate"]``, se dado, acumula base64 + descompressão."""
+    d = {"nsu": el.get("NSU"), "schema": el.get("schema")}
+    t0 = time.perf_counter()
+    raw = base64.b64decode(el.text or "")
+    if settings.DFE_STORE_DOCZIP_RAW and raw[:2] == b"\x1f\x8b":
+        d["zip"] = raw
+        d["fields"] = scan_gzip_fields(raw)  # infla só o início do documento
+        if timing is not None:
+            timing["inflate"] += time.perf_counter() - t0
+    else:
+        d["xml"] = inflate_raw(raw)
+        if timing is not None:
+            timing["inflate"] += time.perf_counter() - t0
+        try:
+            d["fields"] = fields_from_tree(etree.fromstring(d["xml"]))
+        except etree.XMLSyntaxError:
+            d["fields"] = {k: None for k in FIELD_COLUMNS}
+    d["chave"] = d["fields"]["chave"]
+    return d
+
+def doc_xml(d: dict) -> bytes:
+    """XML inflado de um documento devolvido pelas consultas (com "xml" ou "zip")."""
+    if d.get("xml") is not None:
+        return d["xml"]
+    return gzip.decompress(d["zip"]) if d.get("zip") else b""
+
+def _local(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+def decode_ret_dist(source) -> dict | None:
+    """cStat, xMotivo, ultNSU, maxNSU e docs de um retDistDFeInt.
+
+    ``source``: bytes do envelope SOAP (caminho direto) ou elemento lxml já parseado
+    (retorno do zeep). None se não houver retDistDFeInt na resposta. Em ``timing``, o tempo
+    de descompressão dos docZip (``inflate``) e o restante da decodificação (``parse``).
+    """
+    started = time.perf_counter()
+    timing = {"inflate": 0.0}
+    out: dict = {k: None for k in _HEADER}
+    docs: list[dict] = []
+    found = False
+    if isinstance(source, (bytes, bytearray)):
+        events = etree.iterparse(io.BytesIO(source), events=("end",), huge_tree=True)
+        owned = True
+    else:
+        events = etree.iterwalk(source, events=("end",))
+        owned = False  # árvore de terceiros (zeep): não podar
+    for _, el in events:
+        name = _local(el.tag)
+        if name == "docZip":
+            docs.append(doczip_entry(el, timing))
+            if owned:
+                # libera o base64 já decodificado e os irmãos anteriores
+                el.clear()
+                parent = el.getparent()
+                while el.getprevious() is not None:
+                    del parent[0]
+        elif name in _HEADER and out[name] is None:
+            out[name] = el.text
+        elif name == "retDistDFeInt":
+            found = True
+    if not found and out["cStat"] is None:
+        return None
+    out["docs"] = docs
+    timing["parse"] = time.perf_counter() - started - timing["inflate"]
+    out["timing"] = timing
+    return out
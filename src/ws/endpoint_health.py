@@ -0,0 +1,166 @@
+"""Saúde dos endpoints SOAP (URL × variante) com afinidade e circuit breaker.
+
+Os clientes de distribuição e de eventos percorrem listas de URLs candidatas
+tentando SOAP 1.1/1.2 (e, nos eventos, variações de operação). Cada candidato
+morto pode custar um timeout de 45 s antes de chegar ao que funciona. Este
+módulo lembra, por ambiente e serviço, qual par (URL, variante) respondeu por
+último, ordena as tentativas colocando-o primeiro e rebaixa os que falham:
+
+- ``DFE_CB_FAIL_THRESHOLD`` falhas seguidas abrem o circuito por ``DFE_CB_OPEN_SEC``;
+- vencido esse prazo o candidato volta em meia-abertura: o primeiro ``order`` que o entrega
+  reserva a sonda por ``DFE_CB_PROBE_SEC`` (para os demais ele segue aberto); sucesso fecha
+  o circuito, nova falha reabre;
+- candidatos com circuito aberto ainda são tentados por último, para nunca
+  ficarmos sem rota quando todos estiverem marcados como ruins.
+
+O ranking aprendido é persistido em JSON (``DFE_ENDPOINT_CACHE_PATH``), compartilhado
+pelos processos (agendador, API, ``sync_worker``): cada entrada leva o instante da última
+mudança, a gravação mescla com o arquivo (a entrada mais recente vence, sob ``flock``) e o
+arquivo é relido quando outro processo o altera.
+"""
+import json, os, threading, time
+from pathlib import Path
+from typing import Iterable, Optional, Sequence, Tuple
+from src.settings import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+def ambiente() -> str:
+    return "PROD" if settings.NFE_AMBIENTE.upper().startswith("PROD") else "HOMOLOG"
+
+class EndpointHealth:
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state: dict[str, dict] = {}
+        self._mtime = None  # mtime do arquivo na última leitura/gravação
+
+    @staticmethod
+    def _key(service: str, url: str, variant: str) -> str:
+        return f"{ambiente()}|{service}|{url}|{variant}"
+
+    def _read(self) -> dict[str, dict]:
+        try:
+            data = json.loads(Path(self.path).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return {k: v for k, v in data.items() if isinstance(v, dict)} if isinstance(data, dict) else {}
+
+    def _merge_locked(self, disk: dict[str, dict]):
+        # por entrada, vale a mudança mais recente (deste ou de outro processo)
+        for k, v in disk.items():
+            mine = self._state.get(k)
+            if mine is None or (v.get("ts") or 0) > (mine.get("ts") or 0):
+                self._state[k] = v
+
+    def _mtime_now(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load_locked(self):
+        """Mescla o arquivo no estado em memória quando ele mudou desde a última leitura."""
+        if not self.path:
+            return
+        mtime = self._mtime_now()
+        if mtime is None or mtime == self._mtime:
+            return
+        self._mtime = mtime
+        self._merge_locked(self._read())
+
+    def _save_locked(self, merge: bool = True):
+        if not self.path:
+            return
+        try:
+            p = Path(self.path)
+            p.parent.mkdir(parents=True, exist_ok=True)
+            with open(p.with_suffix(p.suffix + ".lock"), "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)  # ler-mesclar-gravar sem perder a gravação de outro processo
+                if merge:
+                    self._merge_locked(self._read())
+                tmp = p.with_suffix(p.suffix + f".{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(self._state, indent=1, sort_keys=True), encoding="utf-8")
+                os.replace(tmp, p)
+                self._mtime = self._mtime_now()
+        except OSError:
+            # cache é otimização: falha de escrita não deve derrubar a chamada
+            pass
+
+    def order(self, service: str, attempts: Iterable[Tuple[str, str]]) -> list[Tuple[str, str]]:
+        """Reordena tentativas (url, variante): última bem-sucedida primeiro, depois
+        saudáveis, sondas meia-abertas e, por fim, circuitos abertos. Uma sonda entregue fica
+        reservada a esta chamada por ``DFE_CB_PROBE_SEC``."""
+        now = time.time()
+        ranked = []
+        claimed = False
+        with self._lock:
+            self._load_locked()
+            for idx, (url, variant) in enumerate(attempts):
+                st = self._state.get(self._key(service, url, variant)) or {}
+                open_until = st.get("open_until") or 0
+                if open_until > now:
+                    group = 3
+                elif open_until:
+                    group = 2  # meia-abertura: prazo vencido; esta chamada faz a sonda
+                    st.update({"open_until": now + settings.DFE_CB_PROBE_SEC, "ts": now})
+                    claimed = True
+                elif st.get("last_ok"):
+                    group = 0
+                else:
+                    group = 1
+                ranked.append((group, -(st.get("last_ok") or 0), idx, (url, variant)))
+            if claimed:
+                self._save_locked()
+        ranked.sort()
+        return [a for (_, _, _, a) in ranked]
+
+    def success(self, service: str, url: str, variant: str):
+        key = self._key(service, url, variant)
+        with self._lock:
+            self._load_locked()
+            st = self._state.setdefault(key, {})
+            # Persistir apenas quando o ranking muda (novo preferido ou circuito fechado)
+            changed = bool(st.get("open_until") or st.get("fails")) or not self._is_preferred_locked(service, key)
+            now = time.time()
+            st.update({"last_ok": now, "fails": 0, "open_until": 0, "ts": now})
+            if changed:
+                self._save_locked()
+
+    def failure(self, service: str, url: str, variant: str):
+        key = self._key(service, url, variant)
+        now = time.time()
+        with self._lock:
+            self._load_locked()
+            st = self._state.setdefault(key, {})
+            st["fails"] = int(st.get("fails") or 0) + 1
+            st["ts"] = now
+            # sonda em meia-abertura (circuito já aberto antes) falhou, ou limite atingido: (re)abre
+            if st.get("open_until") or st["fails"] >= settings.DFE_CB_FAIL_THRESHOLD:
+                st["open_until"] = now + settings.DFE_CB_OPEN_SEC
+                self._save_locked()
+
+    def _is_preferred_locked(self, service: str, key: str) -> bool:
+        prefix = f"{ambiente()}|{service}|"
+        best = max(((v.get("last_ok") or 0, k) for k, v in self._state.items() if k.startswith(prefix)), default=(0, None))
+        return best[0] > 0 and best[1] == key
+
+    def snapshot(self, service: Optional[str] = None) -> dict:
+        with self._lock:
+            self._load_locked()
+            return {k: dict(v) for k, v in self._state.items() if service is None or k.split("|")[1] == service}
+
+    def reset(self):
+        with self._lock:
+            self._state = {}
+            self._save_locked(merge=False)
+
+health = EndpointHealth(settings.DFE_ENDPOINT_CACHE_PATH)
+
+def ordered(service: str, urls: Sequence[str], variants: Sequence[str]) -> list[Tuple[str, str]]:
+    """Produto URL × variante na ordem original, reordenado pela saúde aprendida."""
+    return health.order(service, [(u, v) for u in urls for v in variants])
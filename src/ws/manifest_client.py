@@ -1,9 +1,16 @@
-import time
+import asyncio, time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Optional, Dict
 from lxml import etree
+import httpx
 import requests
 import base64
 from src.settings import settings
+from src.ws.session_pool import get_session
+from src.ws import async_transport, endpoint_health
+from src.ws.signer import get_signer
+from src.ws.rate_limit import limiter
+from src.core import metrics
 import certifi
 
 NS_NFE = "http://www.portalfiscal.inf.br/nfe"
@@ -66,140 +73,225 @@ def _resolve_verify(override: Optional[str|bool]):
         return override
     return settings.DFE_CA_BUNDLE or certifi.where()
 
-def _build_manifest_xml(cnpj:str, chNFe:str, tpEvento:str, nSeqEvento:int, cOrgao:str, justificativa:Optional[str]=None) -> etree._Element:
-    # Evento manifestação do destinatário v1.00 (envelopado dentro do envio v4.00)
-    env = etree.Element("envEvento", nsmap={None: NS_NFE}, versao="1.00")
-    etree.SubElement(env, "idLote").text = str(int(time.time()))
-    evento = etree.SubElement(env, "evento", versao="1.00")
-    inf = etree.SubElement(evento, "infEvento", Id=f"ID{tpEvento}{chNFe}{nSeqEvento:02d}")
-    etree.SubElement(inf, "cOrgao").text = cOrgao
-    etree.SubElement(inf, "tpAmb").text = "1" if settings.NFE_AMBIENTE.upper().startswith("PROD") else "2"
-    etree.SubElement(inf, "CNPJ").text = cnpj
-    etree.SubElement(inf, "chNFe").text = chNFe
+DESC_EVENTO = {
+    "210200":"Confirmação da Operação",
+    "210210":"Ciência da Operação",
+    "210220":"Desconhecimento da Operação",
+    "210240":"Operação não Realizada",
+}
+
+# RecepcaoEvento 4.00: até 20 eventos por envEvento
+LOTE_MAX = 20
+
+def _q(tag:str) -> str:
+    # elementos qualificados no namespace da NF-e: localizáveis por find() ao assinar cada evento
+    return f"{{{NS_NFE}}}{tag}"
+
+def _append_evento(env:etree._Element, cnpj:str, chNFe:str, tpEvento:str, nSeqEvento:int, cOrgao:str, justificativa:Optional[str]=None):
+    evento = etree.SubElement(env, _q("evento"), versao="1.00")
+    inf = etree.SubElement(evento, _q("infEvento"), Id=f"ID{tpEvento}{chNFe}{nSeqEvento:02d}")
+    etree.SubElement(inf, _q("cOrgao")).text = cOrgao
+    etree.SubElement(inf, _q("tpAmb")).text = "1" if settings.NFE_AMBIENTE.upper().startswith("PROD") else "2"
+    etree.SubElement(inf, _q("CNPJ")).text = cnpj
+    etree.SubElement(inf, _q("chNFe")).text = chNFe
     # horário local com offset -03:00 (simplificado); para maior precisão, usar datetime com tzinfo
-    etree.SubElement(inf, "dhEvento").text = time.strftime("%Y-%m-%dT%H:%M:%S-03:00", time.localtime())
-    etree.SubElement(inf, "tpEvento").text = tpEvento
-    etree.SubElement(inf, "nSeqEvento").text = f"{nSeqEvento}"
-    det = etree.SubElement(inf, "detEvento", versao="1.00")
+    etree.SubElement(inf, _q("dhEvento")).text = time.strftime("%Y-%m-%dT%H:%M:%S-03:00", time.localtime())
+    etree.SubElement(inf, _q("tpEvento")).text = tpEvento
+    etree.SubElement(inf, _q("nSeqEvento")).text = f"{nSeqEvento}"
+    det = etree.SubElement(inf, _q("detEvento"), versao="1.00")
     # Desc padrão conforme manual (com acentuação)
-    etree.SubElement(det, "descEvento").text = {
-        "210200":"Confirmação da Operação",
-        "210210":"Ciência da Operação",
-        "210220":"Desconhecimento da Operação",
-        "210240":"Operação não Realizada",
-    }.get(tpEvento, "Ciência da Operação")
+    etree.SubElement(det, _q("descEvento")).text = DESC_EVENTO.get(tpEvento, "Ciência da Operação")
     if justificativa:
-        etree.SubElement(det, "xJust").text = justificativa
-    return env
+        etree.SubElement(det, _q("xJust")).text = justificativa
 
-def _sign_with_pem(env_evento:etree._Element, cert_pem_path:str, key_pem_path:str) -> bytes:
-    # Assinatura: inserir <Signature> em <evento>, referenciando #Id do <infEvento>
-    # Usa signxml para assinatura enveloped com algoritmo compatível.
-    from signxml import XMLSigner, methods
-    cert_pem = open(cert_pem_path,'rb').read()
-    key_pem = open(key_pem_path,'rb').read()
-    signer = XMLSigner(method=methods.enveloped)
-    evento = env_evento.find('.//{http://www.portalfiscal.inf.br/nfe}evento')
-    inf = env_evento.find('.//{http://www.portalfiscal.inf.br/nfe}infEvento')
-    if evento is None or inf is None:
-        # fallback: assina raiz
-        signed = signer.sign(env_evento, key=key_pem, cert=cert_pem)
-        return etree.tostring(signed, encoding='utf-8')
-    ref = inf.get('Id')
-    if ref and not ref.startswith('#'):
-        ref = '#' + ref
-    # Assina o elemento "evento", referenciando explicitamente o infEvento
-    signed_evento = signer.sign(evento, key=key_pem, cert=cert_pem, reference_uri=ref, signature_algorithm="rsa-sha256", digest_algorithm="sha256")
-    # Substituir o nó evento pelo assinado dentro do env_evento
-    parent = evento.getparent()
-    parent.replace(evento, signed_evento)
-    return etree.tostring(env_evento, encoding='utf-8')
+def _build_lote(cnpj:str, eventos:list[tuple[str,str,int]], cOrgao:str) -> etree._Element:
+    """``envEvento`` com um ``evento`` por (chNFe, tpEvento, nSeq), todos do mesmo autor e cOrgao."""
+    # Evento manifestação do destinatário v1.00 (envelopado dentro do envio v4.00)
+    env = etree.Element(_q("envEvento"), nsmap={None: NS_NFE}, versao="1.00")
+    etree.SubElement(env, _q("idLote")).text = str(int(time.time()))
+    for chNFe, tpEvento, nSeq in eventos:
+        _append_evento(env, cnpj, chNFe, tpEvento, nSeq, cOrgao)
+    return env
 
-def enviar_manifestacao(cnpj:str, chNFe:str, tpEvento:str, nSeq:int, cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> Dict:
+def _soap_envelope(op_name:str, soap_version:str, signed_xml_bytes:bytes) -> tuple[bytes, dict]:
     # SOAP envelope builder
-    def _build_envelope(op_name:str, soap_version:str) -> tuple[bytes, dict]:
-        if soap_version == "1.2":
-            env = etree.Element("Envelope", nsmap={None:NS_SOAP12})
-            body_el = etree.SubElement(env, "Body")
-            op = etree.SubElement(body_el, f"{{{NS_WS_EV}}}{op_name}")
-            dados = etree.SubElement(op, f"{{{NS_WS_EV}}}nfeDadosMsg")
-            dados.append(etree.fromstring(signed_xml_bytes))
-            soap_xml = etree.tostring(env, encoding='utf-8', xml_declaration=True)
-            action = f"{NS_WS_EV}/{op_name}"
-            headers = {"Content-Type": f"application/soap+xml; charset=utf-8; action=\"{action}\""}
-            return soap_xml, headers
-        else:
-            env = etree.Element("Envelope", nsmap={None:NS_SOAP11})
-            body_el = etree.SubElement(env, "Body")
-            op = etree.SubElement(body_el, f"{{{NS_WS_EV}}}{op_name}")
-            dados = etree.SubElement(op, f"{{{NS_WS_EV}}}nfeDadosMsg")
-            dados.append(etree.fromstring(signed_xml_bytes))
-            soap_xml = etree.tostring(env, encoding='utf-8', xml_declaration=True)
-            action = f"{NS_WS_EV}/{op_name}"
-            headers = {
-                "Content-Type": "text/xml; charset=utf-8",
-                "SOAPAction": f"\"{action}\"",
-            }
-            return soap_xml, headers
-
-    urls = _resolve_event_urls(chNFe)
-    # Em v4, a operação padrão costuma ser "nfeRecepcaoEvento" no WSDL NFeRecepcaoEvento4; incluir variações
-    base_attempts = [
-        ("nfeRecepcaoEvento","1.2"),
-        ("nfeRecepcaoEvento4","1.2"),
-        ("nfeRecepcaoEvento","1.1"),
-        ("nfeRecepcaoEvento4","1.1"),
-        ("NFeRecepcaoEvento","1.2"),
-        ("NFeRecepcaoEvento4","1.2"),
-        ("NFeRecepcaoEvento","1.1"),
-        ("NFeRecepcaoEvento4","1.1"),
-    ]
-    last_resp = None
-    last_meta = None
-    last_error = None
-    cUF = (chNFe or '')[:2] or "91"
+    ns_env = NS_SOAP12 if soap_version == "1.2" else NS_SOAP11
+    env = etree.Element("Envelope", nsmap={None:ns_env})
+    body_el = etree.SubElement(env, "Body")
+    op = etree.SubElement(body_el, f"{{{NS_WS_EV}}}{op_name}")
+    dados = etree.SubElement(op, f"{{{NS_WS_EV}}}nfeDadosMsg")
+    dados.append(etree.fromstring(signed_xml_bytes))
+    soap_xml = etree.tostring(env, encoding='utf-8', xml_declaration=True)
+    action = f"{NS_WS_EV}/{op_name}"
+    if soap_version == "1.2":
+        headers = {"Content-Type": f"application/soap+xml; charset=utf-8; action=\"{action}\""}
+    else:
+        headers = {
+            "Content-Type": "text/xml; charset=utf-8",
+            "SOAPAction": f"\"{action}\"",
+        }
+    headers.setdefault("Accept", "application/soap+xml, text/xml;q=0.9, */*;q=0.8")
+    return soap_xml, headers
 
-    def _is_an(url: str) -> bool:
-        h = url.lower()
-        return "nfe.fazenda.gov.br" in h
+# Em v4, a operação padrão costuma ser "nfeRecepcaoEvento" no WSDL NFeRecepcaoEvento4; incluir variações
+_BASE_ATTEMPTS = [
+    ("nfeRecepcaoEvento","1.2"),
+    ("nfeRecepcaoEvento4","1.2"),
+    ("nfeRecepcaoEvento","1.1"),
+    ("nfeRecepcaoEvento4","1.1"),
+    ("NFeRecepcaoEvento","1.2"),
+    ("NFeRecepcaoEvento4","1.2"),
+    ("NFeRecepcaoEvento","1.1"),
+    ("NFeRecepcaoEvento4","1.1"),
+]
 
-    for url in urls:
+def _is_an(url: str) -> bool:
+    h = url.lower()
+    return "nfe.fazenda.gov.br" in h
+
+def _event_candidates(chNFe:str) -> list[tuple[str,str,str,str]]:
+    """(url, variante, operação, versão SOAP) na ordem aprendida (último par que respondeu primeiro)."""
+    candidates: list[tuple[str,str]] = []
+    for url in _resolve_event_urls(chNFe):
         # Priorizar SOAP 1.1 em alguns endpoints estaduais (ex.: SP)
         is_sp = "fazenda.sp.gov.br" in url.lower()
-        attempts = base_attempts
+        attempts = _BASE_ATTEMPTS
         if is_sp:
             attempts = [
-                (op, ver) for (op, ver) in base_attempts
+                (op, ver) for (op, ver) in _BASE_ATTEMPTS
                 if ver == "1.1"
             ] + [
-                (op, ver) for (op, ver) in base_attempts
+                (op, ver) for (op, ver) in _BASE_ATTEMPTS
                 if ver == "1.2"
             ]
-        for op_name, ver in attempts:
+        candidates += [(url, f"{op}|{ver}") for (op, ver) in attempts]
+    return [(url, variant, *variant.split("|")) for url, variant in endpoint_health.health.order("evento", candidates)]
+
+class _SignError(Exception):
+    pass
+
+class _SignedLote:
+    """Eventos de um envio lógico: o lote é montado e assinado uma vez por cOrgao e reaproveitado
+    em todas as retentativas de endpoint/operação/versão SOAP."""
+
+    def __init__(self, cnpj:str, eventos:list[tuple[str,str,int]], cert_tuple:Tuple[str,str]):
+        self.cnpj = cnpj
+        self.eventos = eventos
+        self.cUF = (eventos[0][0] or '')[:2] or "91"
+        self._signed: dict[str, bytes] = {}
+        try:
+            self.signer = get_signer(cert_tuple)
+        except Exception as e:
+            raise _SignError(str(e))
+
+    def body(self, url:str) -> bytes:
+        # cOrgao adequado ao endpoint (eventos do mesmo grupo de destino)
+        c_orgao = "91" if _is_an(url) else self.cUF
+        if c_orgao not in self._signed:
             try:
-                # Construir XML do evento com cOrgao adequado ao endpoint
-                c_orgao = "91" if _is_an(url) else cUF
-                try:
-                    body = _build_manifest_xml(cnpj, chNFe, tpEvento, nSeq, c_orgao)
-                    signed = _sign_with_pem(body, cert_tuple[0], cert_tuple[1])
-                except Exception as e:
-                    return {"error":"sign","detail":str(e)}
-                signed_xml_bytes = signed
-                soap_xml, headers = _build_envelope(op_name, ver)
-                headers.setdefault("Accept", "application/soap+xml, text/xml;q=0.9, */*;q=0.8")
-                resp = requests.post(url, data=soap_xml, headers=headers, cert=cert_tuple, verify=_resolve_verify(verify_ca), timeout=45)
-                last_resp = resp
-                last_meta = {"url": url, "op": op_name, "soap": ver}
-                if resp.status_code == 200:
-                    break
-            except requests.RequestException as e:
-                # Não abortar: tentar próximos endpoints/candidatos
-                last_resp = None
-                last_error = str(e)
-                last_meta = {"url": url, "op": op_name, "soap": ver}
-                continue
-        if last_resp is not None and last_resp.status_code == 200:
-            break
+                self._signed[c_orgao] = self.signer.sign_lote(_build_lote(self.cnpj, self.eventos, c_orgao))
+            except Exception as e:
+                raise _SignError(str(e))
+        return self._signed[c_orgao]
+
+def _event_request(lote:_SignedLote, url:str, op_name:str, ver:str) -> tuple[bytes, dict]:
+    return _soap_envelope(op_name, ver, lote.body(url))
+
+def _send(session, cnpj:str, eventos:list[tuple[str,str,int]], cert_tuple:Tuple[str,str]) -> tuple:
+    """Tenta os candidatos até um HTTP 200; (última resposta, meta, erro de rede)."""
+    last_resp = None
+    last_meta = None
+    last_error = None
+    lote = _SignedLote(cnpj, eventos, cert_tuple)
+    for url, variant, op_name, ver in _event_candidates(eventos[0][0]):
+        try:
+            soap_xml, headers = _event_request(lote, url, op_name, ver)
+            limiter.acquire(url)
+            t0 = time.monotonic()
+            resp = session.post(url, data=soap_xml, headers=headers, timeout=45)
+            dt = time.monotonic() - t0
+            limiter.observe(url, dt, resp.status_code == 200)
+            metrics.ws_request("evento", url, ver, dt, resp.status_code)
+            last_resp = resp
+            last_meta = {"url": url, "op": op_name, "soap": ver}
+            if resp.status_code == 200:
+                endpoint_health.health.success("evento", url, variant)
+                break
+            endpoint_health.health.failure("evento", url, variant)
+        except requests.RequestException as e:
+            # Não abortar: tentar próximos endpoints/candidatos
+            endpoint_health.health.failure("evento", url, variant)
+            limiter.observe(url, None, False)
+            metrics.ws_request("evento", url, ver, None, None)
+            last_resp = None
+            last_error = str(e)
+            last_meta = {"url": url, "op": op_name, "soap": ver}
+            continue
+    return last_resp, last_meta, last_error
+
+async def _send_async(client, cnpj:str, eventos:list[tuple[str,str,int]], cert_tuple:Tuple[str,str]) -> tuple:
+    """``_send`` sobre o transporte assíncrono."""
+    last_resp = None
+    last_meta = None
+    last_error = None
+    lote = await asyncio.to_thread(_SignedLote, cnpj, eventos, cert_tuple)
+    for url, variant, op_name, ver in _event_candidates(eventos[0][0]):
+        try:
+            # assinatura (só na primeira tentativa de cada cOrgao) é CPU: fora do event loop
+            soap_xml, headers = await asyncio.to_thread(_event_request, lote, url, op_name, ver)
+            await limiter.acquire_async(url)
+            t0 = time.monotonic()
+            resp = await client.post(url, content=soap_xml, headers=headers)
+            dt = time.monotonic() - t0
+            limiter.observe(url, dt, resp.status_code == 200)
+            metrics.ws_request("evento", url, ver, dt, resp.status_code)
+            last_resp = resp
+            last_meta = {"url": url, "op": op_name, "soap": ver}
+            if resp.status_code == 200:
+                endpoint_health.health.success("evento", url, variant)
+                break
+            endpoint_health.health.failure("evento", url, variant)
+        except httpx.HTTPError as e:
+            # Não abortar: tentar próximos endpoints/candidatos
+            endpoint_health.health.failure("evento", url, variant)
+            limiter.observe(url, None, False)
+            metrics.ws_request("evento", url, ver, None, None)
+            last_resp = None
+            last_error = str(e)
+            last_meta = {"url": url, "op": op_name, "soap": ver}
+            continue
+    return last_resp, last_meta, last_error
+
+def _text(el, tag:str) -> Optional[str]:
+    found = el.find(f'{{{NS_NFE}}}{tag}') if el is not None else None
+    return found.text if found is not None else None
+
+def _parse_ret(content:bytes) -> tuple[dict, list[dict]]:
+    """(cStat/xMotivo do lote, retorno de cada ``retEvento``) da resposta do RecepcaoEvento."""
+    doc = etree.fromstring(content)
+    ret_env = next(doc.iter(f'{{{NS_NFE}}}retEnvEvento'), None)
+    if ret_env is not None:
+        lote = {"cStat": _text(ret_env, "cStat"), "xMotivo": _text(ret_env, "xMotivo")}
+    else:
+        cStat = next(doc.iter(f'{{{NS_NFE}}}cStat'), None)
+        xMotivo = next(doc.iter(f'{{{NS_NFE}}}xMotivo'), None)
+        lote = {"cStat": cStat.text if cStat is not None else None, "xMotivo": xMotivo.text if xMotivo is not None else None}
+    eventos = []
+    for ret in doc.iter(f'{{{NS_NFE}}}retEvento'):
+        inf = ret.find(f'{{{NS_NFE}}}infEvento')
+        eventos.append({
+            "chNFe": _text(inf, "chNFe"),
+            "tpEvento": _text(inf, "tpEvento"),
+            "nSeq": _text(inf, "nSeqEvento"),
+            "cStat": _text(inf, "cStat"),
+            "xMotivo": _text(inf, "xMotivo"),
+            "nProt": _text(inf, "nProt"),
+            "ret_xml": etree.tostring(ret, encoding='unicode'),
+        })
+    return lote, eventos
+
+def _event_result(last_resp, last_meta:Optional[dict], last_error:Optional[str]) -> Dict:
+    """Retorno da manifestação a partir da última resposta (``requests`` ou ``httpx``)."""
     if last_resp is None:
         out = {"error":"http","detail": last_error or "sem resposta"}
         if last_meta:
@@ -213,17 +305,115 @@ def enviar_manifestacao(cnpj:str, chNFe:str, tpEvento:str, nSeq:int, cert_tuple:
             out.update(last_meta)
         return out
     try:
-        doc = etree.fromstring(last_resp.content)
-        ns = {"soap":"http://www.w3.org/2003/05/soap-envelope", "nfe":NS_NFE}
-        # Procurar retEnvEvento/retEvento
-        cStat = doc.find('.//nfe:cStat', ns)
-        xMotivo = doc.find('.//nfe:xMotivo', ns)
+        # cStat do evento (retEvento); sem retEvento (lote rejeitado), o do lote
+        lote, eventos = _parse_ret(last_resp.content)
+        ret = eventos[0] if eventos else lote
         out.update({
-            "cStat": cStat.text if cStat is not None else None,
-            "xMotivo": xMotivo.text if xMotivo is not None else None,
+            "cStat": ret["cStat"],
+            "xMotivo": ret["xMotivo"],
             "resp_xml": last_resp.content.decode('utf-8','ignore')
         })
+        if eventos and eventos[0].get("nProt"):
+            out["nProt"] = eventos[0]["nProt"]
     except Exception as e:
         out["error"] = "parse"
         out["detail"] = str(e)
     return out
+
+def _key(chNFe:str, tpEvento:str, nSeq) -> tuple[str, str, int]:
+    return (chNFe, tpEvento, int(nSeq))
+
+def _lote_results(eventos:list[tuple[str,str,int]], last_resp, last_meta:Optional[dict], last_error:Optional[str]) -> list[Dict]:
+    """Retorno por evento do lote, casado por (chNFe, tpEvento, nSeqEvento); falha do envio ou lote
+    rejeitado vale para todos os eventos."""
+    common = _event_result(last_resp, last_meta, last_error) if last_resp is None or last_resp.status_code != 200 else None
+    by_key = {}
+    no_seq = {}
+    lote = {}
+    if common is None:
+        try:
+            lote, rets = _parse_ret(last_resp.content)
+            for r in rets:
+                if (r["nSeq"] or "").strip().isdigit():
+                    by_key[_key(r["chNFe"], r["tpEvento"], r["nSeq"])] = r
+                else:
+                    # rejeição sem nSeqEvento: casa pela chave/tipo
+                    no_seq[(r["chNFe"], r["tpEvento"])] = r
+        except Exception as e:
+            common = {"status_code": last_resp.status_code, "error": "parse", "detail": str(e)}
+    out = []
+    for chNFe, tpEvento, nSeq in eventos:
+        item = {"chNFe": chNFe, "tpEvento": tpEvento, "nSeq": nSeq}
+        r = by_key.get(_key(chNFe, tpEvento, nSeq)) or no_seq.get((chNFe, tpEvento))
+        if common is not None:
+            item.update(common)
+        elif r is not None:
+            item.update({"cStat": r["cStat"], "xMotivo": r["xMotivo"], "nProt": r["nProt"], "resp_xml": r["ret_xml"]})
+        else:
+            # lote rejeitado por inteiro (ex.: 215 falha de schema) ou evento sem retorno
+            item.update({"cStat": lote.get("cStat"), "xMotivo": lote.get("xMotivo"), "lote": True})
+        out.append(item)
+    return out
+
+def enviar_manifestacao(cnpj:str, chNFe:str, tpEvento:str, nSeq:int, cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> Dict:
+    session = get_session(''.join(ch for ch in (cnpj or '') if ch.isdigit()), cert_tuple, _resolve_verify(verify_ca), service="evento")
+    try:
+        return _event_result(*_send(session, cnpj, [(chNFe, tpEvento, nSeq)], cert_tuple))
+    except _SignError as e:
+        return {"error":"sign","detail":str(e)}
+
+async def enviar_manifestacao_async(cnpj:str, chNFe:str, tpEvento:str, nSeq:int, cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> Dict:
+    """``enviar_manifestacao`` sobre o transporte assíncrono (mesmos candidatos, ordem e retorno)."""
+    client = async_transport.get_client(''.join(ch for ch in (cnpj or '') if ch.isdigit()), cert_tuple, _resolve_verify(verify_ca), service="evento")
+    try:
+        return _event_result(*await _send_async(client, cnpj, [(chNFe, tpEvento, nSeq)], cert_tuple))
+    except _SignError as e:
+        return {"error":"sign","detail":str(e)}
+
+def _lotes(eventos:list[tuple[str,str,int]]) -> list[list[tuple[str,str,int]]]:
+    """Agrupa por destino (mesma lista de endpoints candidatos, ex.: SEFAZ-SP x AN) e fatia em
+    lotes de até ``DFE_EVENT_BATCH_SIZE`` (máx. 20) eventos."""
+    size = max(1, min(LOTE_MAX, settings.DFE_EVENT_BATCH_SIZE))
+    groups: dict[tuple, list] = {}
+    for ev in dict.fromkeys(_key(*ev) for ev in eventos):  # evento repetido iria duas vezes no mesmo lote
+        groups.setdefault(tuple(_resolve_event_urls(ev[0])), []).append(ev)
+    return [g[i:i+size] for g in groups.values() for i in range(0, len(g), size)]
+
+def _lote_failed(lote:list[tuple[str,str,int]], error:str, detail:str) -> list[Dict]:
+    return [{"chNFe": ch, "tpEvento": tp, "nSeq": n, "error": error, "detail": detail} for ch, tp, n in lote]
+
+def enviar_manifestacao_lote(cnpj:str, eventos:list[tuple[str,str,int]], cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> list[Dict]:
+    """Envia vários eventos (chNFe, tpEvento, nSeq) em lotes ``envEvento`` assinados, até
+    ``DFE_EVENT_BATCH_WORKERS`` lotes simultâneos. Devolve um retorno por evento, na ordem de entrada."""
+    session = get_session(''.join(ch for ch in (cnpj or '') if ch.isdigit()), cert_tuple, _resolve_verify(verify_ca), service="evento")
+
+    def _one(lote):
+        try:
+            return _lote_results(lote, *_send(session, cnpj, lote, cert_tuple))
+        except _SignError as e:
+            return _lote_failed(lote, "sign", str(e))
+        except Exception as e:
+            # falha inesperada fica nos eventos deste lote; os demais lotes seguem
+            return _lote_failed(lote, "exception", str(e))
+
+    lotes = _lotes(eventos)
+    with ThreadPoolExecutor(max_workers=max(1, settings.DFE_EVENT_BATCH_WORKERS), thread_name_prefix="dfe-evento") as pool:
+        results = {_key(r["chNFe"], r["tpEvento"], r["nSeq"]): r for res in pool.map(_one, lotes) for r in res}
+    return [results[_key(*ev)] for ev in eventos]
+
+async def enviar_manifestacao_lote_async(cnpj:str, eventos:list[tuple[str,str,int]], cert_tuple:Tuple[str,str], verify_ca:Optional[str|bool]=None) -> list[Dict]:
+    """``enviar_manifestacao_lote`` sobre o transporte assíncrono."""
+    client = async_transport.get_client(''.join(ch for ch in (cnpj or '') if ch.isdigit()), cert_tuple, _resolve_verify(verify_ca), service="evento")
+    sem = asyncio.Semaphore(max(1, settings.DFE_EVENT_BATCH_WORKERS))
+
+    async def _one(lote):
+        async with sem:
+            try:
+                return _lote_results(lote, *await _send_async(client, cnpj, lote, cert_tuple))
+            except _SignError as e:
+                return _lote_failed(lote, "sign", str(e))
+            except Exception as e:
+                return _lote_failed(lote, "exception", str(e))
+
+    results = {_key(r["chNFe"], r["tpEvento"], r["nSeq"]): r for res in await asyncio.gather(*(_one(l) for l in _lotes(eventos))) for r in res}
+    return [results[_key(*ev)] for ev in eventos]
@@ -0,0 +1,198 @@
+"""Governador de taxa por host para chamadas ao AN/SEFAZ.
+
+Balde de fichas por host em memória do processo, compartilhado por todas as empresas e
+threads: reservar uma ficha ou registrar uma resposta não faz I/O. Entre processos
+(agendador + API + ``sync_worker``) circula só a taxa de cada host, em
+``DFE_GOVERNOR_STATE_PATH`` (JSON protegido por ``fcntl.flock``), no máximo a cada
+``DFE_GOV_SYNC_SEC`` por processo: cada um soma ao arquivo o ajuste que fez desde a última
+troca, lê a taxa combinada e se inscreve como ativo; a taxa do host é dividida entre os
+processos ativos. O 656 é gravado na hora. Sem caminho configurado ou sem ``fcntl``, a taxa
+fica só no processo.
+
+A taxa se ajusta sozinha (AIMD) entre ``DFE_GOV_MIN_RPS`` e ``DFE_HOST_MAX_RPS``:
+- resposta rápida (abaixo de ``DFE_GOV_LATENCY_TARGET_MS``): sobe ``DFE_GOV_STEP_RPS``;
+- resposta lenta, erro HTTP ou falha de rede: multiplica por 0.8;
+- cStat 656 (consumo indevido): multiplica por 0.5.
+
+Substitui a pausa fixa entre páginas (``DFE_SLEEP_BETWEEN_CALLS_MS``): empresas
+pequenas paginam na velocidade que o AN aceita, e o ritmo cai para todos assim que
+o AN dá sinais de saturação. O 656 continua encerrando o ciclo da empresa (espera de
+1 h exigida pelo AN para aquele CNPJ); o governador só evita que as demais o provoquem.
+"""
+import asyncio, json, os, socket, threading, time
+from typing import Optional
+from urllib.parse import urlsplit
+from src.settings import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+_SLOW_FACTOR = 0.8
+_656_FACTOR = 0.5
+_PROC_STALE_SEC = 60  # processo sem troca há mais tempo deixa de dividir a taxa
+
+def _host(url: Optional[str]) -> str:
+    return (urlsplit(url).hostname or url) if url else ""
+
+class _SharedRates:
+    """Taxas por host e processos ativos em arquivo JSON; cada troca lê e grava sob ``flock`` exclusivo."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.member = f"{socket.gethostname()}:{os.getpid()}"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def merge(self, deltas: dict[str, float], default: float, clamp) -> tuple[dict[str, float], int]:
+        """Soma ``deltas`` às taxas do arquivo e renova a inscrição do processo; devolve as taxas
+        combinadas e o número de processos ativos."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            with os.fdopen(os.dup(fd), "r+") as f:
+                raw = f.read()
+                try:
+                    data = json.loads(raw) if raw else {}
+                except ValueError:
+                    data = {}
+                now = time.time()
+                procs = {m: ts for m, ts in (data.get("procs") or {}).items() if now - ts < _PROC_STALE_SEC}
+                procs[self.member] = now
+                rates = data.get("rates") or {}
+                for h, d in deltas.items():
+                    rates[h] = clamp(rates.get(h, default) + d)
+                f.seek(0)
+                f.truncate()
+                json.dump({"rates": rates, "procs": procs}, f)
+                return rates, len(procs)
+        finally:
+            os.close(fd)  # libera o flock
+
+class AdaptiveGovernor:
+    def __init__(self, shared: Optional[_SharedRates], max_rps: float, min_rps: float, step_rps: float,
+                 latency_target_sec: float, sync_sec: float = 1.0):
+        self.shared = shared
+        self.max_rps = max_rps
+        self.min_rps = min(min_rps, max_rps) if max_rps > 0 else min_rps
+        self.step_rps = step_rps
+        self.latency_target_sec = latency_target_sec
+        self.sync_sec = sync_sec
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._buckets: dict[str, dict] = {}  # host -> taxa do host (todos os processos), fichas, instante
+        self._base: dict[str, float] = {}    # host -> taxa combinada lida na última troca
+        self._procs = 1
+        self._synced = 0.0
+
+    def _clamp(self, rate: float) -> float:
+        return max(self.min_rps, min(self.max_rps, rate))
+
+    def _bucket(self, host: str, now: float) -> dict:
+        b = self._buckets.get(host)
+        if b is None:
+            b = self._buckets[host] = {"rate": max(self.min_rps, self.max_rps / 2), "tokens": 1.0, "ts": now}
+        return b
+
+    def reserve(self, url: str) -> float:
+        """Reserva uma ficha do host de ``url``; devolve quantos segundos esperar até ela valer
+        (fichas negativas = fila)."""
+        if not self.max_rps or self.max_rps <= 0:
+            return 0.0
+        host = _host(url)
+        with self._lock:
+            now = time.monotonic()
+            b = self._bucket(host, now)
+            rate = b["rate"] / self._procs
+            # rajada máxima de 1 ficha: chamadas espaçadas em 1/rate
+            b["tokens"] = min(1.0, b["tokens"] + (now - b["ts"]) * rate) - 1.0
+            b["ts"] = now
+            wait = -b["tokens"] / rate if b["tokens"] < 0 else 0.0
+        self._sync()
+        return wait
+
+    def acquire(self, url: str):
+        wait = self.reserve(url)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, url: str):
+        """``acquire`` para o transporte assíncrono: a reserva (e a eventual troca com o arquivo)
+        roda em thread e a espera é ``asyncio.sleep``, sem bloquear o event loop."""
+        wait = await asyncio.to_thread(self.reserve, url)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _sync(self, force: bool = False):
+        """Troca a taxa com os demais processos, no máximo a cada ``sync_sec`` (``force``: já)."""
+        if self.shared is None:
+            return
+        # fora do 656, quem chega durante uma troca em curso não espera o arquivo
+        if not self._sync_lock.acquire(blocking=force):
+            return
+        try:
+            with self._lock:
+                now = time.monotonic()
+                if not force and now - self._synced < self.sync_sec:
+                    return
+                self._synced = now
+                sent = {h: b["rate"] for h, b in self._buckets.items()}
+            deltas = {h: r - self._base.get(h, r) for h, r in sent.items()}
+            try:
+                rates, procs = self.shared.merge(deltas, max(self.min_rps, self.max_rps / 2), self._clamp)
+            except OSError as e:
+                print(f"[DFE] governador: falha ao compartilhar taxas em {self.shared.path}: {e}")
+                return
+            with self._lock:
+                self._procs = max(1, procs)
+                for h, r in rates.items():
+                    b = self._bucket(h, now)
+                    # ajustes feitos durante a troca entram na próxima
+                    b["rate"] = self._clamp(r + b["rate"] - sent.get(h, b["rate"]))
+                    self._base[h] = r
+        finally:
+            self._sync_lock.release()
+
+    def _adjust(self, url: Optional[str], fn):
+        if not self.max_rps or self.max_rps <= 0:
+            return False
+        host = _host(url)
+        with self._lock:
+            now = time.monotonic()
+            hosts = [host] if host else list(self._buckets)
+            for h in hosts:
+                b = self._bucket(h, now)
+                b["rate"] = self._clamp(fn(b["rate"]))
+        return True
+
+    def observe(self, url: str, latency_sec: Optional[float], ok: bool):
+        """Resultado de uma chamada: ``ok`` com latência medida, ou falha (HTTP != 200/rede)."""
+        if ok and latency_sec is not None and latency_sec <= self.latency_target_sec:
+            changed = self._adjust(url, lambda r: r + self.step_rps)
+        else:
+            changed = self._adjust(url, lambda r: r * _SLOW_FACTOR)
+        if changed:
+            self._sync()
+
+    def penalize(self, url: Optional[str] = None):
+        """cStat 656 no host de ``url`` (ou em todos, se desconhecido); vai para o arquivo na hora."""
+        if self._adjust(url, lambda r: r * _656_FACTOR):
+            self._sync(force=True)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {h: round(b["rate"], 3) for h, b in self._buckets.items()}
+
+def _shared() -> Optional[_SharedRates]:
+    if settings.DFE_GOVERNOR_STATE_PATH and fcntl is not None:
+        return _SharedRates(settings.DFE_GOVERNOR_STATE_PATH)
+    return None
+
+limiter = AdaptiveGovernor(
+    _shared(),
+    max_rps=settings.DFE_HOST_MAX_RPS,
+    min_rps=settings.DFE_GOV_MIN_RPS,
+    step_rps=settings.DFE_GOV_STEP_RPS,
+    latency_target_sec=settings.DFE_GOV_LATENCY_TARGET_MS / 1000.0,
+    sync_sec=settings.DFE_GOV_SYNC_SEC,
+)
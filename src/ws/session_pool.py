@@ -0,0 +1,141 @@
+"""Registro de sessões HTTP (mTLS) reutilizáveis por empresa/certificado/serviço.
+
+Cada chamada ao AN criava um ``requests.Session`` novo, pagando TCP + handshake TLS
+com certificado cliente a cada página do ``pull_until_idle``. Aqui mantemos uma
+sessão com pool keep-alive por (empresa, fingerprint do certificado, serviço),
+descartada quando fica ociosa ou quando o certificado da empresa muda.
+
+Cert e chave são carregados uma única vez em um ``SSLContext`` próprio da sessão
+(montado no adapter); conexões novas do pool não voltam a ler PEM do disco, e os
+arquivos de origem (ver ``src.cert.cert_manager``) podem sumir depois da criação.
+
+O tempo de conexão (TCP + handshake TLS) das conexões novas é acumulado por thread e
+lido com ``take_connect_time`` (trace por página de ``run_distribution``).
+"""
+import hashlib, os, ssl, threading, time
+from typing import Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from src.settings import settings
+
+_connect = threading.local()
+
+def take_connect_time() -> float:
+    """Segundos gastos abrindo conexões nesta thread desde a última leitura (zera o acumulado)."""
+    sec = getattr(_connect, "sec", 0.0)
+    _connect.sec = 0.0
+    return sec
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        t0 = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            _connect.sec = getattr(_connect, "sec", 0.0) + time.monotonic() - t0
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class _Entry:
+    __slots__ = ("session", "fingerprint", "verify", "last_used")
+
+    def __init__(self, session: requests.Session, fingerprint: str, verify):
+        self.session = session
+        self.fingerprint = fingerprint
+        self.verify = verify
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.session.close()
+        except Exception:
+            pass
+
+class _ContextAdapter(HTTPAdapter):
+    """HTTPAdapter cujo pool usa um SSLContext fixo (cert cliente e CAs já carregados)."""
+
+    def __init__(self, ssl_context: ssl.SSLContext, **kw):
+        self._ssl_context = ssl_context
+        super().__init__(**kw)
+
+    def init_poolmanager(self, *args, **kw):
+        kw["ssl_context"] = self._ssl_context
+        super().init_poolmanager(*args, **kw)
+        self.poolmanager.pool_classes_by_scheme = {"http": HTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+    def proxy_manager_for(self, *args, **kw):
+        kw["ssl_context"] = self._ssl_context
+        return super().proxy_manager_for(*args, **kw)
+
+# (empresa, serviço) -> entrada; o fingerprint fica na entrada para detectar troca de certificado
+_registry: dict[tuple[str, str], _Entry] = {}
+_lock = threading.Lock()
+
+def cert_fingerprint(cert_tuple: Tuple[str, str]) -> str:
+    """SHA-256 do PEM do certificado (cadeia incluída)."""
+    with open(cert_tuple[0], "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def ssl_context(cert_tuple: Tuple[str, str], verify) -> ssl.SSLContext:
+    if verify is False:
+        ctx = ssl.create_default_context()
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    elif isinstance(verify, str) and os.path.isdir(verify):
+        ctx = ssl.create_default_context(capath=verify)
+    elif isinstance(verify, str):
+        ctx = ssl.create_default_context(cafile=verify)
+    else:
+        ctx = ssl.create_default_context()
+    ctx.load_cert_chain(cert_tuple[0], cert_tuple[1])
+    return ctx
+
+def _new_session(cert_tuple: Tuple[str, str], verify) -> requests.Session:
+    s = requests.Session()
+    adapter = _ContextAdapter(ssl_context(cert_tuple, verify), pool_connections=4,
+                              pool_maxsize=settings.DFE_SESSION_POOL_MAXSIZE, max_retries=0)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    # verificação/CAs e cert cliente já estão no contexto; True evita que o requests
+    # recarregue o bundle e o par cert/chave a cada conexão nova
+    s.verify = verify is not False
+    return s
+
+def _evict_idle_locked(now: float):
+    ttl = settings.DFE_SESSION_IDLE_SEC
+    for key in [k for k, e in _registry.items() if now - e.last_used > ttl]:
+        _registry.pop(key).close()
+
+def get_session(empresa: str, cert_tuple: Tuple[str, str], verify, service: str = "dist") -> requests.Session:
+    """Retorna a sessão mTLS da empresa para o serviço, criando-a se necessário.
+
+    Se o fingerprint do certificado (ou o ``verify``) mudou desde a criação, a sessão
+    antiga é fechada e substituída. Sessões ociosas há mais de ``DFE_SESSION_IDLE_SEC`` são descartadas.
+    """
+    fp = cert_fingerprint(cert_tuple)
+    key = (empresa, service)
+    now = time.monotonic()
+    with _lock:
+        _evict_idle_locked(now)
+        entry = _registry.get(key)
+        if entry is not None and (entry.fingerprint != fp or entry.verify != verify):
+            _registry.pop(key).close()
+            entry = None
+        if entry is None:
+            entry = _Entry(_new_session(cert_tuple, verify), fp, verify)
+            _registry[key] = entry
+        entry.last_used = now
+        return entry.session
+
+def invalidate(empresa: Optional[str] = None):
+    """Fecha as sessões da empresa (ou todas, se ``empresa`` for None)."""
+    with _lock:
+        for key in [k for k in _registry if empresa is None or k[0] == empresa]:
+            _registry.pop(key).close()
+
+def evict_idle():
+    with _lock:
+        _evict_idle_locked(time.monotonic())
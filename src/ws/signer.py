@@ -0,0 +1,83 @@
+"""Assinatura XMLDSig dos eventos da NF-e com o material de chave em cache.
+
+Antes, cada tentativa de envio (URL × operação × versão SOAP) relia os PEM do disco,
+montava um ``XMLSigner`` e assinava o lote de novo: uma manifestação podia ser assinada
+dezenas de vezes. Aqui:
+
+- chave privada e cadeia do certificado são carregadas uma vez por certificado
+  (fingerprint SHA-256 do PEM, o mesmo das sessões de ``session_pool``), em cache LRU;
+- ``EventSigner.sign_lote`` assina todos os ``evento`` de um ``envEvento`` com o mesmo
+  ``XMLSigner``: uma ``Signature`` enveloped por evento, referenciando o ``infEvento``
+  (RSA-SHA256, C14N 1.0, como exige o leiaute).
+
+Reaproveitar o lote assinado entre as retentativas de um mesmo envio fica com o chamador
+(``src.ws.manifest_client``): só o cOrgao (UF x AN) muda o conteúdo assinado.
+"""
+import threading
+from collections import OrderedDict
+from typing import Tuple
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from lxml import etree
+from signxml import XMLSigner, methods
+from signxml.util import iterate_pem
+from src.ws.session_pool import cert_fingerprint
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+NS_DS = "http://www.w3.org/2000/09/xmldsig#"
+C14N_10 = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+
+# certificados distintos mantidos em memória (empresas com manifestação ativa)
+_MAX_SIGNERS = 64
+
+class EventSigner:
+    """Chave e cadeia de um certificado, já carregadas."""
+
+    def __init__(self, cert_pem: bytes, key_pem: bytes):
+        self._key = load_pem_private_key(key_pem, password=None)
+        self._chain = list(iterate_pem(cert_pem))
+
+    def _xml_signer(self) -> XMLSigner:
+        signer = XMLSigner(method=methods.enveloped, signature_algorithm="rsa-sha256",
+                           digest_algorithm="sha256", c14n_algorithm=C14N_10)
+        signer.namespaces = {None: NS_DS}  # <Signature> sem prefixo
+        return signer
+
+    def sign_lote(self, env: etree._Element) -> bytes:
+        """Assina cada ``evento`` do ``envEvento`` (no lugar) e devolve o lote serializado."""
+        eventos = env.findall(f"{{{NS_NFE}}}evento")
+        if not eventos:
+            raise ValueError("envEvento sem evento para assinar")
+        signer = self._xml_signer()
+        for evento in eventos:
+            inf = evento.find(f"{{{NS_NFE}}}infEvento")
+            ref = inf.get("Id") if inf is not None else None
+            if not ref:
+                raise ValueError("infEvento sem Id")
+            signed = signer.sign(evento, key=self._key, cert=self._chain, reference_uri="#" + ref)
+            env.replace(evento, signed)
+        return etree.tostring(env, encoding="utf-8")
+
+# fingerprint do certificado -> assinador (mais recente no fim)
+_signers: "OrderedDict[str, EventSigner]" = OrderedDict()
+_lock = threading.Lock()
+
+def get_signer(cert_tuple: Tuple[str, str]) -> EventSigner:
+    """Assinador do certificado; a chave só é lida/decodificada na primeira vez."""
+    fp = cert_fingerprint(cert_tuple)
+    with _lock:
+        signer = _signers.get(fp)
+        if signer is not None:
+            _signers.move_to_end(fp)
+            return signer
+    # carrega fora do lock; em corrida duas threads podem carregar, a última vence
+    with open(cert_tuple[0], "rb") as f:
+        cert_pem = f.read()
+    with open(cert_tuple[1], "rb") as f:
+        key_pem = f.read()
+    signer = EventSigner(cert_pem, key_pem)
+    with _lock:
+        _signers[fp] = signer
+        _signers.move_to_end(fp)
+        while len(_signers) > _MAX_SIGNERS:
+            _signers.popitem(last=False)
+    return signer
@@ -0,0 +1,79 @@
+"""Montagem das requisições da Distribuição DF-e (distNSU, consNSU, consChNFe).
+
+Os envelopes SOAP 1.1/1.2 de cada operação são compilados uma única vez em trechos
+de bytes fixos; a cada chamada só se concatenam tpAmb, CNPJ e o valor da consulta
+(ultNSU, NSU ou chNFe). Os cabeçalhos HTTP por versão também são fixos. Para o
+caminho via WSDL (zeep), o ``distDFeInt`` é copiado de um elemento modelo.
+
+Nova operação: incluir em ``OPS`` (elemento do grupo, campo e normalização do valor).
+"""
+import copy
+from functools import lru_cache
+from lxml import etree
+from src.settings import settings
+
+NS_WS  = "http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe"
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+ACTION = "http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe/nfeDistDFeInteresse"
+HEADERS = {
+    "1.1": {'Content-Type': 'text/xml; charset=utf-8', 'SOAPAction': ACTION},
+    "1.2": {'Content-Type': 'application/soap+xml; charset=utf-8; action="'+ACTION+'"'},
+}
+SOAP_VERSIONS = ("1.1", "1.2")
+
+def _digits(s: str) -> str:
+    return ''.join(ch for ch in (s or '') if ch.isdigit())
+
+def _nsu15(nsu: str) -> str:
+    return _digits(nsu).zfill(15)[:15]
+
+# operação -> (grupo em distDFeInt, campo, normalização do valor)
+OPS = {
+    "distNSU":   ("distNSU",   "ultNSU", _nsu15),
+    "consNSU":   ("consNSU",   "NSU",    _nsu15),
+    "consChNFe": ("consChNFe", "chNFe",  lambda v: _digits(v)[:44]),
+}
+
+_ENVELOPES = {
+    "1.1": ("soap", "http://schemas.xmlsoap.org/soap/envelope/"),
+    "1.2": ("soap12", "http://www.w3.org/2003/05/soap-envelope"),
+}
+
+def tp_amb() -> str:
+    return "1" if settings.NFE_AMBIENTE.upper().startswith("PROD") else "2"
+
+@lru_cache(maxsize=None)
+def _template(op: str, ver: str) -> tuple[bytes, bytes, bytes, bytes]:
+    """(antes do tpAmb, entre tpAmb e CNPJ, entre CNPJ e valor, depois do valor)."""
+    group, field, _ = OPS[op]
+    p, ns_env = _ENVELOPES[ver]
+    head = (f'<?xml version="1.0" encoding="utf-8"?>'
+            f'<{p}:Envelope xmlns:{p}="{ns_env}" xmlns:ws="{NS_WS}" xmlns:nfe="{NS_NFE}">'
+            f'<{p}:Body><ws:nfeDistDFeInteresse><ws:nfeDadosMsg>'
+            f'<distDFeInt xmlns="{NS_NFE}" versao="1.01"><tpAmb>')
+    tail = (f'</{field}></{group}></distDFeInt>'
+            f'</ws:nfeDadosMsg></ws:nfeDistDFeInteresse></{p}:Body></{p}:Envelope>')
+    return (head.encode(), b"</tpAmb><CNPJ>", f"</CNPJ><{group}><{field}>".encode(), tail.encode())
+
+def envelope(op: str, ver: str, cnpj: str, value: str) -> bytes:
+    """Envelope SOAP ``ver`` (1.1|1.2) da operação ``op`` pronto para o POST."""
+    head, mid1, mid2, tail = _template(op, ver)
+    return b"".join((head, tp_amb().encode(), mid1, _digits(cnpj).encode(), mid2,
+                     OPS[op][2](value).encode(), tail))
+
+@lru_cache(maxsize=None)
+def _element_template(op: str):
+    group, field, _ = OPS[op]
+    root = etree.Element("distDFeInt", nsmap={None: NS_NFE}, versao="1.01")
+    etree.SubElement(root, "tpAmb")
+    etree.SubElement(root, "CNPJ")
+    etree.SubElement(etree.SubElement(root, group), field)
+    return root
+
+def dist_element(op: str, cnpj: str, value: str):
+    """``distDFeInt`` como elemento lxml (caminho via WSDL/zeep)."""
+    root = copy.deepcopy(_element_template(op))
+    root[0].text = tp_amb()
+    root[1].text = _digits(cnpj)
+    root[2][0].text = OPS[op][2](value)
+    return root
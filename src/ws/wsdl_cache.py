@@ -0,0 +1,120 @@
+"""Cache do WSDL da Distribuição DF-e para o modo ``DFE_USE_WSDL``.
+
+Antes, cada consulta criava um ``zeep.Client`` novo: baixava (ou relia) e parseava
+o WSDL/XSD, centenas de ms por página do ``pull_until_idle``. Agora:
+
+- o ``zeep.wsdl.Document`` parseado fica em memória por (ambiente, WSDL) e é
+  compartilhado; o ``Client`` de cada sessão mTLS é só um invólucro barato sobre ele
+  (guardado na própria sessão, vive e morre com ela);
+- os bytes de WSDL/XSD baixados ficam em ``DFE_WSDL_CACHE_PATH`` (``SqliteCache`` do
+  zeep), de modo que um processo novo parseia sem ir à rede;
+- passado ``DFE_WSDL_TTL_SEC``, o documento em uso continua servindo e um novo é
+  carregado em segundo plano;
+- se nem o remoto nem o arquivo local carregam, a falha é lembrada por alguns
+  minutos (as consultas seguem pelo SOAP direto sem nova tentativa a cada página).
+"""
+import logging, os, threading, time
+from typing import Optional
+from zeep import Client, Settings
+from zeep.cache import SqliteCache
+from zeep.transports import Transport
+from zeep.wsdl import Document
+from src.settings import settings
+from src.ws.endpoint_health import ambiente
+
+logger = logging.getLogger("dfe.ws")
+
+_RETRY_FAILED_SEC = 300
+_ZEEP_SETTINGS = Settings(strict=False, xml_huge_tree=True)
+
+class _Doc:
+    __slots__ = ("document", "loaded_at", "refreshing")
+
+    def __init__(self, document: Optional[Document]):
+        self.document = document
+        self.loaded_at = time.monotonic()
+        self.refreshing = False
+
+# (ambiente, wsdl remoto) -> documento parseado (ou None: falha recente)
+_docs: dict[tuple[str, str], _Doc] = {}
+_lock = threading.Lock()
+_sqlite_cache: Optional[SqliteCache] = None
+
+def _wsdl() -> str:
+    return settings.AN_WSDL_PRODUCAO if settings.NFE_AMBIENTE.upper().startswith("PROD") else settings.AN_WSDL_HOMOLOG
+
+def _local_wsdl() -> str:
+    path = settings.AN_WSDL_LOCAL_PATH or os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "wsdl", "NFeDistribuicaoDFe.wsdl")
+    return os.path.abspath(path)
+
+def _persistent_cache() -> Optional[SqliteCache]:
+    global _sqlite_cache
+    if _sqlite_cache is None and settings.DFE_WSDL_CACHE_PATH:
+        os.makedirs(os.path.dirname(os.path.abspath(settings.DFE_WSDL_CACHE_PATH)), exist_ok=True)
+        _sqlite_cache = SqliteCache(path=settings.DFE_WSDL_CACHE_PATH, timeout=settings.DFE_WSDL_TTL_SEC)
+    return _sqlite_cache
+
+def _load(session) -> Optional[Document]:
+    """Parseia o WSDL remoto (bytes via SqliteCache quando disponíveis) ou o fallback local."""
+    remote = _wsdl()
+    transport = Transport(session=session, timeout=45, cache=_persistent_cache())
+    try:
+        return Document(remote, transport, settings=_ZEEP_SETTINGS)
+    except Exception as e:
+        local = _local_wsdl()
+        if settings.DFE_DEBUG:
+            logger.warning(f"Falha ao carregar WSDL remoto ({remote}): {e}. Tentando fallback local: {local}")
+        if os.path.exists(local):
+            try:
+                return Document(local, transport, settings=_ZEEP_SETTINGS)
+            except Exception as e2:
+                logger.warning(f"Falha ao carregar WSDL local ({local}): {e2}")
+        return None
+
+def _refresh(key: tuple[str, str], session):
+    document = _load(session)
+    with _lock:
+        entry = _docs.get(key)
+        if document is not None or entry is None or entry.document is None:
+            _docs[key] = _Doc(document)
+        else:
+            # mantém o documento antigo e tenta de novo no próximo TTL
+            entry.loaded_at = time.monotonic()
+            entry.refreshing = False
+
+def _document(session) -> Optional[Document]:
+    key = (ambiente(), _wsdl() or "")
+    now = time.monotonic()
+    with _lock:
+        entry = _docs.get(key)
+        if entry is not None:
+            age = now - entry.loaded_at
+            if entry.document is None:
+                if age < _RETRY_FAILED_SEC:
+                    return None
+            else:
+                if age > settings.DFE_WSDL_TTL_SEC and not entry.refreshing:
+                    entry.refreshing = True
+                    threading.Thread(target=_refresh, args=(key, session), name="dfe-wsdl-refresh", daemon=True).start()
+                return entry.document
+    # primeira carga (ou nova tentativa após falha): síncrona
+    _refresh(key, session)
+    with _lock:
+        return _docs[key].document
+
+def get_client(session) -> Optional[Client]:
+    """Client zeep sobre o WSDL em cache, com transporte na sessão mTLS dada; None se não houver WSDL."""
+    document = _document(session)
+    if document is None:
+        return None
+    cached = getattr(session, "_dfe_zeep", None)
+    if cached is not None and cached[0] is document:
+        return cached[1]
+    client = Client(document, transport=Transport(session=session, timeout=45), settings=_ZEEP_SETTINGS)
+    session._dfe_zeep = (document, client)
+    return client
+
+def invalidate():
+    """Descarta os documentos em memória (o SqliteCache em disco expira por TTL)."""
+    with _lock:
+        _docs.clear()